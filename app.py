@@ -2,14 +2,17 @@
 
 import argparse
 import os,traceback
-import hashlib
 from flask_cors import CORS
-from flask import Flask, request, render_template, jsonify, send_from_directory, send_file
+from flask import Flask, Response, request, render_template, jsonify, send_from_directory, \
+    stream_with_context
 from multi_speaker.synthesizer import Synthesizer
 from hparams import hparams
-from pydub import silence, AudioSegment
 import tensorflow as tf
-from tacotron.utils.text_kr import h2j, is_korean_text, normalize_number, split_to_jamo
+from tacotron.utils.text_kr import h2j, is_korean_text, normalize_number, split_to_jamo, split_sentences, split_clauses
+from datasets import audio
+from synthesis_cache import SynthesisCache, cache_key
+from synthesis_scheduler import BatchScheduler
+from synthesis_pool import SynthesisPool
 
 ROOT_PATH = "web"
 AUDIO_DIR = "audio"
@@ -19,6 +22,9 @@ base_path = os.path.dirname(os.path.realpath(__file__))
 static_path = os.path.join(base_path, 'web/static')
 
 global_config = None
+checkpoint_path = None
+cache = None
+scheduler = None
 synthesizer = Synthesizer()
 app = Flask(__name__, root_path=ROOT_PATH, static_url_path='')
 CORS(app)
@@ -35,6 +41,8 @@ def match_target_amplitude(sound, target_dBFS):
 
 
 def amplify(path):
+    from pydub import silence, AudioSegment
+
     sound = AudioSegment.from_file(path)
 
     nonsilent_ranges = silence.detect_nonsilent(
@@ -60,28 +68,54 @@ def amplify(path):
 
 
 def generate_audio_response(text, speaker_id):
-    global global_config
-
-    hashed_text = hashlib.md5(text.encode('utf-8')).hexdigest()
-
-    relative_dir_path = os.path.join(AUDIO_DIR, "{}.{}.wav".format(hashed_text, speaker_id))
-    real_path = os.path.join(ROOT_PATH, relative_dir_path)
-    os.makedirs(os.path.dirname(real_path), exist_ok=True)
-
-    try:
-        synthesizer.predict(text, real_path, speaker_id)
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify(success=False), 400
-
-    if os.path.exists(real_path):
-        return send_file(
-            relative_dir_path,
-            mimetype="audio/wav",
-            as_attachment=True,
-            attachment_filename=real_path)
+    key = cache_key(text, speaker_id, checkpoint_path, hparams)
+    data = cache.get(key)
+    if data is None:
+        try:
+            data = audio.to_wav_bytes(scheduler.synthesize(text, speaker_id), hparams.sample_rate)
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify(success=False), 400
+
+        cache.put(key, data)
+
+    return Response(data, mimetype="audio/wav",
+                    headers={'Content-Disposition': 'attachment; filename={}.wav'.format(key)})
+
+
+def normalize_text(text):
+    if is_korean_text(text):
+        text = normalize_number(text)
+        text = split_to_jamo(text, hparams.cleaners)
+    return text
+
+
+def split_chunks(text, max_chars=60):
+    '''Splits a text into sentences, and sentences longer than max_chars into clauses'''
+    return [clause for sentence in split_sentences(text) for clause in split_clauses(sentence, max_chars)]
+
+
+def stream_audio_response(text, speaker_id, fmt='wav'):
+    '''Synthesizes the text chunk by chunk and streams every chunk (16 bit PCM) as soon as it is ready'''
+    chunks = split_chunks(text)
+
+    def generate():
+        if fmt == 'wav':
+            yield audio.wav_header(hparams.sample_rate)
+        for chunk in chunks:
+            try:
+                wav = scheduler.synthesize(normalize_text(chunk), speaker_id)
+            except Exception:
+                # Headers are already sent, just end the stream
+                traceback.print_exc()
+                return
+            yield audio.to_pcm16(wav)
+
+    if fmt == 'wav':
+        mimetype = 'audio/wav'
     else:
-        return jsonify(success=False), 500
+        mimetype = 'audio/L16; rate={}; channels=1'.format(hparams.sample_rate)
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 
 @app.route('/')
@@ -93,17 +127,28 @@ def index():
 @app.route('/generate')
 def view_method():
     text = request.args.get('text')
-    if is_korean_text(text):
-        text = normalize_number(text)
-        text = split_to_jamo(text, hparams.cleaners)
     speaker_id = int(request.args.get('speaker_id'))
+    # stream=wav (or 1) streams a wav as chunks are synthesized, stream=pcm streams raw 16 bit PCM
+    stream = request.args.get('stream')
 
-    if text:
-        return generate_audio_response(text, speaker_id)
+    if text and stream:
+        return stream_audio_response(text, speaker_id, 'pcm' if stream == 'pcm' else 'wav')
+    elif text:
+        return generate_audio_response(normalize_text(text), speaker_id)
     else:
         return jsonify(success=True), 200
 
 
+@app.route('/cache')
+def cache_stats():
+    return jsonify(cache.stats())
+
+
+@app.route('/scheduler')
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+
 @app.route('/js/<path:path>')
 def send_js(path):
     return send_from_directory(
@@ -124,21 +169,54 @@ def send_audio(path):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--load_path', default='logs-MultiSpeaker/taco_pretrained/')
+    parser.add_argument('--load_path', default='logs-MultiSpeaker/taco_pretrained/',
+                        help='Checkpoint directory, or frozen graph (.pb) written by export.py')
     parser.add_argument('--num_speakers', default=2, type=int)
     parser.add_argument('--port', default=51000, type=int)
     parser.add_argument('--debug', default=False, type=bool)
+    parser.add_argument('--cache_dir', default=AUDIO_PATH, help='Directory of the synthesized audio cache')
+    parser.add_argument('--cache_memory_items', default=256, type=int, help='Number of audios cached in memory')
+    parser.add_argument('--cache_size_mb', default=1024, type=int, help='Max size of the audio cache directory')
+    parser.add_argument('--max_batch', default=8, type=int, help='Max number of requests synthesized together')
+    parser.add_argument('--max_wait_ms', default=50, type=int,
+                        help='Max time a request waits for others to be batched with')
+    parser.add_argument('--workers', default=0, type=int,
+                        help='Number of synthesis worker processes (0 = synthesize in the server process)')
+    parser.add_argument('--intra_op_threads', default=0, type=int, help='TF intra op threads per session (0 = all)')
+    parser.add_argument('--inter_op_threads', default=0, type=int, help='TF inter op threads per session (0 = all)')
+    parser.add_argument('--pin_cpus', action='store_true', help='Pin every worker process to its share of the cpus')
+    parser.add_argument('--hparams', default='',
+                        help='Hyperparameter overrides as a comma-separated list of name=value pairs')
     config = parser.parse_args()
+    hparams.parse(config.hparams)
+
+    cache = SynthesisCache(config.cache_dir, config.cache_memory_items, config.cache_size_mb * 1024 * 1024)
 
     if os.path.exists(config.load_path):
         checkpoint = config.load_path
-        try:
-            checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
-        except AttributeError:
-            raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
+        if checkpoint.endswith('.pb'):
+            checkpoint_path = checkpoint
+        else:
+            try:
+                checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
+            except AttributeError:
+                raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
 
         global_config = config
-        synthesizer.load(checkpoint_path, hparams)
+        if config.workers > 0:
+            # Sessions live in worker processes, requests go to the least loaded one
+            scheduler = SynthesisPool(config.workers, checkpoint_path, config.hparams, config.intra_op_threads,
+                                      config.inter_op_threads, config.pin_cpus, config.max_batch,
+                                      config.max_wait_ms / 1000)
+        else:
+            session_config = tf.ConfigProto(intra_op_parallelism_threads=config.intra_op_threads,
+                                            inter_op_parallelism_threads=config.inter_op_threads)
+            if checkpoint_path.endswith('.pb'):
+                synthesizer.load_frozen(checkpoint_path, hparams, session_config=session_config)
+            else:
+                synthesizer.load(checkpoint_path, hparams, session_config=session_config)
+            # Concurrent requests are synthesized together, by a single thread using the session
+            scheduler = BatchScheduler(synthesizer.synthesize_wav_batch, config.max_batch, config.max_wait_ms / 1000)
     else:
         print(" [!] load_path not found: {}".format(config.load_path))
 
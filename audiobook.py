@@ -1,14 +1,21 @@
 import argparse
+import hashlib
+import io
+import json
+import shutil
 from hparams import hparams, hparams_debug_string
 import tensorflow as tf
 from infolog import log
 from multi_speaker.synthesizer import Synthesizer
 import os
-import nltk
-from konlpy.tag import Kkma
+import wave
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tqdm import tqdm
 import numpy as np
 from datasets import audio
+from synthesis_cache import SynthesisCache, cache_key
+from synthesis_pool import SynthesisPool
+from tacotron.utils.text_kr import is_korean_text, iter_sentences, normalize_number, split_to_jamo
 
 
 def generate_fast(model, text, speaker_id, play=True):
@@ -31,6 +38,18 @@ def change_file_ext(file, new_ext):
     return '.'.join(parts)
 
 
+def split_sentences(f, lang, kkma=False):
+    """Sentences of an open text file. Korean is segmented by the rule based text_kr.iter_sentences (streamed)
+    unless kkma is set: konlpy (which starts a JVM) and nltk are only imported when used"""
+    if lang == 'kr':
+        if not kkma:
+            return list(iter_sentences(f))
+        from konlpy.tag import Kkma
+        return Kkma().sentences(f.read())
+    import nltk
+    return nltk.sent_tokenize(f.read())
+
+
 def read(args, hparams, checkpoint_path):
     log(hparams_debug_string())
     if not os.path.exists(args.book):
@@ -41,12 +60,7 @@ def read(args, hparams, checkpoint_path):
     synth.load(checkpoint_path, hparams)
 
     with open_file(args.book) as f:
-        text = f.read()
-        if args.lang == 'kr':
-            kkma = Kkma()
-            sents = kkma.sentences(text)
-        else:
-            sents = nltk.sent_tokenize(text)
+        sents = split_sentences(f, args.lang, args.kkma)
 
         for i, line in enumerate(sents):
             try:
@@ -65,33 +79,176 @@ def publish(args, hparams, checkpoint_path):
         raise ValueError('{}: {}'.format('No such file or directory', args.book))
 
     speaker_id = args.speaker_id
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams)
+    synth = None
+    # Audio of every sentence, addressed by text, speaker, checkpoint and audio hparams: a re-publish only
+    # synthesizes the sentences that changed
+    cache = SynthesisCache(args.cache_dir or change_file_ext(args.book, '.cache'), max_memory_items=0,
+                           max_disk_bytes=args.cache_size_mb * 1024 * 1024)
 
     with open_file(args.book) as f:
-        text = f.read()
-        if args.lang == 'kr':
-            kkma = Kkma()
-            sents = kkma.sentences(text)
-        else:
-            sents = nltk.sent_tokenize(text)
+        sents = [line.strip() for line in split_sentences(f, args.lang, args.kkma)]
+    sents = [text for text in sents if text]
+
+    save_path = change_file_ext(args.book, '.wav')
+    silence = _silence(hparams)
+
+    # Every sentence is vocoded and appended to the wav file by a worker thread while the next one is decoded,
+    # so memory does not grow with the book length (sentences are peak normalized one by one)
+    with wave.open(save_path, 'wb') as wav_file, ThreadPoolExecutor(max_workers=1) as executor:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(hparams.sample_rate)
+
+        def vocode(i, key, mels):
+            data = audio.to_wav_bytes(audio.inv_mel_spectrogram(mels.T, hparams), hparams.sample_rate)
+            cache.put(key, data)
+            append(i, data)
 
-        full_mels = None
-        silence = np.full((100, hparams.num_mels), hparams.min_level_db, np.float32)
-        for i, line in enumerate(tqdm(sents)):
-            text = line.strip()
-            if text:
+        def append(i, data):
+            with wave.open(io.BytesIO(data), 'rb') as sentence:
+                pcm = sentence.readframes(sentence.getnframes())
+            wav_file.writeframes(silence + pcm if i > 0 else pcm)
+
+        reused = 0
+        pending = None
+        for i, text in enumerate(tqdm(sents)):
+            key = cache_key(text, speaker_id, checkpoint_path, hparams)
+            data = cache.get(key)
+            if data is None:
+                if synth is None:
+                    synth = Synthesizer()
+                    synth.load(checkpoint_path, hparams)
                 mels = generate_fast(synth, text, speaker_id, play=False)
-                if i > 0:
-                    full_mels = np.concatenate((full_mels, silence), axis=0)  # padding silence between sents
-                    full_mels = np.concatenate((full_mels, mels), axis=0)
+            else:
+                reused += 1
+
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(vocode, i, key, mels) if data is None else executor.submit(append, i, data)
+        if pending is not None:
+            pending.result()
+
+    log('saved to {} ({} sentences reused, {} regenerated)'.format(save_path, reused, len(sents) - reused))
+
+
+def _silence(hparams):
+    # Padding silence between sents (100 frames), 16 bit PCM
+    return np.zeros(100 * audio.get_hop_size(hparams), np.int16).tobytes()
+
+
+def _write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _unit_path(job_dir, index):
+    return os.path.join(job_dir, 'units', '{:06d}.wav'.format(index))
+
+
+def _normalize(text, hparams):
+    if is_korean_text(text):
+        text = normalize_number(text)
+        text = split_to_jamo(text, hparams.cleaners)
+    return text
+
+
+def load_job(args, hparams, checkpoint_path, job_dir):
+    """Returns the manifest of the job of args.book, created (sentence split) on first run
+
+    A job whose book, checkpoint, speaker or audio hparams changed starts over.
+    """
+    with open_file(args.book) as f:
+        text = f.read()
+    book_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    # The units depend on the sentence splitter as well
+    config = cache_key([book_hash, args.lang, args.kkma], args.speaker_id, checkpoint_path, hparams)
+
+    manifest_path = os.path.join(job_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf8') as f:
+            manifest = json.load(f)
+        if manifest['config'] == config:
+            return manifest
+        log('Job settings changed, restarting {}'.format(job_dir))
+        shutil.rmtree(os.path.join(job_dir, 'units'), ignore_errors=True)
+
+    os.makedirs(os.path.join(job_dir, 'units'), exist_ok=True)
+    manifest = {
+        'book': args.book,
+        'checkpoint': checkpoint_path,
+        'speaker_id': args.speaker_id,
+        'config': config,
+        'units': [sent.strip() for sent in split_sentences(io.StringIO(text), args.lang, args.kkma) if sent.strip()],
+    }
+    _write_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    return manifest
+
+
+def run_job(args, hparams, checkpoint_path):
+    """Synthesizes a book with a pool of worker processes, one sentence (unit) per request
+
+    Every finished unit is written to <job_dir>/units, so an interrupted or failed job resumes from the
+    units left. The book is assembled in order once all units are done.
+    """
+    log(hparams_debug_string())
+    if not os.path.exists(args.book):
+        raise ValueError('{}: {}'.format('No such file or directory', args.book))
+
+    job_dir = args.job_dir or change_file_ext(args.book, '.job')
+    manifest = load_job(args, hparams, checkpoint_path, job_dir)
+    units = manifest['units']
+    todo = [i for i in range(len(units)) if not os.path.exists(_unit_path(job_dir, i))]
+    log('{}: {} units, {} left'.format(job_dir, len(units), len(todo)))
+
+    if todo:
+        pool = SynthesisPool(args.workers, checkpoint_path, max_batch=args.max_batch)
+        # A bounded window of units is in flight: a finished unit is dropped once written, so memory does not
+        # grow with the book length
+        window = args.workers * args.max_batch * 2
+        pending = {}
+        failed = 0
+        progress = tqdm(total=len(todo))
+
+        def write_finished():
+            nonlocal failed
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    wav = future.result()
+                except Exception as e:
+                    log('unit {} failed: {}'.format(i, e))
+                    failed += 1
                 else:
-                    full_mels = mels
+                    _write_atomic(_unit_path(job_dir, i), audio.to_wav_bytes(wav, hparams.sample_rate))
+                progress.update(1)
+
+        for i in todo:
+            if len(pending) >= window:
+                write_finished()
+            pending[pool.submit(_normalize(units[i], hparams), args.speaker_id)] = i
+        while pending:
+            write_finished()
+        progress.close()
 
-        save_path = change_file_ext(args.book, '.wav')
-        log('saving to wav file...')
-        wav = audio.inv_mel_spectrogram(full_mels.T, hparams)
-        audio.save_wav(wav, save_path, sr=hparams.sample_rate)
+        if failed:
+            raise RuntimeError('{} units failed, run the job again to resume'.format(failed))
+
+    save_path = change_file_ext(args.book, '.wav')
+    silence = _silence(hparams)
+    with wave.open(save_path + '.tmp', 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(hparams.sample_rate)
+        for i in range(len(units)):
+            with wave.open(_unit_path(job_dir, i), 'rb') as unit:
+                if i > 0:
+                    wav_file.writeframes(silence)
+                wav_file.writeframes(unit.readframes(unit.getnframes()))
+    os.replace(save_path + '.tmp', save_path)
+    log('saved to {}'.format(save_path))
 
 
 def prepare_run(args):
@@ -103,7 +260,7 @@ def prepare_run(args):
 
 
 def main():
-    accepted_modes = ['read', 'publish']
+    accepted_modes = ['read', 'publish', 'job']
     parser = argparse.ArgumentParser()
     parser.add_argument('--base_dir', default='D:/voice/MultiSpeaker')
     parser.add_argument('--checkpoint', default='pretrained/', help='Path to model checkpoint')
@@ -113,6 +270,14 @@ def main():
                         help='Text file contains list of texts to be synthesized')
     parser.add_argument('--speaker_id', default=2, type=int)
     parser.add_argument('--lang', default='kr')
+    parser.add_argument('--kkma', action='store_true',
+                        help='Split korean sentences with konlpy Kkma (slower) instead of the rule based splitter')
+    parser.add_argument('--workers', default=2, type=int, help='Number of synthesis worker processes (job mode)')
+    parser.add_argument('--max_batch', default=8, type=int, help='Max number of sentences a worker synthesizes together')
+    parser.add_argument('--cache_dir', default=None,
+                        help='Directory of the sentence audio cache (publish mode), defaults to <book>.cache')
+    parser.add_argument('--cache_size_mb', default=4096, type=int, help='Max size of the sentence audio cache')
+    parser.add_argument('--job_dir', default=None, help='Directory of the job state (job mode), defaults to <book>.job')
     args = parser.parse_args()
 
     accepted_models = ['Tacotron', 'WaveNet', 'Both', 'Tacotron-2', 'MultiSpeaker']
@@ -146,6 +311,8 @@ def main():
         read(args, hparams, checkpoint_path)
     elif args.mode == 'publish':
         publish(args, hparams, checkpoint_path)
+    elif args.mode == 'job':
+        run_job(args, hparams, checkpoint_path)
 
 
 if __name__ == '__main__':
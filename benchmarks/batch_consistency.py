@@ -0,0 +1,92 @@
+"""Check that a sentence synthesized in a batch comes out as when it is synthesized alone, run from the repository
+root with a trained checkpoint:
+
+    python benchmarks/batch_consistency.py --checkpoint logs-Tacotron/taco_pretrained/ [--text sentences.txt]
+        [--model MultiSpeaker --speaker_ids 0 2]
+
+Without --text, hparams.sentences are used. MultiSpeaker sentences take the --speaker_ids in turn, so the batch
+mixes speakers. The prenet dropout (also active at synthesis) is turned off so both runs are deterministic. Exits with an error if a mel spectrogram length differs or a value differs by more than
+--tolerance.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from hparams import hparams
+from tacotron.utils.text_kr import is_korean_text, normalize_number, split_to_jamo
+
+
+def normalize(text):
+    if is_korean_text(text):
+        text = split_to_jamo(normalize_number(text), hparams.cleaners)
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True, help='Checkpoint file or directory')
+    parser.add_argument('--text', default=None, help='Text file, one sentence per line (utf-8)')
+    parser.add_argument('--model', default='Tacotron', help='Tacotron or MultiSpeaker')
+    parser.add_argument('--speaker_ids', nargs='+', default=[0], type=int, help='Speakers (MultiSpeaker)')
+    parser.add_argument('--hparams', default='', help='Hyperparameter overrides as a comma-separated list of name=value')
+    parser.add_argument('--tolerance', default=1e-3, type=float, help='Max absolute difference of the mel values')
+    args = parser.parse_args()
+
+    hparams.parse(args.hparams)
+    hparams.set_hparam('tacotron_dropout_rate', 0.)
+    checkpoint = args.checkpoint
+    if os.path.isdir(checkpoint):
+        checkpoint = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
+
+    if args.text:
+        with open(args.text, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = hparams.sentences
+    texts = [normalize(text) for text in texts]
+
+    if args.model == 'MultiSpeaker':
+        from multi_speaker.synthesizer import Synthesizer
+    else:
+        from tacotron.synthesizer import Synthesizer
+    synth = Synthesizer()
+    synth.load(checkpoint, hparams)
+    speaker_ids = [args.speaker_ids[i % len(args.speaker_ids)] for i in range(len(texts))]
+
+    def synthesize_batch(indices):
+        batch = [texts[i] for i in indices]
+        if args.model == 'MultiSpeaker':
+            return synth.synthesize_batch(batch, [speaker_ids[i] for i in indices])
+        return synth.synthesize_batch(batch)
+
+    start = time.time()
+    alone = [synthesize_batch([i])[0] for i in range(len(texts))]
+    alone_time = time.time() - start
+    start = time.time()
+    batched = synthesize_batch(range(len(texts)))
+    batch_time = time.time() - start
+    print('{} sentences: {:.2f} sec alone, {:.2f} sec in one batch'.format(len(texts), alone_time, batch_time))
+
+    failures = 0
+    for i, (mel, batch_mel) in enumerate(zip(alone, batched)):
+        if mel.shape != batch_mel.shape:
+            print('sentence {}: {} frames alone, {} in the batch'.format(i, len(mel), len(batch_mel)))
+            failures += 1
+            continue
+        difference = np.abs(mel - batch_mel).max()
+        if difference > args.tolerance:
+            print('sentence {}: max absolute difference {:.2e}'.format(i, difference))
+            failures += 1
+
+    print('{} of {} sentences differ'.format(failures, len(texts)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Load time, memory and lookup speed of the CMUDict text parser against its binary index, run from the repository
+root with a CMUDict text file (e.g. cmudict-0.7b):
+
+    python benchmarks/cmudict_index.py --cmudict cmudict-0.7b [--words 100000]
+
+The index is written to <cmudict>.idx. Exits with an error if both disagree on any word.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from tacotron.utils import cmudict
+
+
+def loaded(load):
+    tracemalloc.start()
+    start = time.time()
+    dictionary = load()
+    elapsed = time.time() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return dictionary, elapsed, memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cmudict', required=True, help='CMUDict text file')
+    parser.add_argument('--words', default=100000, type=int, help='Number of lookups to time')
+    args = parser.parse_args()
+
+    index_path = args.cmudict + '.idx'
+    start = time.time()
+    cmudict.build_index(args.cmudict, index_path)
+    print('index built in {:.3f} sec, {:.1f} MB'.format(time.time() - start, os.path.getsize(index_path) / 2 ** 20))
+
+    text, text_time, text_memory = loaded(lambda: cmudict.CMUDict(args.cmudict))
+    index, index_time, index_memory = loaded(lambda: cmudict.CMUDictIndex(index_path))
+    print('text:  {} words, loaded in {:.3f} sec, {:.1f} MB'.format(len(text), text_time, text_memory / 2 ** 20))
+    print('index: {} words, loaded in {:.3f} sec, {:.1f} MB'.format(len(index), index_time, index_memory / 2 ** 20))
+
+    rng = random.Random(0)
+    words = [rng.choice(list(text._entries)).lower() for _ in range(args.words)] + ['notaword'] * 10
+    mismatches = [word for word in words if text.lookup(word) != index.lookup(word)]
+    for dictionary, name in [(text, 'text'), (index, 'index')]:
+        start = time.time()
+        for word in words:
+            dictionary.lookup(word)
+        print('{} lookup: {:.1f} us/word'.format(name, (time.time() - start) / len(words) * 1e6))
+
+    sentence = ' '.join(words[:20])
+    for name, repeat in [('to_arpabet (first)', 1), ('to_arpabet (memoized)', 1000)]:
+        start = time.time()
+        for _ in range(repeat):
+            index.to_arpabet(sentence)
+        print('{}: {:.1f} us/sentence of 20 words'.format(name, (time.time() - start) / repeat * 1e6))
+
+    print('{} words compared, {} mismatches'.format(len(words), len(mismatches)))
+    if mismatches:
+        print('mismatches: {}'.format(mismatches[:10]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
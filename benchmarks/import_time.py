@@ -0,0 +1,78 @@
+"""Import time report of the entry point modules (python -X importtime), run from the repository root:
+
+    python benchmarks/import_time.py [--modules app synthesize] [--top 15] [--budget_ms 0]
+
+Every module is imported in a fresh interpreter. Exits with an error if a module takes more than --budget_ms
+or imports one of the --lazy modules (which must only be loaded on first use).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+_default_modules = ['tacotron.utils.plot', 'tacotron.synthesizer', 'multi_speaker.synthesizer', 'audiobook',
+                    'synthesize', 'app']
+_default_lazy = ['matplotlib', 'pyaudio', 'konlpy', 'nltk', 'pydub', 'librosa.display']
+
+
+def import_time(module, lazy):
+    """Returns the import time (us) of module, the cumulative times of the modules it imports directly and
+    the lazy modules that were imported"""
+    code = 'import sys, {0}; print(",".join(m for m in {1!r} if m in sys.modules))'.format(module, lazy)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=base_dir,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError('import {} failed:\n{}'.format(module, process.stderr[-2000:]))
+
+    # import time: self [us] | cumulative | imported package, a module is listed after the (indented) ones it imports
+    entries = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        entries.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative)))
+
+    total, children = 0, {}
+    for i, (depth, name, cumulative) in enumerate(entries):
+        if depth == 1 and name == module:
+            total = cumulative
+            for child_depth, child, child_cumulative in reversed(entries[:i]):
+                if child_depth == 1:
+                    break
+                if child_depth == 3:
+                    children[child] = child_cumulative
+    imported = [name for name in process.stdout.strip().split(',') if name]
+    return total, children, imported
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=_default_modules)
+    parser.add_argument('--lazy', nargs='+', default=_default_lazy,
+                        help='Modules that must not be imported by the entry points')
+    parser.add_argument('--top', default=15, type=int, help='Number of slowest imports to report per module')
+    parser.add_argument('--budget_ms', default=0, type=float, help='Max import time of a module (0 = no limit)')
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        total, children, imported = import_time(module, args.lazy)
+        total /= 1000
+        print('{}: {:.1f} ms'.format(module, total))
+        for name, t in sorted(children.items(), key=lambda x: -x[1])[:args.top]:
+            print('    {:>10.1f} ms  {}'.format(t / 1000, name))
+
+        if imported:
+            failures.append('{} eagerly imports {}'.format(module, ', '.join(imported)))
+        if args.budget_ms and total > args.budget_ms:
+            failures.append('{} takes {:.1f} ms to import (budget {:.1f} ms)'.format(module, total, args.budget_ms))
+
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Throughput of text_kr.h2j / j2h (translation table, single regex pass) against the former per character
+implementations (kept below as reference), and check that both give the same output. Run from the repository root:
+
+    python benchmarks/korean_jamo.py [--text corpus.txt] [--repeat 2000]
+
+Without --text, the sentences of text_kr's examples repeated --repeat times are used.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from tacotron.utils.text_kr import h2j, j2h, h2j_batch, j2h_batch, BASE_CODE, CHOSUNG, JUNGSUNG, \
+    CHOSUNG_LIST, JUNGSUNG_LIST, JONGSUNG_LIST, HANGUEL_LIST, SYMBOLS
+
+_sample = [
+    '대한민국 만세',
+    '올해는 이천십칠년 이다.',
+    'LA에는 많은 한국인들이 살고 있다.',
+    '면적은 대한민국 국토의 영쩜 육%이지만, 약 구백팔십만 명이 살고 있어서 인구밀도가 높다.',
+    '시청 소재지는 중구이며, 이십오개의 자치구로 이루어져 있다.',
+    '그녀의 딸은 올해 여덟살이다. 정말요? 네!',
+]
+
+
+def _reference_merge_j(jamos):
+    if len(jamos) == 3:
+        code = CHOSUNG_LIST.index(jamos[0]) * CHOSUNG + \
+               JUNGSUNG_LIST.index(jamos[1]) * JUNGSUNG + \
+               JONGSUNG_LIST.index(jamos[2])
+    else:
+        code = CHOSUNG_LIST.index(jamos[0]) * CHOSUNG + \
+               JUNGSUNG_LIST.index(jamos[1]) * JUNGSUNG
+    code += BASE_CODE
+    c = chr(code)
+    return c + ' ' if jamos[-1] == ' ' else c
+
+
+def reference_h2j(text):
+    result = list()
+    for keyword in text:
+        # 한글 여부 check 후 분리
+        if re.match('.*[ㄱ-ㅎㅏ-ㅣ가-힣]+.*', keyword) is not None:
+            char_code = ord(keyword) - BASE_CODE
+            char1 = int(char_code / CHOSUNG)
+            result.append(CHOSUNG_LIST[char1])
+            char2 = int((char_code - (CHOSUNG * char1)) / JUNGSUNG)
+            result.append(JUNGSUNG_LIST[char2])
+            char3 = int((char_code - (CHOSUNG * char1) - (JUNGSUNG * char2)))
+            # 종성이 있는 경우
+            if char3 > 0:
+                result.append(JONGSUNG_LIST[char3])
+        else:
+            result.append(keyword)
+    # result
+    return "".join(result)
+
+
+def reference_j2h(text):
+    result = list()
+    idx = 0
+    while idx < len(text):
+        c = text[idx]
+        if c in HANGUEL_LIST:
+            if c in CHOSUNG_LIST:
+                if idx + 1 < len(text) and text[idx + 1] in JUNGSUNG_LIST:
+                    if idx + 2 < len(text) and text[idx + 2] in JONGSUNG_LIST:
+                        if (idx + 3 < len(text) and text[idx + 3] in CHOSUNG_LIST + SYMBOLS) or (idx +3 == len(text)):
+                            result.append(_reference_merge_j(text[idx: idx + 3]))
+                            idx += 2
+                        else:
+                            result.append(_reference_merge_j(text[idx: idx + 2]))
+                            idx += 1
+                    else:
+                        result.append(_reference_merge_j(text[idx: idx + 2]))
+                        idx += 1
+        else:
+            result.append(c)
+        idx += 1
+
+    return ''.join(result)
+
+
+def timed(fn, texts):
+    start = time.time()
+    outputs = [fn(text) for text in texts]
+    return outputs, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--text', default=None, help='Text file, one sentence per line (utf-8)')
+    parser.add_argument('--repeat', default=2000, type=int, help='Repetitions of the sample (without --text)')
+    args = parser.parse_args()
+
+    if args.text:
+        with open(args.text, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = _sample * args.repeat
+    chars = sum(len(text) for text in texts)
+
+    jamos = None
+    failed = False
+    functions = [('h2j', h2j, reference_h2j, h2j_batch), ('j2h', j2h, reference_j2h, j2h_batch)]
+    for name, fn, reference, batch in functions:
+        inputs = texts if name == 'h2j' else jamos
+        expected, reference_time = timed(reference, inputs)
+        outputs, new_time = timed(fn, inputs)
+        start = time.time()
+        batch_outputs = batch(inputs)
+        batch_time = time.time() - start
+        mismatches = sum(a != b for a, b in zip(expected, outputs))
+        mismatches += sum(a != b for a, b in zip(expected, batch_outputs))
+        print('{}: reference {:.3f} sec, new {:.3f} sec (x{:.1f}), batch {:.3f} sec, {:.0f} chars/sec, '
+              '{} mismatches'.format(name, reference_time, new_time, reference_time / max(new_time, 1e-9),
+                                     batch_time, chars / max(new_time, 1e-9), mismatches))
+        jamos = outputs
+        failed = failed or mismatches > 0
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
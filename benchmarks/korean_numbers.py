@@ -0,0 +1,190 @@
+"""Speed of the korean number normalization (text_kr.normalize_number) against the multi pass reference
+implementation it replaced, and check that both agree on a golden set and random texts, run from the repository
+root:
+
+    python benchmarks/korean_numbers.py [--text book.txt] [--lines 20000] [--fuzz 20000]
+
+Without --text, --lines random sample sentences are used. Exits with an error on any mismatch.
+"""
+import argparse
+import ast
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from tacotron.utils.text_kr import (normalize_number, normalize_with_dictionary, number_checker, count_checker,
+                                    unit_to_kor1, unit_to_kor2, count_to_kor1, count_tenth_dict, num_to_kor,
+                                    num_to_kor1, num_to_kor2, num_to_kor3)
+
+_golden = [
+    '대한민국 만세',
+    '올해는 2017년 이다.',
+    '그 친구는 05학번이다.',
+    'LA에는 많은 한국인들이 살고 있다.',
+    '2교대 3교대로 전환 되었지만~',
+    '면적은 대한민국 국토의 0.6%이지만, 약 980만 명이 살고 있어서 인구밀도가 높다.',
+    '동서 간의 거리는 36.78 km, 남북 간의 거리는 30.3 km이며, 넓이는 605.25 km²이다.',
+    '시청 소재지는 중구이며, 25개의 자치구로 이루어져 있다.',
+    '1986년 아시안 게임, 1988년 하계 올림픽, 2010년 서울 G20 정상회의를 개최한 국제적인 도시이다.',
+    '그녀의 딸은 올해 8살이다.',
+    '사과 12개와 배 1,000개, 사람 21명, 오후 3시 15분.',
+    '기온은 -3.5도에서 +12도까지, 체중 70kg, 키 175cm.',
+    '버전 1.2.3개, 2018.1.2명, 10,000,000원',
+    '0.5개 3.14 100 mmm cm kmm',
+]
+
+_templates = [
+    '{}년 {}월 {}일, 약 {}명이 모여 {}개의 안건을 논의했다.',
+    '거리는 {}.{} km이고 면적은 국토의 {}.{}%이지만, 인구는 {:,}명이다.',
+    '그녀의 딸은 올해 {}살이고, 사과 {}개와 배 {}개를 샀다.',
+    '가격은 {:,}원에서 {:,}원으로 올랐고, 기온은 -{}.{}도였다.',
+]
+
+
+# normalize_number and number_to_korean before they were rewritten: one pass per unit dictionary and per number
+# pattern, no memoization
+def reference_normalize_number(text):
+    text = normalize_with_dictionary(text, unit_to_kor1)
+    text = normalize_with_dictionary(text, unit_to_kor2)
+    text = re.sub(number_checker + count_checker, lambda x: reference_number_to_korean(x, True), text)
+    text = re.sub(number_checker, lambda x: reference_number_to_korean(x, False), text)
+    return text
+
+
+def reference_number_to_korean(num_str, is_count=False):
+    if is_count:
+        num_str, unit_str = num_str.group(1), num_str.group(2)
+    else:
+        num_str, unit_str = num_str.group(), ""
+
+    num_str = num_str.replace(',', '')
+    num = ast.literal_eval(num_str)
+
+    if num == 0:
+        return "영"
+
+    check_float = num_str.split('.')
+    if len(check_float) == 2:
+        digit_str, float_str = check_float
+    elif len(check_float) >= 3:
+        raise Exception(" [!] Wrong number format")
+    else:
+        digit_str, float_str = check_float[0], None
+
+    if is_count and float_str is not None:
+        raise Exception(" [!] `is_count` and float number does not fit each other")
+
+    digit = int(digit_str)
+
+    if digit_str.startswith("-"):
+        digit, digit_str = abs(digit), str(abs(digit))
+
+    kor = ""
+    size = len(str(digit))
+    tmp = []
+
+    for i, v in enumerate(digit_str, start=1):
+        v = int(v)
+
+        if v != 0:
+            if is_count:
+                tmp += count_to_kor1[v]
+            else:
+                tmp += num_to_kor1[v]
+
+            tmp += num_to_kor3[(size - i) % 4]
+
+        if (size - i) % 4 == 0 and len(tmp) != 0:
+            kor += "".join(tmp)
+            tmp = []
+            kor += num_to_kor2[int((size - i) / 4)]
+
+    if is_count:
+        if kor.startswith("한") and len(kor) > 1:
+            kor = kor[1:]
+
+        if any(word in kor for word in count_tenth_dict):
+            kor = re.sub(
+                '|'.join(count_tenth_dict.keys()),
+                lambda x: count_tenth_dict[x.group()], kor)
+
+    if not is_count and kor.startswith("일") and len(kor) > 1:
+        kor = kor[1:]
+
+    if float_str is not None:
+        kor += "쩜 "
+        kor += re.sub(r'\d', lambda x: num_to_kor[x.group()], float_str)
+
+    if num_str.startswith("+"):
+        kor = "플러스 " + kor
+    elif num_str.startswith("-"):
+        kor = "마이너스 " + kor
+
+    return kor + unit_str
+
+
+def outcome(normalize, text):
+    try:
+        return normalize(text)
+    except Exception as e:
+        return '{}: {}'.format(type(e).__name__, e)
+
+
+def random_text(rng):
+    pieces = ['0', '1', '5', '9', '10', '25', '1,000', '.', ',', '+', '-', ' ', '개', '명', '살', '시', '다발',
+              '사람', '년', '원', 'm', 'mm', 'cm', 'k', 'g', '%', '가', 'a']
+    return ''.join(rng.choice(pieces) for _ in range(rng.randint(1, 12)))
+
+
+def sample_lines(rng, count):
+    # A document whose numbers vary (years, dates, counts and amounts) as in a book
+    return [rng.choice(_templates).format(*[rng.choice([rng.randint(1, 31), rng.randint(1900, 2020),
+                                                       rng.randint(1, 99999999)]) for _ in range(5)])
+            for _ in range(count)]
+
+
+def timed(normalize, lines):
+    start = time.time()
+    for line in lines:
+        normalize(line)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--text', default=None, help='Text file to normalize line by line (utf-8)')
+    parser.add_argument('--lines', default=20000, type=int, help='Number of sample lines (without --text)')
+    parser.add_argument('--fuzz', default=20000, type=int, help='Number of random texts to compare')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    if args.text:
+        with open(args.text, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    else:
+        lines = sample_lines(rng, args.lines)
+    chars = sum(len(line) for line in lines)
+
+    reference = timed(reference_normalize_number, lines)
+    new = timed(normalize_number, lines)
+    print('reference: {:.3f} sec, {:.0f} chars/sec'.format(reference, chars / max(reference, 1e-9)))
+    print('normalize_number: {:.3f} sec, {:.0f} chars/sec, speedup x{:.2f}'.format(
+        new, chars / max(new, 1e-9), reference / max(new, 1e-9)))
+
+    # Compared after the timing, which starts with a cold number cache
+    texts = _golden + lines[:1000] + [random_text(rng) for _ in range(args.fuzz)]
+    mismatches = [text for text in texts
+                  if outcome(normalize_number, text) != outcome(reference_normalize_number, text)]
+    for text in mismatches[:10]:
+        print('mismatch: {!r}\n  new: {!r}\n  ref: {!r}'.format(
+            text, outcome(normalize_number, text), outcome(reference_normalize_number, text)), file=sys.stderr)
+    print('{} texts compared, {} mismatches'.format(len(texts), len(mismatches)))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Throughput of the rule based korean sentence splitter (text_kr.split_sentences), and its agreement with
+konlpy Kkma().sentences when konlpy is installed, run from the repository root:
+
+    python benchmarks/korean_sentences.py [--text book.txt] [--repeat 200] [--no_kkma]
+
+Without --text, a sample paragraph repeated --repeat times is used.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from tacotron.utils.text_kr import split_sentences
+
+_sample = '''옛날 옛적 깊은 산골에 홀어머니와 오누이가 살았다. 어머니는 고개 너머 부잣집에서 일을 하고 떡을 얻어 돌아오곤 했어요.
+하루는 고개를 넘는데 호랑이가 나타나 "떡 하나 주면 안 잡아먹지!"라고 말했다. 어머니는 떡을 하나 던져 주었지만, 호랑이는 고개마다 다시 나타났습니다.
+면적은 대한민국 국토의 0.6%이지만, 약 980만 명이 살고 있어서 인구밀도가 높다. 동서 간의 거리는 36.78 km이다
+그래서 어떻게 되었을까? 정말 궁금하죠! 이야기는 여기서 끝나지 않아요…
+오빠는 "무서워요." 라고 말했다. 누이는 “올라가자!” 하고 동아줄을 잡았다. 그때 우리 어머니
+께서 오셨다.
+
+1. 오누이는 하늘로 올라가 해와 달이 되었다. 2. 호랑이는 수수밭에 떨어졌다.
+'''
+
+
+def boundaries(sentences):
+    # Sentence ends as offsets in the text without whitespace, to compare splitters that normalize differently
+    ends, offset = set(), 0
+    for sentence in sentences:
+        offset += len(''.join(sentence.split()))
+        ends.add(offset)
+    return ends
+
+
+def timed(split, text):
+    start = time.time()
+    sentences = split(text)
+    return sentences, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--text', default=None, help='Text file to split (utf-8)')
+    parser.add_argument('--repeat', default=200, type=int, help='Repetitions of the sample text (without --text)')
+    parser.add_argument('--no_kkma', action='store_true', help='Skip the Kkma comparison')
+    args = parser.parse_args()
+
+    if args.text:
+        with open(args.text, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = _sample * args.repeat
+
+    sentences, elapsed = timed(split_sentences, text)
+    print('rules: {} sentences, {:.3f} sec, {:.0f} chars/sec'.format(
+        len(sentences), elapsed, len(text) / max(elapsed, 1e-9)))
+
+    if args.no_kkma:
+        return
+    try:
+        from konlpy.tag import Kkma
+    except ImportError:
+        print('konlpy is not installed, skipping the Kkma comparison')
+        return
+
+    start = time.time()
+    kkma = Kkma()
+    load_time = time.time() - start
+    kkma_sentences, kkma_elapsed = timed(kkma.sentences, text)
+    print('kkma: {} sentences, {:.3f} sec (+{:.3f} sec startup), {:.0f} chars/sec'.format(
+        len(kkma_sentences), kkma_elapsed, load_time, len(text) / max(kkma_elapsed, 1e-9)))
+
+    ours, theirs = boundaries(sentences), boundaries(kkma_sentences)
+    both = len(ours & theirs)
+    print('agreement: precision {:.3f}, recall {:.3f} (kkma boundaries as reference), speedup x{:.1f}'.format(
+        both / max(len(ours), 1), both / max(len(theirs), 1), kkma_elapsed / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
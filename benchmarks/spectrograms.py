@@ -0,0 +1,78 @@
+"""Preprocessing feature extraction throughput: melspectrogram + linearspectrogram (two STFTs, dense mel basis)
+against audio.spectrograms (one STFT, sparse mel basis, in place float32), run from the repository root:
+
+    python benchmarks/spectrograms.py [--wav_dir LJSpeech-1.1/wavs] [--utterances 100] [--seconds 6]
+
+Without --wav_dir, random signals of --seconds are used. Exits with an error if the features differ by more
+than --tolerance.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from datasets import audio
+from hparams import hparams
+
+
+_mel_basis = None
+
+
+def two_stfts(wav, hparams):
+    # Features as _process_utterance computed them before audio.spectrograms (dense mel basis, built once)
+    global _mel_basis
+    if _mel_basis is None:
+        _mel_basis = audio._build_mel_basis(hparams)
+    mel = audio._amp_to_db(np.dot(_mel_basis, np.abs(audio._stft(wav, hparams))), hparams) - hparams.ref_level_db
+    if hparams.signal_normalization:
+        mel = audio._normalize(mel, hparams)
+    return mel.astype(np.float32), audio.linearspectrogram(wav, hparams).astype(np.float32)
+
+
+def timed(extract, wavs):
+    start = time.time()
+    features = [extract(wav, hparams) for wav in wavs]
+    return features, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wav_dir', default=None, help='Directory of wav files to extract features from')
+    parser.add_argument('--utterances', default=100, type=int, help='Number of utterances')
+    parser.add_argument('--seconds', default=6., type=float, help='Length of the random signals (without --wav_dir)')
+    parser.add_argument('--tolerance', default=1e-3, type=float, help='Max absolute difference of the features')
+    args = parser.parse_args()
+
+    if args.wav_dir:
+        paths = sorted(glob.glob(os.path.join(args.wav_dir, '*.wav')))[:args.utterances]
+        wavs = [audio.load_wav(path, sr=hparams.sample_rate) for path in paths]
+    else:
+        rng = np.random.RandomState(0)
+        wavs = [(rng.randn(int(args.seconds * hparams.sample_rate)) * 0.1).astype(np.float32)
+                for _ in range(args.utterances)]
+    seconds = sum(len(wav) for wav in wavs) / hparams.sample_rate
+
+    # Warm up (mel basis and STFT setup)
+    audio.spectrograms(wavs[0], hparams)
+    two_stfts(wavs[0], hparams)
+
+    reference, reference_time = timed(two_stfts, wavs)
+    fused, fused_time = timed(audio.spectrograms, wavs)
+    print('{} utterances, {:.1f} sec of audio'.format(len(wavs), seconds))
+    print('two STFTs: {:.3f} sec, {:.1f} utterances/sec'.format(reference_time, len(wavs) / reference_time))
+    print('spectrograms: {:.3f} sec, {:.1f} utterances/sec, speedup x{:.2f}'.format(
+        fused_time, len(wavs) / fused_time, reference_time / fused_time))
+
+    difference = max(max(np.abs(mel - ref_mel).max(), np.abs(linear - ref_linear).max())
+                     for (mel, linear), (ref_mel, ref_linear) in zip(fused, reference))
+    print('max absolute difference: {:.2e}'.format(difference))
+    if difference > args.tolerance:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
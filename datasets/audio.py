@@ -1,7 +1,9 @@
 import librosa
 import librosa.filters
+import struct
+from collections import OrderedDict
 import numpy as np
-from scipy import signal
+from scipy import signal, sparse
 import tensorflow as tf
 from scipy.io import wavfile
 
@@ -11,9 +13,46 @@ def load_wav(path, sr):
 
 
 def save_wav(wav, path, sr):
-    wav *= 32767 / max(0.01, np.max(np.abs(wav)))
     # proposed by @dsmiller
-    wavfile.write(path, sr, wav.astype(np.int16))
+    wavfile.write(path, sr, to_int16(wav))
+
+
+def to_int16(wav):
+    '''Peak normalized 16 bit samples of a waveform (the input is left untouched)'''
+    return (wav * (32767 / max(0.01, np.max(np.abs(wav))))).astype(np.int16)
+
+
+def to_pcm16(wav):
+    '''Peak normalizes a waveform (as save_wav) and returns its 16 bit little endian PCM bytes'''
+    return to_int16(wav).astype('<i2').tobytes()
+
+
+def to_wav_bytes(wav, sr):
+    '''Content of the wav file save_wav would write'''
+    pcm = to_pcm16(wav)
+    return wav_header(sr, len(pcm) // 2) + pcm
+
+
+def play_wav(wav, sr, chunk=512):
+    '''Plays a waveform on the default output device'''
+    import pyaudio
+    pcm = to_pcm16(wav)
+    p = pyaudio.PyAudio()
+    stream = p.open(format=pyaudio.paInt16, channels=1, rate=sr, output=True)
+    for i in range(0, len(pcm), chunk * 2):
+        stream.write(pcm[i:i + chunk * 2])
+
+    stream.stop_stream()
+    stream.close()
+    p.terminate()
+
+
+def wav_header(sr, num_samples=None):
+    '''RIFF header of a mono 16 bit PCM wav. Without num_samples, sizes are left at their max value so the
+    header can start a stream whose length is not known yet'''
+    data_size = 0xFFFFFFFF - 36 if num_samples is None else num_samples * 2
+    return (b'RIFF' + struct.pack('<I', data_size + 36) + b'WAVEfmt ' +
+            struct.pack('<IHHIIHH', 16, 1, 1, sr, sr * 2, 2, 16) + b'data' + struct.pack('<I', data_size))
 
 
 # From https://github.com/r9y9/wavenet_vocoder/blob/master/audio.py
@@ -67,58 +106,224 @@ def melspectrogram(wav, hparams):
     return S
 
 
-def inv_linear_spectrogram(linear_spectrogram, hparams):
-    '''Converts linear spectrogram to waveform using librosa'''
-    if hparams.signal_normalization:
-        D = _denormalize(linear_spectrogram, hparams)
-    else:
-        D = linear_spectrogram
+def spectrograms(wav, hparams):
+    '''Mel and linear spectrograms (float32) of a waveform, as melspectrogram and linearspectrogram but from a
+    single STFT, with the mel filterbank applied as a sparse matrix and the dB conversion and normalization done
+    in place'''
+    S = np.abs(_stft(wav, hparams)).astype(np.float32, copy=False)
+    mel = get_vocoder(hparams).mel_basis.dot(S)
+    return _spectrogram_inplace(mel, hparams), _spectrogram_inplace(S, hparams)
 
-    S = _db_to_amp(D + hparams.ref_level_db)  # Convert back to linear
 
-    if hparams.use_lws:
-        processor = _lws_processor(hparams)
-        D = processor.run_lws(S.astype(np.float64).T ** hparams.power)
-        y = processor.istft(D).astype(np.float32)
-        return y
-    else:
-        return _griffin_lim(S ** hparams.power, hparams)
+def inv_linear_spectrogram(linear_spectrogram, hparams):
+    '''Converts linear spectrogram to waveform using librosa'''
+    return get_vocoder(hparams).inv_linear_spectrogram(linear_spectrogram)
 
 
 def inv_mel_spectrogram(mel_spectrogram, hparams):
     '''Converts mel spectrogram to waveform using librosa'''
-    if hparams.signal_normalization:
-        D = _denormalize(mel_spectrogram, hparams)
-    else:
-        D = mel_spectrogram
+    return get_vocoder(hparams).inv_mel_spectrogram(mel_spectrogram)
 
-    S = _mel_to_linear(_db_to_amp(D + hparams.ref_level_db), hparams)  # Convert back to linear
 
-    if hparams.use_lws:
-        processor = _lws_processor(hparams)
-        D = processor.run_lws(S.astype(np.float64).T ** hparams.power)
-        y = processor.istft(D).astype(np.float32)
-        return y
-    else:
-        return _griffin_lim(S ** hparams.power, hparams)
+def inv_mel_spectrograms(mel_spectrograms, hparams):
+    '''Converts a list of mel spectrograms [num_mels, frames] to waveforms, Griffin-Lim runs on all of them at once'''
+    return get_vocoder(hparams).inv_mel_spectrograms(mel_spectrograms)
 
 
-def _lws_processor(hparams):
-    import lws
-    return lws.lws(hparams.n_fft, get_hop_size(hparams), fftsize=hparams.win_size, mode="speech")
-
+def inv_mel_spectrogram_tensorflow(mel_spectrograms, hparams):
+    '''Builds the in graph conversion of mel spectrograms [batch, frames, num_mels] to waveforms [batch, samples]
 
-def _griffin_lim(S, hparams):
-    '''librosa implementation of Griffin-Lim
-    Based on https://github.com/librosa/librosa/issues/434
+    Griffin-Lim runs on tf.contrib.signal STFTs, so waveforms can be fetched in the same session.run as the mels.
     '''
-    angles = np.exp(2j * np.pi * np.random.rand(*S.shape))
-    S_complex = np.abs(S).astype(np.complex)
-    y = _istft(S_complex * angles, hparams)
-    for i in range(hparams.griffin_lim_iters):
-        angles = np.exp(1j * np.angle(_stft(y, hparams)))
-        y = _istft(S_complex * angles, hparams)
-    return y
+    with tf.name_scope('inv_mel_spectrogram'):
+        D = _denormalize_tensorflow(mel_spectrograms, hparams)
+        S = tf.pow(10.0, (D + hparams.ref_level_db) * 0.05)  # Convert back to linear
+        inv_mel_basis = tf.constant(get_vocoder(hparams).inv_mel_basis.T, dtype=tf.float32)
+        S = tf.maximum(1e-10, tf.tensordot(S, inv_mel_basis, [[2], [0]]))
+        return _griffin_lim_tensorflow(tf.pow(S, hparams.power), hparams)
+
+
+# Window sum-square envelopes kept per Vocoder
+_max_envelopes = 8
+
+# Vocoders by STFT, inversion and normalization configuration
+_vocoders = {}
+
+
+def get_vocoder(hparams):
+    '''Returns the Vocoder of hparams, created once per configuration (every hparam it reads is in the key)'''
+    key = (hparams.sample_rate, hparams.n_fft, get_hop_size(hparams), hparams.win_size, hparams.num_mels,
+           hparams.fmin, hparams.fmax, hparams.power, hparams.griffin_lim_iters, hparams.griffin_lim_momentum,
+           hparams.use_lws, hparams.signal_normalization, hparams.allow_clipping_in_normalization,
+           hparams.symmetric_mels, hparams.max_abs_value, hparams.min_level_db, hparams.ref_level_db)
+    if key not in _vocoders:
+        _vocoders[key] = Vocoder(hparams)
+    return _vocoders[key]
+
+
+class Vocoder:
+    """
+        Inverts spectrograms to waveforms with LWS or Griffin-Lim.
+
+        Everything that only depends on the STFT configuration (window, inverse mel basis and LWS processor) is
+        built once, and the window sum-square envelopes of the latest signal lengths are cached. STFT and ISTFT are
+        vectorized numpy implementations working on batches of signals ([..., samples] <-> [..., freq, frames]),
+        so Griffin-Lim runs on a whole batch of spectrograms at once. With hparams.griffin_lim_momentum > 0, the
+        fast Griffin-Lim update (Perraudin et al., 2013) is used, which converges in far fewer iterations.
+    """
+
+    def __init__(self, hparams):
+        self._hparams = hparams
+        self._n_fft = hparams.n_fft
+        self._hop_size = get_hop_size(hparams)
+        win_size = hparams.win_size or hparams.n_fft
+        # Periodic hann window centered in n_fft (as librosa.stft)
+        lpad = (self._n_fft - win_size) // 2
+        self._window = np.pad(signal.get_window('hann', win_size, fftbins=True),
+                              (lpad, self._n_fft - win_size - lpad), mode='constant')
+        self._n_segments = -(-self._n_fft // self._hop_size)
+        # Envelopes of the latest signal lengths (Griffin-Lim reuses one per batch, lengths vary across batches)
+        self._envelopes = OrderedDict()
+        self._mel_basis = None
+        self._inv_mel_basis = None
+        self._lws = None
+
+    @property
+    def mel_basis(self):
+        '''Mel filterbank (float32) as a sparse matrix: every filter only covers a band of frequencies'''
+        if self._mel_basis is None:
+            self._mel_basis = sparse.csr_matrix(_build_mel_basis(self._hparams).astype(np.float32))
+        return self._mel_basis
+
+    @property
+    def inv_mel_basis(self):
+        if self._inv_mel_basis is None:
+            self._inv_mel_basis = np.linalg.pinv(_build_mel_basis(self._hparams))
+        return self._inv_mel_basis
+
+    @property
+    def lws_processor(self):
+        if self._lws is None:
+            import lws
+            self._lws = lws.lws(self._n_fft, self._hop_size, fftsize=self._hparams.win_size, mode="speech")
+        return self._lws
+
+    def inv_linear_spectrogram(self, linear_spectrogram):
+        S = _db_to_amp(self._denormalize(linear_spectrogram) + self._hparams.ref_level_db)  # Convert back to linear
+        return self._invert(S ** self._hparams.power)
+
+    def inv_mel_spectrogram(self, mel_spectrogram):
+        S = self._mel_to_linear(_db_to_amp(self._denormalize(mel_spectrogram) + self._hparams.ref_level_db))
+        return self._invert(S ** self._hparams.power)
+
+    def inv_mel_spectrograms(self, mel_spectrograms):
+        if self._hparams.use_lws or len(mel_spectrograms) == 1:
+            return [self.inv_mel_spectrogram(mel) for mel in mel_spectrograms]
+
+        # Pad the batch with zero magnitudes, trimmed out of the waveforms afterwards
+        lengths = [mel.shape[1] for mel in mel_spectrograms]
+        S = np.zeros((len(lengths), self._n_fft // 2 + 1, max(lengths)))
+        for i, mel in enumerate(mel_spectrograms):
+            S[i, :, :lengths[i]] = self._mel_to_linear(
+                _db_to_amp(self._denormalize(mel) + self._hparams.ref_level_db)) ** self._hparams.power
+        wavs = self.griffin_lim(S, lengths)
+        return [wav[:(length - 1) * self._hop_size] for wav, length in zip(wavs, lengths)]
+
+    def griffin_lim(self, S, lengths=None):
+        '''Griffin-Lim over magnitudes S [..., freq, frames]
+        With lengths, the frames of every entry of a zero padded batch S [batch, freq, frames], each entry is
+        normalized and reflect padded on its own frames, as if it were alone
+        Based on https://github.com/librosa/librosa/issues/434
+        '''
+        momentum = self._hparams.griffin_lim_momentum
+        S = np.abs(S)
+        envelope = None if lengths is None else self._batch_envelope(lengths, S.shape[-1])
+        angles = np.exp(2j * np.pi * np.random.rand(*S.shape))
+        rebuilt = 0.
+        for i in range(self._hparams.griffin_lim_iters):
+            previous = rebuilt
+            rebuilt = self.stft(self.istft(S * angles, envelope), lengths)
+            angles = rebuilt - (momentum / (1 + momentum)) * previous
+            angles /= np.abs(angles) + 1e-16
+        return self.istft(S * angles, envelope).astype(np.float32)
+
+    def stft(self, y, lengths=None):
+        '''Centered STFT of y [..., samples] -> [..., n_fft // 2 + 1, frames] (as librosa.stft)
+        With lengths, the frames of every entry of a batch y [batch, samples], each entry is reflect padded at the
+        end of its own (length - 1) * hop_size samples, and zero after
+        '''
+        pad = self._n_fft // 2
+        padded = np.pad(y, [(0, 0)] * (y.ndim - 1) + [(pad, pad)], mode='reflect')
+        if lengths is not None:
+            for i, length in enumerate(lengths):
+                samples = (length - 1) * self._hop_size
+                padded[i, :samples + 2 * pad] = np.pad(y[i, :samples], (pad, pad), mode='reflect')
+                padded[i, samples + 2 * pad:] = 0.
+        y = padded
+        n_frames = 1 + (y.shape[-1] - self._n_fft) // self._hop_size
+        frames = np.lib.stride_tricks.as_strided(
+            y, shape=y.shape[:-1] + (n_frames, self._n_fft),
+            strides=y.strides[:-1] + (y.strides[-1] * self._hop_size, y.strides[-1]))
+        return np.swapaxes(np.fft.rfft(frames * self._window, axis=-1), -1, -2)
+
+    def istft(self, D, envelope=None):
+        '''Inverse of stft(), D [..., n_fft // 2 + 1, frames] -> [..., samples] (as librosa.istft)
+        The overlap-add is normalized by envelope if given (see _batch_envelope), else by the one of all frames
+        '''
+        n_frames = D.shape[-1]
+        frames = np.fft.irfft(np.swapaxes(D, -1, -2), n=self._n_fft, axis=-1) * self._window
+        y = self._overlap_add(frames) / (self._envelope(n_frames) if envelope is None else envelope)
+        pad = self._n_fft // 2
+        return y[..., pad: y.shape[-1] - pad]
+
+    def _overlap_add(self, frames):
+        # Adds the n_fft frames [..., frames, n_fft] hop_size apart, one hop_size segment of all frames at a time
+        n_frames = frames.shape[-2]
+        frames = np.pad(frames, [(0, 0)] * (frames.ndim - 1) + [(0, self._n_segments * self._hop_size - self._n_fft)],
+                        mode='constant')
+        frames = frames.reshape(frames.shape[:-1] + (self._n_segments, self._hop_size))
+        y = np.zeros(frames.shape[:-3] + (n_frames + self._n_segments - 1, self._hop_size))
+        for j in range(self._n_segments):
+            y[..., j: j + n_frames, :] += frames[..., j, :]
+        y = y.reshape(y.shape[:-2] + (-1,))
+        return y[..., :self._n_fft + self._hop_size * (n_frames - 1)]
+
+    def _envelope(self, n_frames):
+        # Window sum-square normalization of a signal of n_frames frames (1 where it is ~0)
+        envelope = self._envelopes.pop(n_frames, None)
+        if envelope is None:
+            envelope = self._overlap_add(np.tile(self._window ** 2, (n_frames, 1)))
+            envelope = np.where(envelope > np.finfo(np.float32).tiny, envelope, 1.)
+        # Reinserted as the most recently used, the least recently used one is dropped
+        self._envelopes[n_frames] = envelope
+        if len(self._envelopes) > _max_envelopes:
+            self._envelopes.popitem(last=False)
+        return envelope
+
+    def _batch_envelope(self, lengths, n_frames):
+        # Window sum-square normalization of a batch [batch, samples], every entry only counting its own frames
+        mask = np.arange(n_frames) < np.asarray(lengths)[:, None]
+        envelope = self._overlap_add(mask[:, :, None] * self._window ** 2)
+        return np.where(envelope > np.finfo(np.float32).tiny, envelope, 1.)
+
+    def _invert(self, S):
+        if self._hparams.use_lws:
+            processor = self.lws_processor
+            D = processor.run_lws(S.astype(np.float64).T)
+            return processor.istft(D).astype(np.float32)
+        return self.griffin_lim(S)
+
+    def _denormalize(self, D):
+        if self._hparams.signal_normalization:
+            return _denormalize(D, self._hparams)
+        return D
+
+    def _mel_to_linear(self, mel_spectrogram):
+        return np.maximum(1e-10, np.dot(self.inv_mel_basis, mel_spectrogram))
+
+
+def _lws_processor(hparams):
+    return get_vocoder(hparams).lws_processor
 
 
 def _stft(y, hparams):
@@ -128,8 +333,36 @@ def _stft(y, hparams):
         return librosa.stft(y=y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=hparams.win_size)
 
 
-def _istft(y, hparams):
-    return librosa.istft(y, hop_length=get_hop_size(hparams), win_length=hparams.win_size)
+def _griffin_lim_tensorflow(S, hparams):
+    '''tf.contrib.signal implementation of (fast) Griffin-Lim over magnitudes S [batch, frames, freq]
+    '''
+    with tf.variable_scope('griffinlim'):
+        momentum = tf.constant(hparams.griffin_lim_momentum / (1 + hparams.griffin_lim_momentum), tf.complex64)
+        S_complex = tf.cast(S, tf.complex64)
+        angles = tf.exp(tf.complex(tf.zeros_like(S), 2 * np.pi * tf.random_uniform(tf.shape(S))))
+
+        def body(i, angles, rebuilt):
+            previous = rebuilt
+            rebuilt = _stft_tensorflow(_istft_tensorflow(S_complex * angles, hparams), hparams)
+            angles = rebuilt - momentum * previous
+            angles /= tf.cast(tf.abs(angles) + 1e-16, tf.complex64)
+            return i + 1, angles, rebuilt
+
+        shape = tf.TensorShape([None, None, None])
+        _, angles, _ = tf.while_loop(lambda i, angles, rebuilt: i < hparams.griffin_lim_iters, body,
+                                     [tf.constant(0), angles, tf.zeros_like(S_complex)],
+                                     shape_invariants=[tf.TensorShape([]), shape, shape])
+        return _istft_tensorflow(S_complex * angles, hparams)
+
+
+def _stft_tensorflow(signals, hparams):
+    return tf.contrib.signal.stft(signals, hparams.win_size or hparams.n_fft, get_hop_size(hparams), hparams.n_fft)
+
+
+def _istft_tensorflow(stfts, hparams):
+    hop_size = get_hop_size(hparams)
+    return tf.contrib.signal.inverse_stft(stfts, hparams.win_size or hparams.n_fft, hop_size, hparams.n_fft,
+                                          window_fn=tf.contrib.signal.inverse_stft_window_fn(hop_size))
 
 
 def num_frames(length, fsize, fshift):
@@ -154,22 +387,8 @@ def pad_lr(x, fsize, fshift):
 
 
 # Conversions
-_mel_basis = None
-_inv_mel_basis = None
-
-
 def _linear_to_mel(spectogram, hparams):
-    global _mel_basis
-    if _mel_basis is None:
-        _mel_basis = _build_mel_basis(hparams)
-    return np.dot(_mel_basis, spectogram)
-
-
-def _mel_to_linear(mel_spectrogram, hparams):
-    global _inv_mel_basis
-    if _inv_mel_basis is None:
-        _inv_mel_basis = np.linalg.pinv(_build_mel_basis(hparams))
-    return np.maximum(1e-10, np.dot(_inv_mel_basis, mel_spectrogram))
+    return get_vocoder(hparams).mel_basis.dot(spectogram)
 
 
 def _build_mel_basis(hparams):
@@ -187,6 +406,31 @@ def _db_to_amp(x):
     return np.power(10.0, (x) * 0.05)
 
 
+def _spectrogram_inplace(S, hparams):
+    # Magnitudes S -> _normalize(_amp_to_db(S) - ref_level_db), overwriting S (float32)
+    min_level = np.float32(np.exp(hparams.min_level_db / 20 * np.log(10)))
+    np.maximum(S, min_level, out=S)
+    np.log10(S, out=S)
+    S *= 20
+    S -= hparams.ref_level_db
+    if not hparams.signal_normalization:
+        return S
+
+    if not hparams.allow_clipping_in_normalization:
+        assert S.max() <= 0 and S.min() - hparams.min_level_db >= 0
+    S -= hparams.min_level_db
+    if hparams.symmetric_mels:
+        S *= 2 * hparams.max_abs_value / -hparams.min_level_db
+        S -= hparams.max_abs_value
+        low = -hparams.max_abs_value
+    else:
+        S *= hparams.max_abs_value / -hparams.min_level_db
+        low = 0
+    if hparams.allow_clipping_in_normalization:
+        np.clip(S, low, hparams.max_abs_value, out=S)
+    return S
+
+
 def _normalize(S, hparams):
     if hparams.allow_clipping_in_normalization:
         if hparams.symmetric_mels:
@@ -221,3 +465,20 @@ def _denormalize(D, hparams):
                     2 * hparams.max_abs_value)) + hparams.min_level_db)
     else:
         return ((D * -hparams.min_level_db / hparams.max_abs_value) + hparams.min_level_db)
+
+
+def _denormalize_tensorflow(D, hparams):
+    if not hparams.signal_normalization:
+        return D
+
+    if hparams.allow_clipping_in_normalization:
+        if hparams.symmetric_mels:
+            D = tf.clip_by_value(D, -hparams.max_abs_value, hparams.max_abs_value)
+        else:
+            D = tf.clip_by_value(D, 0, hparams.max_abs_value)
+
+    if hparams.symmetric_mels:
+        return (((D + hparams.max_abs_value) * -hparams.min_level_db / (
+                    2 * hparams.max_abs_value)) + hparams.min_level_db)
+    else:
+        return ((D * -hparams.min_level_db / hparams.max_abs_value) + hparams.min_level_db)
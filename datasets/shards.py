@@ -0,0 +1,189 @@
+import json
+import os
+from glob import glob
+import numpy as np
+
+# Target size of a single shard file (bytes). Shards are only split between examples.
+_default_shard_bytes = 1 << 30
+
+
+def index_path(data_dir, name):
+    return os.path.join(data_dir, '{}-index.json'.format(name))
+
+
+def open_reader(data_dir):
+    '''Returns a ShardReader over data_dir if it holds packed features, None otherwise'''
+    indices = glob(index_path(data_dir, '*'))
+    if len(indices) != 1:
+        return None
+    name = os.path.basename(indices[0])[:-len('-index.json')]
+    return ShardReader(data_dir, name)
+
+
+def load(reader, data_dir, filename):
+    '''Loads an example either from a shard reader or from its .npy file'''
+    if reader is not None:
+        return reader[filename]
+    return np.load(os.path.join(data_dir, filename))
+
+
+class ShardWriter:
+    """
+        Appends 1-D or 2-D arrays into a few large contiguous binary shard files.
+
+        Every array is stored as raw bytes, rows after rows, and is referenced by a key
+        (the file name it would have had as a .npy file) in a json index written by close(),
+        along with the optional attrs dict.
+    """
+
+    def __init__(self, data_dir, name, dtype, max_shard_bytes=_default_shard_bytes, attrs=None):
+        self._data_dir = data_dir
+        self._attrs = attrs or {}
+        self._name = name
+        self._dtype = np.dtype(dtype)
+        self._max_shard_bytes = max_shard_bytes
+        self._shards = []
+        self._entries = {}
+        self._dim = None
+        self._file = None
+        self._size = 0
+
+    def append(self, key, array):
+        array = np.ascontiguousarray(array, dtype=self._dtype)
+        dim = array.shape[1] if array.ndim == 2 else 0
+        if self._dim is None:
+            self._dim = dim
+        elif dim != self._dim:
+            raise ValueError('{}: inconsistent feature dimension {} (expected {})'.format(key, dim, self._dim))
+
+        if self._file is None or self._size + array.nbytes > self._max_shard_bytes:
+            self._open_next_shard()
+
+        # Offsets are stored in elements of dtype so the reader can slice its memmap directly
+        self._entries[key] = [len(self._shards) - 1, self._size // self._dtype.itemsize, len(array)]
+        self._file.write(array.tobytes())
+        self._size += array.nbytes
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        with open(index_path(self._data_dir, self._name), 'w', encoding='utf-8') as f:
+            json.dump({
+                'dtype': self._dtype.str,
+                'dim': self._dim or 0,
+                'shards': self._shards,
+                'entries': self._entries,
+                'attrs': self._attrs,
+            }, f)
+
+    def _open_next_shard(self):
+        if self._file is not None:
+            self._file.close()
+        filename = '{}-{:03d}.bin'.format(self._name, len(self._shards))
+        self._shards.append(filename)
+        self._file = open(os.path.join(self._data_dir, filename), 'wb')
+        self._size = 0
+
+
+class ShardReader:
+    """
+        Serves arrays written by ShardWriter as slices of read-only memory maps.
+
+        Shard files are mapped once, on first use, so reading an example costs neither a file open
+        nor a header parse. Readers can be pickled to worker processes; maps are reopened there.
+    """
+
+    def __init__(self, data_dir, name):
+        self._data_dir = data_dir
+        with open(index_path(data_dir, name), encoding='utf-8') as f:
+            index = json.load(f)
+        self._dtype = np.dtype(index['dtype'])
+        self._dim = index['dim']
+        self._shards = index['shards']
+        self._entries = index['entries']
+        self._maps = [None] * len(self._shards)
+        # Free form metadata given to the writer
+        self.attrs = index.get('attrs', {})
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        shard, offset, rows = self._entries[key]
+        data = self._maps[shard]
+        if data is None:
+            data = np.memmap(os.path.join(self._data_dir, self._shards[shard]), dtype=self._dtype, mode='r')
+            self._maps[shard] = data
+
+        if self._dim:
+            return data[offset: offset + rows * self._dim].reshape(rows, self._dim)
+        return data[offset: offset + rows]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = [None] * len(self._shards)
+        return state
+
+
+def pack_corpus(metadata, mel_dir, linear_dir, wav_dir, max_shard_bytes=_default_shard_bytes,
+                remove_npy=True, tqdm=lambda x: x):
+    """
+    Packs the per utterance .npy files referenced by a train.txt metadata into shards
+
+    Shards are written next to the .npy files (mels/mels-000.bin, linear/linear-000.bin, audio/audio-000.bin)
+    and keep the original file names as keys, so the metadata stays valid for both formats.
+
+    Args:
+        - metadata: list of tuples (audio_filename, mel_filename, linear_filename, ...) as written to train.txt
+        - mel_dir: directory of the mel-spectrogram .npy files
+        - linear_dir: directory of the linear-spectrogram .npy files
+        - wav_dir: directory of the audio .npy files
+        - max_shard_bytes: Optional, approximate size of a shard file
+        - remove_npy: Optional, delete the .npy files once packed
+        - tqdm: Optional, provides a nice progress bar
+    """
+    columns = [(0, wav_dir, 'audio'), (1, mel_dir, 'mels'), (2, linear_dir, 'linear')]
+    writers = {}
+    for m in tqdm(metadata):
+        for column, data_dir, name in columns:
+            path = os.path.join(data_dir, m[column])
+            array = np.load(path)
+            if name not in writers:
+                writers[name] = ShardWriter(data_dir, name, array.dtype, max_shard_bytes)
+            writers[name].append(m[column], array)
+
+    for writer in writers.values():
+        writer.close()
+
+    if remove_npy:
+        for m in metadata:
+            for column, data_dir, _ in columns:
+                os.remove(os.path.join(data_dir, m[column]))
+
+
+def pack_sequences(metadata, text_column, out_dir, encode, version, tqdm=lambda x: x):
+    """
+    Writes the symbol ID sequence of every transcript of a train.txt metadata as int32 shards (inputs/)
+
+    Sequences are keyed by the mel-spectrogram file name and tagged with version, so feeders can skip
+    text processing and fall back to it when the sequences were made by another text pipeline.
+
+    Args:
+        - metadata: list of tuples (audio_filename, mel_filename, ...) as written to train.txt
+        - text_column: index of the transcript in a metadata tuple
+        - out_dir: preprocessing output directory (the one of train.txt)
+        - encode: function of a transcript returning its symbol IDs
+        - version: version tag of encode
+        - tqdm: Optional, provides a nice progress bar
+    """
+    input_dir = os.path.join(out_dir, 'inputs')
+    os.makedirs(input_dir, exist_ok=True)
+    writer = ShardWriter(input_dir, 'inputs', np.int32, attrs={'version': version})
+    for m in tqdm(metadata):
+        writer.append(m[1], encode(m[text_column]))
+    writer.close()
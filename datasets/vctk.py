@@ -55,7 +55,8 @@ def _process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hpar
         constant_values = 0.
         out_dtype = np.float32
 
-    mel_spectrogram = audio.melspectrogram(wav, hparams).astype(np.float32)
+    # Compute the mel and linear scale spectrograms from the wav (a single STFT)
+    mel_spectrogram, linear_spectrogram = audio.spectrograms(wav, hparams)
 
     name = os.path.splitext(os.path.basename(wav_path))[0]
     speaker_id = _speaker_re.match(name).group(1)
@@ -65,8 +66,6 @@ def _process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hpar
     if mel_frames > hparams.max_mel_frames and hparams.clip_mels_length:
         return None
 
-    # Compute the linear scale spectrogram from the wav
-    linear_spectrogram = audio.linearspectrogram(wav, hparams).astype(np.float32)
     linear_frames = linear_spectrogram.shape[1]
 
     # sanity check
@@ -0,0 +1,182 @@
+import argparse
+import os
+import time
+from types import SimpleNamespace
+import tensorflow as tf
+from hparams import hparams, load_from_json
+from infolog import log
+
+# Graph transforms run on frozen graphs (https://github.com/tensorflow/tensorflow/tree/master/tensorflow/tools/graph_transforms)
+_transforms = [
+    'remove_nodes(op=CheckNumerics)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'strip_unused_nodes',
+    'sort_by_execution_order',
+]
+
+
+def freeze(session, input_names, output_names):
+    '''Returns the GraphDef of the outputs with variables turned into constants and inference only transforms applied
+
+    Only the variables the outputs depend on are kept (no optimizer slots, no global step). Batch normalizations
+    following 1-D convolutions are folded into the convolution weights.
+    '''
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        session, session.graph.as_graph_def(), output_names)
+    graph_def = TransformGraph(graph_def, input_names, output_names, _transforms)
+    graph_def = _fold_conv1d_batch_norms(graph_def)
+    return tf.graph_util.extract_sub_graph(graph_def, output_names)
+
+
+def load_frozen_graph(path):
+    '''Imports a graph written by export.py in a new tf.Graph'''
+    graph_def = tf.GraphDef()
+    with open(path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    return graph
+
+
+def frozen_tensors(graph, names):
+    '''Tensors of a frozen graph by name, None for the ones that were not exported'''
+    ops = {op.name for op in graph.get_operations()}
+    return SimpleNamespace(**{name: graph.get_tensor_by_name(name + ':0') if name in ops else None for name in names})
+
+
+def _fold_conv1d_batch_norms(graph_def):
+    # tf.layers.conv1d followed by a (non fused) inference batch normalization ends up, once constants are folded, as
+    # Conv2D(x, W) -> Squeeze -> BiasAdd(b) -> Mul(scale) -> Add(shift). The Mul and Add are folded into W and b
+    nodes = {node.name: node for node in graph_def.node}
+    consumers = {}
+    for node in graph_def.node:
+        for name in node.input:
+            name = name.lstrip('^').split(':')[0]
+            consumers[name] = consumers.get(name, 0) + 1
+
+    def const_input(node, index):
+        input_node = nodes.get(node.input[index].split(':')[0])
+        if input_node is None or input_node.op != 'Const' or consumers[input_node.name] != 1:
+            return None
+        return input_node
+
+    def single_input(node, op):
+        input_node = nodes.get(node.input[0].split(':')[0])
+        if input_node is None or input_node.op != op or consumers[input_node.name] != 1:
+            return None
+        return input_node
+
+    folded = 0
+    for add in list(graph_def.node):
+        if add.op not in ('Add', 'AddV2') or const_input(add, 1) is None:
+            continue
+        mul = single_input(add, 'Mul')
+        bias_add = mul and const_input(mul, 1) is not None and single_input(mul, 'BiasAdd')
+        squeeze = bias_add and const_input(bias_add, 1) is not None and single_input(bias_add, 'Squeeze')
+        conv = squeeze and single_input(squeeze, 'Conv2D')
+        if not conv or const_input(conv, 1) is None:
+            continue
+
+        scale = tf.make_ndarray(const_input(mul, 1).attr['value'].tensor)
+        shift = tf.make_ndarray(const_input(add, 1).attr['value'].tensor)
+        kernel_node, bias_node = const_input(conv, 1), const_input(bias_add, 1)
+        kernel = tf.make_ndarray(kernel_node.attr['value'].tensor)
+        bias = tf.make_ndarray(bias_node.attr['value'].tensor)
+        kernel_node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto((kernel * scale).astype(kernel.dtype)))
+        bias_node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto((bias * scale + shift).astype(bias.dtype)))
+
+        # The Add now forwards the BiasAdd, Mul and constants are left unused
+        dtype = add.attr['T']
+        add.op = 'Identity'
+        del add.input[:]
+        add.input.append(bias_add.name)
+        add.attr.clear()
+        add.attr['T'].CopyFrom(dtype)
+        folded += 1
+
+    log('Folded {} batch normalizations into convolutions'.format(folded))
+    return graph_def
+
+
+def _load_synthesizer(args, checkpoint_path):
+    if args.model == 'WaveNet':
+        from wavenet_vocoder.synthesizer import Synthesizer
+        synth = Synthesizer()
+        synth.load(checkpoint_path, hparams)
+        inputs = [t for t in (synth.local_conditions, synth.global_conditions, synth.synthesis_length) if t is not None]
+        outputs = {'y_hat': synth.model.y_hat}
+        return synth, inputs, outputs
+
+    if args.model == 'MultiSpeaker':
+        from multi_speaker.synthesizer import Synthesizer
+        synth = Synthesizer()
+        synth.load(checkpoint_path, hparams)
+        inputs = [synth.model.inputs, synth.model.input_lengths, synth.model.speaker_ids]
+    else:
+        from tacotron.synthesizer import Synthesizer
+        synth = Synthesizer()
+        synth.load(checkpoint_path, hparams, model_name=args.model)
+        inputs = [synth.model.inputs, synth.model.input_lengths]
+
+    outputs = {
+        'mel_outputs': synth.mel_outputs,
+        'stop_token_prediction': synth.stop_token_prediction,
+        'alignments': synth.model.alignments,
+    }
+    if hparams.predict_linear:
+        outputs['linear_outputs'] = synth.model.linear_outputs
+    if synth.wav_outputs is not None:
+        outputs['wav_outputs'] = synth.wav_outputs
+    return synth, inputs, outputs
+
+
+def export(args, checkpoint_path):
+    start = time.time()
+    synth, inputs, outputs = _load_synthesizer(args, checkpoint_path)
+    log('Loaded {} from {} in {:.3f} sec'.format(args.model, checkpoint_path, time.time() - start))
+
+    # Outputs get stable names for the loaders
+    with synth.session.graph.as_default():
+        output_names = [tf.identity(tensor, name=name).op.name for name, tensor in outputs.items()]
+    input_names = [tensor.op.name for tensor in inputs]
+
+    graph_def = freeze(synth.session, input_names, output_names)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    log('Exported {} nodes (inputs: {}, outputs: {}) to {} ({:.1f} MB)'.format(
+        len(graph_def.node), input_names, output_names, args.output, os.path.getsize(args.output) / 2 ** 20))
+
+
+def main():
+    accepted_models = ['Tacotron', 'MultiSpeaker', 'WaveNet']
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', required=True, help='Path to model checkpoint (or its directory)')
+    parser.add_argument('--model', default='MultiSpeaker', help='one of {}'.format(accepted_models))
+    parser.add_argument('--output', required=True, help='Path of the frozen graph (.pb) to write')
+    parser.add_argument('--hparams', default='',
+                        help='Hyperparameter overrides as a comma-separated list of name=value pairs, or a json file')
+    args = parser.parse_args()
+
+    if args.model not in accepted_models:
+        raise ValueError('please enter a valid model to export: {}'.format(accepted_models))
+
+    if os.path.exists(args.hparams):
+        load_from_json(args.hparams)
+    else:
+        hparams.parse(args.hparams)
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+    checkpoint_path = args.checkpoint
+    if os.path.isdir(checkpoint_path):
+        checkpoint_path = tf.train.get_checkpoint_state(checkpoint_path).model_checkpoint_path
+    export(args, checkpoint_path)
+
+
+if __name__ == '__main__':
+    main()
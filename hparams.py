@@ -8,11 +8,19 @@ hparams = tf.contrib.training.HParams(
     # text, you may want to use "basic_cleaners" or "transliteration_cleaners" or "korean_cleaners".
     cleaners='transliteration_cleaners',
     lang='kr',
+    # CMUDict text file or binary index (tacotron.utils.cmudict.build_index, also built next to a text file on first
+    # use): words found in it are fed to the model as ARPAbet. None feeds characters only
+    cmudict_path=None,
 
     # Hardware setup (TODO: multi-GPU parallel tacotron training)
     use_all_gpus=False,
     # Whether to use all GPU resources. If True, total number of available gpus will override num_gpus.
     num_gpus=1,  # Determines the number of gpus in use
+
+    # Input pipeline of all feeders. Can be ('queue' or 'dataset'). 'queue' feeds numpy batches into a FIFOQueue
+    # from a Python thread, 'dataset' builds batches with tf.data (parallel map, bucketing, padding and prefetch)
+    input_pipeline='queue',
+    dataset_prefetch_device=None,  # Device to prefetch tf.data batches to (e.g. '/gpu:0'). None keeps them on cpu
     ###########################################################################################################################################
 
     # Audio
@@ -58,6 +66,8 @@ hparams = tf.contrib.training.HParams(
     # Griffin Lim
     power=1.2,
     griffin_lim_iters=60,
+    griffin_lim_momentum=0.,  # fast Griffin-Lim momentum (0 = original algorithm, ~0.99 needs far fewer iterations)
+    griffin_lim_in_graph=False,  # synthesizers invert mels with a TensorFlow Griffin-Lim in the synthesis session.run
     ###########################################################################################################################################
 
     # Tacotron
@@ -84,12 +94,13 @@ hparams = tf.contrib.training.HParams(
     decoder_layers=2,  # number of decoder lstm layers
     decoder_lstm_units=1024,  # number of decoder lstm units on each layer
     max_iters=2500,  # Max decoder steps during inference (Just for safety from infinite loop cases)
+    tacotron_synthesis_batch_size=16,  # number of sentences synthesized by a single decoder run in eval mode
 
     postnet_num_layers=5,  # number of postnet convolutional layers
     postnet_kernel_size=(5,),  # size of postnet convolution filters for each layer
     postnet_channels=512,  # number of postnet convolution filters for each layer
 
-    mask_encoder=False,  # whether to mask encoder padding while computing attention
+    mask_encoder=False,  # whether to mask encoder padding (encoder convolutions and attention), always on at synthesis
     mask_decoder=False,
     # Whether to use loss mask for padded sequences (if False, <stop_token> loss function will not be weighted, else recommended pos_weight = 20)
 
@@ -142,6 +153,13 @@ hparams = tf.contrib.training.HParams(
     # Whether to use cpu as support to gpu for decoder computation (Not recommended: may cause major slowdowns! Only use when critical!)
 
     tacotron_batch_size=48,  # number of training samples on each training steps
+    tacotron_loader_workers=0,  # number of workers loading and padding train batches (0 = load on the feeder thread)
+    tacotron_loader_type='thread',  # Can be ('thread' or 'process'). 'process' avoids the GIL for text processing
+    tacotron_prefetch_batches=16,  # max number of train batches loaded (or being loaded) ahead of the input queue
+    tacotron_global_bucketing=False,  # bucket the whole train set by mel length every epoch (instead of windows of 32 batches)
+    tacotron_bucket_boundaries=None,  # mel frames boundaries of the length buckets (None = percentiles of the train set)
+    tacotron_num_buckets=10,  # number of length buckets when tacotron_bucket_boundaries is None
+    tacotron_batch_frames=None,  # max padded mel frames per train batch (batch size * longest target). None = fixed tacotron_batch_size
     tacotron_reg_weight=1e-6,  # regularization weight (for L2 regularization)
     tacotron_scale_regularization=True,
     # Whether to rescale regularization weight to adapt for outputs range (used when reg_weight is high and biasing the model)
@@ -192,6 +210,8 @@ hparams = tf.contrib.training.HParams(
     # Whether to use cpu as support to gpu for decoder computation (Not recommended: may cause major slowdowns! Only use when critical!)
 
     wavenet_batch_size=4,  # batch size used to train wavenet.
+    wavenet_loader_workers=4,  # number of parallel batch loading calls (only used when input_pipeline = 'dataset')
+    wavenet_prefetch_batches=8,  # number of train batches prefetched (only used when input_pipeline = 'dataset')
     wavenet_test_size=0.0441,  # % of data to keep as test data, if None, wavenet_test_batches must be not None
     wavenet_test_batches=None,  # number of test batches.
     wavenet_data_random_state=1234,  # random state for train test split repeatability
@@ -74,7 +74,8 @@ class MultiSpeakerTacotron():
             encoder_cell = TacotronEncoderCell(
                 EncoderConvolutions(is_training, hparams=hp, scope='encoder_convolutions'),
                 EncoderRNN(is_training, size=hp.encoder_lstm_units,
-                           zoneout=hp.tacotron_zoneout_rate, scope='encoder_LSTM'))
+                           zoneout=hp.tacotron_zoneout_rate, scope='encoder_LSTM'),
+                mask_paddings=hp.mask_encoder)
 
             encoder_outputs = encoder_cell(embedded, input_lengths)
 
@@ -137,8 +138,14 @@ class MultiSpeakerTacotron():
             # Postnet
             postnet = Postnet(is_training, hparams=hp, scope='postnet_convolutions')
 
+            # With a masked encoder, the post networks of a synthesis batch entry do not see the frames decoded
+            # past its own <stop_token> either: it comes out as if it was synthesized alone
+            output_lengths = None
+            if hp.mask_encoder and not (is_training or is_evaluating or gta):
+                output_lengths = stop_token_lengths(stop_token_prediction, hp)
+
             # Compute residual using post-net ==> [batch_size, decoder_steps * r, postnet_channels]
-            residual = postnet(decoder_output)
+            residual = postnet(decoder_output, output_lengths)
 
             # Project residual to same dimension as mel spectrogram
             # ==> [batch_size, decoder_steps * r, num_mels]
@@ -154,9 +161,10 @@ class MultiSpeakerTacotron():
                 post_processing_cell = TacotronEncoderCell(
                     EncoderConvolutions(is_training, hparams=hp, scope='post_processing_convolutions'),
                     EncoderRNN(is_training, size=hp.encoder_lstm_units,
-                               zoneout=hp.tacotron_zoneout_rate, scope='post_processing_LSTM'))
+                               zoneout=hp.tacotron_zoneout_rate, scope='post_processing_LSTM'),
+                    mask_paddings=output_lengths is not None)
 
-                expand_outputs = post_processing_cell(mel_outputs)
+                expand_outputs = post_processing_cell(mel_outputs, output_lengths)
                 linear_outputs = FrameProjection(hp.num_freq, scope='post_processing_projection')(expand_outputs)
 
             # Grab alignments from the final decoder state
@@ -4,7 +4,8 @@ import os
 from tqdm import tqdm
 from multi_speaker import preprocessor
 from hparams import hparams
-from datasets import vctk
+from tacotron.utils.text import training_sequence, sequence_version
+from datasets import vctk, shards
 
 
 def preprocess(args, input_folders, out_dir, hparams):
@@ -23,8 +24,19 @@ def preprocess(args, input_folders, out_dir, hparams):
     else:
         raise ValueError('not support dataset')
 
+    metadata = [m for m in metadata if m]
     write_metadata(metadata, out_dir)
 
+    print('Encoding transcripts..')
+    cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
+    shards.pack_sequences(metadata, 6, out_dir,
+                          lambda text: training_sequence(text, cleaner_names, hparams.cmudict_path),
+                          sequence_version(cleaner_names, hparams.cmudict_path), tqdm=tqdm)
+
+    if args.output_format == 'shards':
+        print('Packing features into shards..')
+        shards.pack_corpus(metadata, mel_dir, linear_dir, wav_dir, tqdm=tqdm)
+
 
 def write_metadata(metadata, out_dir):
     with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as f:
@@ -77,6 +89,8 @@ def main():
                         help='Hyperparameter overrides as a comma-separated list of name=value pairs')
     parser.add_argument('--output', default='training_data')
     parser.add_argument('--n_jobs', type=int, default=cpu_count())
+    parser.add_argument('--output_format', default='npy', choices=['npy', 'shards'],
+                        help='Write one .npy file per utterance or pack features into memory mappable shards')
     args = parser.parse_args()
 
     modified_hp = hparams.parse(args.hparams)
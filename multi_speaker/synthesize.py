@@ -9,6 +9,18 @@ import random
 from tacotron.utils.text_kr import split_to_jamo, is_korean_text, normalize_number
 
 
+def load_synthesizer(checkpoint_path, hparams, gta=False):
+    """Synthesizer restored from a checkpoint, or started from a frozen graph (.pb) exported by export.py"""
+    synth = Synthesizer()
+    if not checkpoint_path.endswith('.pb'):
+        synth.load(checkpoint_path, hparams, gta=gta)
+    elif gta:
+        raise ValueError('GTA synthesis needs a checkpoint, {} has no mel targets input'.format(checkpoint_path))
+    else:
+        synth.load_frozen(checkpoint_path, hparams)
+    return synth
+
+
 def generate_fast(model, text, speaker_id=1):
     model.synthesize(text, None, None, None, None, speaker_id)
 
@@ -16,8 +28,7 @@ def generate_fast(model, text, speaker_id=1):
 def run_live(args, checkpoint_path, hparams):
     # Log to Terminal without keeping any records in files
     log(hparams_debug_string())
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams)
+    synth = load_synthesizer(checkpoint_path, hparams)
 
     # Generate fast greeting message
     greetings = 'Hello, Welcome to the Live testing tool. Please type a message and I will try to read it!'
@@ -59,8 +70,7 @@ def run_eval(args, checkpoint_path, output_dir, hparams, sentences):
     os.makedirs(os.path.join(log_dir, 'plots'), exist_ok=True)
 
     log(hparams_debug_string())
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams)
+    synth = load_synthesizer(checkpoint_path, hparams)
 
     with open(os.path.join(eval_dir, 'map.txt'), 'w') as file:
         for i, text in enumerate(tqdm(sentences)):
@@ -95,8 +105,7 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
 
     metadata_filename = os.path.join(args.base_dir, args.input_dir, 'train.txt')
     log(hparams_debug_string())
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams, gta=GTA)
+    synth = load_synthesizer(checkpoint_path, hparams, gta=GTA)
     with open(metadata_filename, encoding='utf-8') as f:
         metadata = [line.strip().split('|') for line in f]
         frame_shift_ms = hparams.hop_size / hparams.sample_rate
@@ -122,24 +131,28 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
 def multispeaker_synthesize(args, hparams, checkpoint, sentences=None):
     output_dir = 'tacotron_' + args.output_dir
 
-    try:
-        checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
-        log('loaded model at {}'.format(checkpoint_path))
-    except AttributeError:
-        # Swap logs dir name in case user used Tacotron-2 for train and Both for test (and vice versa)
-        if 'Both' in checkpoint:
-            checkpoint = checkpoint.replace('Both', 'Tacotron-2')
-        elif 'Tacotron-2' in checkpoint:
-            checkpoint = checkpoint.replace('Tacotron-2', 'Both')
-        else:
-            raise AssertionError('Cannot restore checkpoint: {}, did you train a model?'.format(checkpoint))
-
+    if checkpoint.endswith('.pb'):
+        # Frozen graph exported by export.py
+        checkpoint_path = checkpoint
+    else:
         try:
-            # Try loading again
             checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
             log('loaded model at {}'.format(checkpoint_path))
-        except:
-            raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
+        except AttributeError:
+            # Swap logs dir name in case user used Tacotron-2 for train and Both for test (and vice versa)
+            if 'Both' in checkpoint:
+                checkpoint = checkpoint.replace('Both', 'Tacotron-2')
+            elif 'Tacotron-2' in checkpoint:
+                checkpoint = checkpoint.replace('Tacotron-2', 'Both')
+            else:
+                raise AssertionError('Cannot restore checkpoint: {}, did you train a model?'.format(checkpoint))
+
+            try:
+                # Try loading again
+                checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
+                log('loaded model at {}'.format(checkpoint_path))
+            except:
+                raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
 
     if args.mode == 'eval':
         return run_eval(args, checkpoint_path, output_dir, hparams, sentences)
@@ -2,47 +2,71 @@ import os
 import numpy as np
 import tensorflow as tf
 from multi_speaker.models import create_model
-from tacotron.utils.text import text_to_sequence
+from tacotron.utils.text import text_to_sequence, arpabet_text
 from tacotron.utils import plot
 from datasets import audio
-import pyaudio
-import wave
 from infolog import log
 from tacotron.utils.text_kr import split_to_jamo, j2h, is_korean_char, is_korean_text, normalize_number
+from tacotron.synthesizer import output_length, synthesis_hparams
 
 
 class Synthesizer:
-    def load(self, checkpoint_path, hparams, gta=False, model_name='MultiSpeaker'):
+    def load(self, checkpoint_path, hparams, gta=False, model_name='MultiSpeaker', session_config=None):
         log('Constructing model: %s' % model_name)
-        inputs = tf.placeholder(tf.int32, [1, None], 'inputs')
-        input_lengths = tf.placeholder(tf.int32, [1], 'input_lengths')
-        speaker_ids = tf.placeholder(tf.int32, [1], 'speaker_ids')
-        targets = tf.placeholder(tf.float32, [1, None, hparams.num_mels], 'mel_targets')
+        inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+        input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+        speaker_ids = tf.placeholder(tf.int32, [None], 'speaker_ids')
+        targets = tf.placeholder(tf.float32, [None, None, hparams.num_mels], 'mel_targets')
         with tf.variable_scope('model') as scope:
-            self.model = create_model(model_name, hparams)
+            # Padded steps of a batch are masked, so a sentence comes out the same alone or batched with others
+            self.model = create_model(model_name, synthesis_hparams(hparams))
             if gta:
                 self.model.initialize(inputs, input_lengths, speaker_ids, targets, gta=gta)
             else:
                 self.model.initialize(inputs, input_lengths, speaker_ids)
             self.mel_outputs = self.model.mel_outputs
             self.alignment = self.model.alignments[0]
+            self.stop_token_prediction = self.model.stop_token_prediction
+
+        # mel -> wav inversion fetched in the same session.run as the mels
+        self.wav_outputs = audio.inv_mel_spectrogram_tensorflow(
+            self.mel_outputs, hparams) if hparams.griffin_lim_in_graph else None
 
         self.gta = gta
         self._hparams = hparams
 
         log('Loading checkpoint: %s' % checkpoint_path)
-        self.session = tf.Session()
+        self.session = tf.Session(config=session_config)
         self.session.run(tf.global_variables_initializer())
         saver = tf.train.Saver()
         saver.restore(self.session, checkpoint_path)
 
+    def load_frozen(self, frozen_path, hparams, session_config=None):
+        '''Loads a graph exported by export.py (no model construction nor checkpoint restore)'''
+        from export import load_frozen_graph, frozen_tensors
+
+        log('Loading frozen graph: %s' % frozen_path)
+        graph = load_frozen_graph(frozen_path)
+        self.model = frozen_tensors(graph, ['inputs', 'input_lengths', 'speaker_ids', 'alignments', 'linear_outputs'])
+        outputs = frozen_tensors(graph, ['mel_outputs', 'stop_token_prediction', 'wav_outputs'])
+        self.mel_outputs = outputs.mel_outputs
+        self.stop_token_prediction = outputs.stop_token_prediction
+        self.wav_outputs = outputs.wav_outputs
+        with graph.as_default():
+            self.alignment = self.model.alignments[0]
+        self.linear_outputs = self.model.linear_outputs
+
+        self.gta = False
+        self._hparams = hparams
+        self.session = tf.Session(graph=graph, config=session_config)
+
     def synthesize(self, text, index, out_dir, log_dir, mel_filename, speaker_id):
         hparams = self._hparams
         cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
         if is_korean_text(text):
             text = normalize_number(text)
             text = split_to_jamo(text, cleaner_names)
-        seq = text_to_sequence(text, cleaner_names)
+        seq = text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names)
         feed_dict = {
             self.model.inputs: [np.asarray(seq, dtype=np.int32)],
             self.model.input_lengths: np.asarray([len(seq)], dtype=np.int32),
@@ -52,37 +76,22 @@ class Synthesizer:
         if self.gta:
             feed_dict[self.model.mel_targets] = np.load(mel_filename).reshape(1, -1, 80)
 
+        need_wav = index is None or log_dir is not None
         if self.gta or not hparams.predict_linear:
-            mels, alignment = self.session.run([self.mel_outputs, self.alignment], feed_dict=feed_dict)
+            (mels, alignment), wav = self._run([self.mel_outputs, self.alignment], feed_dict, need_wav)
 
         else:
-            linear, mels, alignment = self.session.run([self.linear_outputs, self.mel_outputs, self.alignment],
-                                                       feed_dict=feed_dict)
+            (linear, mels, alignment), wav = self._run([self.linear_outputs, self.mel_outputs, self.alignment],
+                                                       feed_dict, need_wav)
             linear = linear.reshape(-1, hparams.num_freq)
 
         mels = mels.reshape(-1, hparams.num_mels)  # Thanks to @imdatsolak for pointing this out
 
         if index is None:
-            # Generate wav and read it
-            wav = audio.inv_mel_spectrogram(mels.T, hparams)
-            audio.save_wav(wav, 'temp.wav', sr=hparams.sample_rate)  # Find a better way
-
-            chunk = 512
-            f = wave.open('temp.wav', 'rb')
-            p = pyaudio.PyAudio()
-            stream = p.open(format=p.get_format_from_width(f.getsampwidth()),
-                            channels=f.getnchannels(),
-                            rate=f.getframerate(),
-                            output=True)
-            data = f.readframes(chunk)
-            while data:
-                stream.write(data)
-                data = f.readframes(chunk)
-
-            stream.stop_stream()
-            stream.close()
-
-            p.terminate()
+            # Generate wav and play it
+            if wav is None:
+                wav = audio.inv_mel_spectrogram(mels.T, hparams)
+            audio.play_wav(wav, hparams.sample_rate)
             return
 
         # Write the spectrogram to disk
@@ -92,7 +101,8 @@ class Synthesizer:
 
         if log_dir is not None:
             # save wav (mel -> wav)
-            wav = audio.inv_mel_spectrogram(mels.T, hparams)
+            if wav is None:
+                wav = audio.inv_mel_spectrogram(mels.T, hparams)
             audio.save_wav(wav, os.path.join(log_dir, 'wavs/speech-wav-{:05d}-mel.wav'.format(index)),
                            sr=hparams.sample_rate)
 
@@ -114,56 +124,101 @@ class Synthesizer:
 
         return mel_filename
 
-    def predict(self, text, out_dir, speaker_id):
+    def synthesize_wav(self, text, speaker_id):
+        '''Synthesizes a (normalized) text to a float32 waveform, without writing any file
+        '''
         hparams = self._hparams
         cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
-        seq = text_to_sequence(text, cleaner_names)
+        seq = text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names)
         feed_dict = {
             self.model.inputs: [np.asarray(seq, dtype=np.int32)],
             self.model.input_lengths: np.asarray([len(seq)], dtype=np.int32),
             self.model.speaker_ids: np.asarray([speaker_id], dtype=np.int32)
         }
 
-        mels, alignment = self.session.run([self.mel_outputs, self.alignment], feed_dict=feed_dict)
-        mels = mels.reshape(-1, hparams.num_mels)  # Thanks to @imdatsolak for pointing this out
+        (mels,), wav = self._run([self.mel_outputs], feed_dict, True)
+        if wav is None:
+            wav = audio.inv_mel_spectrogram(mels.reshape(-1, hparams.num_mels).T, hparams)
+        return wav
+
+    def predict(self, text, out_path, speaker_id):
+        '''Returns the wav file content (bytes) of a text, also written to out_path unless it is None
+        '''
+        data = audio.to_wav_bytes(self.synthesize_wav(text, speaker_id), self._hparams.sample_rate)
+        if out_path is not None:
+            with open(out_path, 'wb') as f:
+                f.write(data)
+        return data
+
+    def synthesize_batch(self, texts, speaker_ids):
+        '''Synthesizes a batch of (normalized) texts, each with its own speaker, with a single decoder run
+
+        Sequences are padded to the longest one and every output is cut after its own <stop_token>.
+        Returns the list of mel spectrograms [frames, num_mels].
+        '''
+        return self._run_batch(texts, speaker_ids, False)[0]
+
+    def synthesize_wav_batch(self, texts, speaker_ids):
+        '''Same as synthesize_batch but returns the list of waveforms
+        '''
+        mels, wavs = self._run_batch(texts, speaker_ids, True)
+        if wavs is not None:
+            return wavs
+        return audio.inv_mel_spectrograms([mel.T for mel in mels], self._hparams)
+
+    def _run_batch(self, texts, speaker_ids, wavs):
+        hparams = self._hparams
+        cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
+        seqs = [text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names) for text in texts]
+        input_lengths = np.asarray([len(seq) for seq in seqs], dtype=np.int32)
+        # Pad sequences with the <pad_token> 0
+        inputs = np.zeros((len(seqs), input_lengths.max()), dtype=np.int32)
+        for i, seq in enumerate(seqs):
+            inputs[i, :len(seq)] = seq
+        feed_dict = {
+            self.model.inputs: inputs,
+            self.model.input_lengths: input_lengths,
+            self.model.speaker_ids: np.asarray(speaker_ids, dtype=np.int32)
+        }
 
-        wav = audio.inv_mel_spectrogram(mels.T, hparams)
-        audio.save_wav(wav, out_dir, sr=hparams.sample_rate)
+        fetch_wavs = wavs and self.wav_outputs is not None
+        fetches = [self.mel_outputs, self.stop_token_prediction]
+        if fetch_wavs:
+            fetches.append(self.wav_outputs)
+        outputs = self.session.run(fetches, feed_dict=feed_dict)
+        lengths = [output_length(stop_tokens, hparams) for stop_tokens in outputs[1]]
 
-        return out_dir
+        mels = [mel[:length] for mel, length in zip(outputs[0], lengths)]
+        if not fetch_wavs:
+            return mels, None
+        hop_size = audio.get_hop_size(hparams)
+        return mels, [wav[:length * hop_size] for wav, length in zip(outputs[2], lengths)]
 
     def run(self, text, speaker_id, play=True):
         hparams = self._hparams
         cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
-        seq = text_to_sequence(text, cleaner_names)
+        seq = text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names)
         feed_dict = {
             self.model.inputs: [np.asarray(seq, dtype=np.int32)],
             self.model.input_lengths: np.asarray([len(seq)], dtype=np.int32),
             self.model.speaker_ids: np.asarray([speaker_id], dtype=np.int32)
         }
 
-        mels, alignment = self.session.run([self.mel_outputs, self.alignment], feed_dict=feed_dict)
+        (mels, alignment), wav = self._run([self.mel_outputs, self.alignment], feed_dict, play)
         mels = mels.reshape(-1, hparams.num_mels)  # Thanks to @imdatsolak for pointing this out
 
         if play:
-            # Generate wav and read it
-            wav = audio.inv_mel_spectrogram(mels.T, hparams)
-            audio.save_wav(wav, 'temp.wav', sr=hparams.sample_rate)  # Find a better way
-
-            chunk = 512
-            f = wave.open('temp.wav', 'rb')
-            p = pyaudio.PyAudio()
-            stream = p.open(format=p.get_format_from_width(f.getsampwidth()),
-                            channels=f.getnchannels(),
-                            rate=f.getframerate(),
-                            output=True)
-            data = f.readframes(chunk)
-            while data:
-                stream.write(data)
-                data = f.readframes(chunk)
-
-            stream.stop_stream()
-            stream.close()
-            p.terminate()
+            # Generate wav and play it
+            if wav is None:
+                wav = audio.inv_mel_spectrogram(mels.T, hparams)
+            audio.play_wav(wav, hparams.sample_rate)
 
         return mels
+
+    def _run(self, fetches, feed_dict, wav):
+        '''Runs fetches and, if wav is True and the in graph vocoder was built, the waveform in the same run
+        '''
+        if wav and self.wav_outputs is not None:
+            outputs = self.session.run(fetches + [self.wav_outputs], feed_dict=feed_dict)
+            return outputs[:-1], outputs[-1][0]
+        return self.session.run(fetches, feed_dict=feed_dict), None
@@ -4,7 +4,8 @@ import os
 from tqdm import tqdm
 from datasets import preprocessor
 from hparams import hparams
-from datasets import krspeech
+from tacotron.utils.text import training_sequence, sequence_version
+from datasets import krspeech, shards
 
 
 def preprocess(args, input_folders, out_dir, hparams):
@@ -20,8 +21,19 @@ def preprocess(args, input_folders, out_dir, hparams):
     else:
         metadata = preprocessor.build_from_path(hparams, input_folders, mel_dir, linear_dir, wav_dir, args.n_jobs,
                                                 tqdm=tqdm)
+    metadata = [m for m in metadata if m]
     write_metadata(metadata, out_dir)
 
+    print('Encoding transcripts..')
+    cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
+    shards.pack_sequences(metadata, 5, out_dir,
+                          lambda text: training_sequence(text, cleaner_names, hparams.cmudict_path),
+                          sequence_version(cleaner_names, hparams.cmudict_path), tqdm=tqdm)
+
+    if args.output_format == 'shards':
+        print('Packing features into shards..')
+        shards.pack_corpus(metadata, mel_dir, linear_dir, wav_dir, tqdm=tqdm)
+
 
 def write_metadata(metadata, out_dir):
     with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as f:
@@ -105,6 +117,8 @@ def main():
     parser.add_argument('--book', default='northandsouth')
     parser.add_argument('--output', default='training_data')
     parser.add_argument('--n_jobs', type=int, default=cpu_count())
+    parser.add_argument('--output_format', default='npy', choices=['npy', 'shards'],
+                        help='Write one .npy file per utterance or pack features into memory mappable shards')
     args = parser.parse_args()
 
     modified_hp = hparams.parse(args.hparams)
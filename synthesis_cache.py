@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Hparams changing the synthesized audio for a given model and text
+_audio_hparams = ('sample_rate', 'num_mels', 'n_fft', 'hop_size', 'win_size', 'fmin', 'fmax', 'use_lws', 'power',
+                  'griffin_lim_iters', 'griffin_lim_momentum', 'griffin_lim_in_graph', 'signal_normalization',
+                  'allow_clipping_in_normalization', 'symmetric_mels', 'max_abs_value', 'min_level_db',
+                  'ref_level_db', 'outputs_per_step', 'stop_at_any', 'max_iters', 'cleaners', 'cmudict_path')
+# Hparams naming files read at synthesis
+_file_hparams = ('cmudict_path',)
+
+
+def cache_key(text, speaker_id, checkpoint, hparams):
+    '''Content address of a synthesis: normalized text, speaker, checkpoint, audio hparams and the files they name'''
+    config = {name: getattr(hparams, name, None) for name in _audio_hparams}
+    for name in _file_hparams:
+        config[name + '_identity'] = _file_identity(config[name])
+    content = json.dumps([text, speaker_id, checkpoint, config], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _file_identity(path):
+    # Size and modification time, so that a file edited in place changes the keys too
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+class SynthesisCache:
+    """
+        Two tier LRU cache of synthesized audio (bytes) addressed by cache_key().
+
+        Hot items are kept in memory (up to max_memory_items), every item is written to cache_dir whose size
+        is kept under max_disk_bytes by removing the least recently used files. Files left by a previous run
+        are reused, oldest modification time first out.
+    """
+
+    def __init__(self, cache_dir, max_memory_items=256, max_disk_bytes=1 << 30, ext='.wav'):
+        self._cache_dir = cache_dir
+        self._max_memory_items = max_memory_items
+        self._max_disk_bytes = max_disk_bytes
+        self._ext = ext
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = []
+        for filename in os.listdir(cache_dir):
+            if filename.endswith(ext):
+                stat = os.stat(os.path.join(cache_dir, filename))
+                files.append((stat.st_mtime, filename[:-len(ext)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+        with self._lock:
+            self._evict()
+
+    def path(self, key):
+        return os.path.join(self._cache_dir, key + self._ext)
+
+    def get(self, key):
+        '''Returns the cached bytes of key or None'''
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            if key not in self._disk:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+            # Keeps the disk LRU order across restarts
+            os.utime(self.path(key))
+        except OSError:
+            with self._lock:
+                self._forget(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._forget(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._remember(key, data)
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            requests = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / requests if requests else 0.,
+                'evictions': self.evictions,
+                'memory_items': len(self._memory),
+                'disk_items': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _forget(self, key):
+        self._memory.pop(key, None)
+        self._disk_bytes -= self._disk.pop(key, 0)
+
+    def _evict(self):
+        while self._disk_bytes > self._max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._memory.pop(key, None)
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
@@ -0,0 +1,279 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from infolog import log
+
+
+def _worker_main(worker_id, generation, checkpoint_path, hparams_overrides, intra_op_threads, inter_op_threads, cpus,
+                 max_batch, max_wait, heartbeat_interval, requests, results):
+    '''Entry point of a worker process: loads its own session and serves the requests of its queue by batches'''
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    import tensorflow as tf
+    from hparams import hparams
+    from multi_speaker.synthesizer import Synthesizer
+    from synthesis_scheduler import BatchScheduler
+
+    # The results pipe is written by the serving loop and by the scheduler thread
+    lock = threading.Lock()
+
+    def send(kind, key, value):
+        with lock:
+            results.send((kind, generation, key, value))
+
+    hparams.parse(hparams_overrides)
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    synthesizer = Synthesizer()
+    if checkpoint_path.endswith('.pb'):
+        synthesizer.load_frozen(checkpoint_path, hparams, session_config=config)
+    else:
+        synthesizer.load(checkpoint_path, hparams, session_config=config)
+    scheduler = BatchScheduler(synthesizer.synthesize_wav_batch, max_batch, max_wait)
+    send('ready', worker_id, None)
+
+    def reply(request_id):
+        def _reply(future):
+            try:
+                send('result', request_id, future.result())
+            except Exception:
+                send('error', request_id, traceback.format_exc())
+        return _reply
+
+    # Heartbeats come from the serving loop, so they stop if it hangs
+    last_heartbeat = 0.
+    while True:
+        try:
+            request_id, text, speaker_id = requests.get(timeout=heartbeat_interval)
+            scheduler.submit(text, speaker_id).add_done_callback(reply(request_id))
+        except queue.Empty:
+            pass
+        if time.time() - last_heartbeat >= heartbeat_interval:
+            send('heartbeat', worker_id, None)
+            last_heartbeat = time.time()
+
+
+class _Worker:
+    def __init__(self, worker_id, cpus):
+        self.id = worker_id
+        self.cpus = cpus
+        self.generation = 0
+        self.process = None
+        self.requests = None
+        self.results = None
+        self.sender = None
+        self.pending = {}
+        self.state = 'starting'
+        self.started = 0.
+        self.last_heartbeat = 0.
+        self.last_progress = 0.
+        self.restart_at = 0.
+        self.failures = 0
+        self.served = 0
+        self.restarts = 0
+
+
+class SynthesisPool:
+    """
+        Pool of synthesis worker processes, each owning a loaded session, behind a least-loaded dispatcher.
+
+        Requests go to the ready worker with the fewest requests in flight. A worker is restarted and its requests
+        in flight fail when it dies, takes more than load_timeout seconds to load, stops sending heartbeats for
+        health_timeout seconds, or answers nothing for request_timeout seconds while it has requests in flight
+        (a hung session run). A worker failing max_restarts times in a row before it is ready is restarted after
+        an exponential backoff, then given up. Worker processes are spawned (not forked) since TensorFlow is not
+        fork safe, and each has its own results pipe so that killing one cannot corrupt the others.
+    """
+
+    def __init__(self, num_workers, checkpoint_path, hparams_overrides='', intra_op_threads=0, inter_op_threads=0,
+                 pin_cpus=False, max_batch=8, max_wait=0.05, heartbeat_interval=1., health_timeout=30.,
+                 request_timeout=120., load_timeout=600., max_restarts=5):
+        self._context = multiprocessing.get_context('spawn')
+        self._args = (checkpoint_path, hparams_overrides, intra_op_threads, inter_op_threads)
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._heartbeat_interval = heartbeat_interval
+        self._health_timeout = health_timeout
+        self._request_timeout = request_timeout
+        self._load_timeout = load_timeout
+        self._max_restarts = max_restarts
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        cpus_per_worker = len(cpus) // num_workers if pin_cpus else 0
+        self._workers = [_Worker(i, cpus[i * cpus_per_worker: (i + 1) * cpus_per_worker]) for i in range(num_workers)]
+        for worker in self._workers:
+            self._attach(worker)
+            self._start(worker)
+
+        for target in (self._receive, self._monitor):
+            thread = threading.Thread(name='synthesis_pool', target=target)
+            thread.daemon = True  # Thread will close when parent quits
+            thread.start()
+
+    def submit(self, text, speaker_id):
+        future = Future()
+        with self._lock:
+            workers = [w for w in self._workers if w.state != 'failed']
+            if not workers:
+                raise RuntimeError('All synthesis workers failed')
+            # Least loaded worker, ready ones first (a loading or restarting worker only queues requests)
+            worker = min(workers, key=lambda w: (w.state != 'ready', len(w.pending)))
+            request_id = next(self._request_ids)
+            worker.pending[request_id] = (future, time.time())
+            worker.requests.put((request_id, text, speaker_id))
+        return future
+
+    def synthesize(self, text, speaker_id):
+        return self.submit(text, speaker_id).result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': [{
+                    'id': w.id,
+                    'pid': w.process.pid if w.process else None,
+                    'alive': w.process.is_alive() if w.process else False,
+                    'state': w.state,
+                    'in_flight': len(w.pending),
+                    'served': w.served,
+                    'restarts': w.restarts,
+                    'cpus': w.cpus,
+                } for w in self._workers],
+                'in_flight': sum(len(w.pending) for w in self._workers),
+            }
+
+    def _attach(self, worker):
+        # New generation: fresh queue and pipe, the messages still in the old pipe are ignored
+        worker.generation += 1
+        worker.requests = self._context.Queue()
+        worker.results, worker.sender = self._context.Pipe(duplex=False)
+        worker.process = None
+
+    def _start(self, worker):
+        '''Starts the process of the worker's generation, called without the lock held'''
+        process = self._context.Process(
+            target=_worker_main, name='synthesis_worker_{}'.format(worker.id),
+            args=(worker.id, worker.generation) + self._args + (worker.cpus, self._max_batch, self._max_wait,
+                                                                self._heartbeat_interval, worker.requests,
+                                                                worker.sender))
+        process.daemon = True
+        process.start()
+        # Only the worker writes the pipe, so its reader gets EOF when the worker dies
+        worker.sender.close()
+        with self._lock:
+            worker.process = process
+            worker.state = 'loading'
+            worker.started = time.time()
+
+    def _receive(self):
+        while True:
+            with self._lock:
+                connections = {w.results: w for w in self._workers if w.results is not None}
+            # Times out so that the pipes of restarted workers are picked up
+            for connection in wait(list(connections), timeout=self._heartbeat_interval):
+                worker = connections[connection]
+                try:
+                    kind, generation, key, value = connection.recv()
+                except (EOFError, OSError):
+                    # The worker is gone, the monitor restarts it
+                    with self._lock:
+                        if worker.results is connection:
+                            worker.results = None
+                    continue
+
+                future = None
+                with self._lock:
+                    if generation != worker.generation:
+                        continue
+                    now = time.time()
+                    if kind in ('heartbeat', 'ready'):
+                        worker.last_heartbeat = now
+                        if kind == 'ready':
+                            worker.state = 'ready'
+                            worker.failures = 0
+                            worker.last_progress = now
+                            log('Synthesis worker {} ready (pid {})'.format(worker.id, worker.process.pid))
+                        continue
+
+                    future, _ = worker.pending.pop(key, (None, None))
+                    worker.last_progress = now
+                    if future is not None:
+                        worker.served += 1
+                if future is None:
+                    continue
+                if kind == 'result':
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(value))
+
+    def _unhealthy(self, worker, now):
+        '''Reason to restart a worker, None if it is healthy'''
+        if not worker.process.is_alive():
+            return 'exit code {}'.format(worker.process.exitcode)
+        if worker.state == 'loading' and now - worker.started > self._load_timeout:
+            return 'not loaded after {:.0f} sec'.format(now - worker.started)
+        if worker.state != 'ready':
+            return None
+        if now - worker.last_heartbeat > self._health_timeout:
+            return 'no heartbeat for {:.0f} sec'.format(now - worker.last_heartbeat)
+        if worker.pending:
+            oldest = next(iter(worker.pending.values()))[1]
+            idle = now - max(oldest, worker.last_progress)
+            if idle > self._request_timeout:
+                return 'no answer for {:.0f} sec'.format(idle)
+        return None
+
+    def _monitor(self):
+        while True:
+            time.sleep(self._heartbeat_interval)
+            stopped, due = [], []
+            # Workers are detached under the lock; processes are stopped and started outside of it
+            with self._lock:
+                now = time.time()
+                for worker in self._workers:
+                    if worker.state == 'restarting':
+                        if now >= worker.restart_at:
+                            due.append(worker)
+                        continue
+                    if worker.state != 'loading' and worker.state != 'ready':
+                        continue
+                    reason = self._unhealthy(worker, now)
+                    if reason is None:
+                        continue
+
+                    if worker.state == 'loading':
+                        worker.failures += 1
+                    process, pending = worker.process, worker.pending
+                    worker.pending = {}
+                    worker.restarts += 1
+                    if worker.failures > self._max_restarts:
+                        log('Giving up synthesis worker {} after {} failed starts ({})'.format(
+                            worker.id, worker.failures, reason))
+                        worker.state = 'failed'
+                        worker.results = None
+                    else:
+                        delay = min(2 ** worker.failures - 1, 60)
+                        log('Restarting synthesis worker {} in {} sec ({})'.format(worker.id, delay, reason))
+                        worker.state = 'restarting'
+                        worker.restart_at = now + delay
+                        self._attach(worker)
+                    stopped.append((worker, process, pending))
+
+            for worker, process, pending in stopped:
+                if process.is_alive():
+                    process.terminate()
+                process.join(timeout=5)
+                for future, _ in pending.values():
+                    future.set_exception(RuntimeError('Synthesis worker {} crashed'.format(worker.id)))
+
+            for worker in due:
+                self._start(worker)
@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """
+        Groups concurrent synthesis requests into batches run by a single worker thread.
+
+        A batch starts with the oldest waiting request and takes every request arriving within max_wait seconds,
+        up to max_batch requests. synthesize_batch(texts, speaker_ids) must return one result per request,
+        which is delivered to the Future returned by submit().
+    """
+
+    def __init__(self, synthesize_batch, max_batch=8, max_wait=0.05):
+        self._synthesize_batch = synthesize_batch
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+        self._wait_time = 0.
+        self._run_time = 0.
+
+        thread = threading.Thread(name='scheduler', target=self._run)
+        thread.daemon = True  # Thread will close when parent quits
+        thread.start()
+
+    def submit(self, text, speaker_id):
+        future = Future()
+        self._queue.put((text, speaker_id, future, time.time()))
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def synthesize(self, text, speaker_id):
+        return self.submit(text, speaker_id).result()
+
+    def stats(self):
+        with self._lock:
+            requests = sum(size * count for size, count in self._batch_sizes.items())
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'requests': requests,
+                'batches': batches,
+                'mean_batch_size': requests / batches if batches else 0.,
+                'batch_sizes': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'mean_wait_sec': self._wait_time / requests if requests else 0.,
+                'mean_batch_sec': self._run_time / batches if batches else 0.,
+            }
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        # The oldest request waits at most max_wait since it was submitted (not since it was dequeued, which can be
+        # a whole batch run later). Past its deadline, only the requests already queued join the batch.
+        deadline = batch[0][3] + self._max_wait
+        while len(batch) < self._max_batch:
+            timeout = deadline - time.time()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [request for request in self._next_batch() if request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.time()
+            texts, speaker_ids, futures, submitted = zip(*batch)
+            try:
+                results = self._synthesize_batch(list(texts), list(speaker_ids))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._wait_time += sum(start - t for t in submitted)
+                self._run_time += time.time() - start
@@ -1,7 +1,4 @@
 import argparse
-from tacotron.synthesize import tacotron_synthesize
-from wavenet_vocoder.synthesize import wavenet_synthesize
-from multi_speaker.synthesize import multispeaker_synthesize
 from infolog import log
 from hparams import hparams, load_from_json
 from warnings import warn
@@ -20,6 +17,10 @@ def prepare_run(args):
 
     run_name = args.name or args.wavenet_name or args.model
     wave_checkpoint = os.path.join('logs-' + run_name, 'wave_' + args.checkpoint)
+
+    # Frozen graphs (see export.py) start without model construction nor checkpoint restore
+    taco_checkpoint = args.tacotron_frozen or taco_checkpoint
+    wave_checkpoint = args.wavenet_frozen or wave_checkpoint
     return taco_checkpoint, wave_checkpoint, modified_hp
 
 
@@ -33,6 +34,9 @@ def get_sentences(args):
 
 
 def synthesize(args, hparams, taco_checkpoint, wave_checkpoint, sentences):
+    from tacotron.synthesize import tacotron_synthesize
+    from wavenet_vocoder.synthesize import wavenet_synthesize
+
     log('Running End-to-End TTS Evaluation. Model: {}'.format(args.name or args.model))
     log('Synthesizing mel-spectrograms from text..')
     wavenet_in_dir = tacotron_synthesize(args, hparams, taco_checkpoint, sentences)
@@ -46,6 +50,10 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--base_dir', default='D:/voice/MultiSpeaker')
     parser.add_argument('--checkpoint', default='pretrained/', help='Path to model checkpoint')
+    parser.add_argument('--tacotron_frozen', default=None,
+                        help='Frozen Tacotron/MultiSpeaker graph (.pb) used instead of the checkpoint')
+    parser.add_argument('--wavenet_frozen', default=None,
+                        help='Frozen WaveNet graph (.pb) used instead of the checkpoint')
     parser.add_argument('--hparams', default='',
                         help='Hyperparameter overrides from a json file')
     parser.add_argument('--name', help='Name of logging directory if the two models were trained together.')
@@ -90,11 +98,15 @@ def main():
     taco_checkpoint, wave_checkpoint, hparams = prepare_run(args)
     sentences = get_sentences(args)
 
+    # Only the modules of the requested model are imported
     if args.model == 'Tacotron':
+        from tacotron.synthesize import tacotron_synthesize
         _ = tacotron_synthesize(args, hparams, taco_checkpoint, sentences)
     elif args.model == 'WaveNet':
+        from wavenet_vocoder.synthesize import wavenet_synthesize
         wavenet_synthesize(args, hparams, wave_checkpoint)
     elif args.model == 'MultiSpeaker':
+        from multi_speaker.synthesize import multispeaker_synthesize
         multispeaker_synthesize(args, hparams, taco_checkpoint, sentences)
     elif args.model in ('Both', 'Tacotron-2'):
         synthesize(args, hparams, taco_checkpoint, wave_checkpoint, sentences)
@@ -1,14 +1,23 @@
+import multiprocessing
 import numpy as np
 import os
+import queue
 import threading
 import time
-from tacotron.utils.text import text_to_sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tacotron.utils.text import training_sequence, sequence_version
 from infolog import log
 from sklearn.model_selection import train_test_split
 import tensorflow as tf
-from tacotron.utils.text_kr import split_to_jamo, is_korean_text, normalize_number
+from datasets import shards
+from tacotron.utils.sampler import BucketSampler, bucket_boundaries
 
 _batches_per_group = 32
+# Feeder attributes needed to load and pad examples (sent to loader processes)
+_loader_state = ('_hparams', '_cleaner_names', '_mel_dir', '_linear_dir', '_mel_reader', '_linear_reader',
+                 '_input_reader', '_pad', '_target_pad', '_token_pad')
+# Feeder of a loader process, set once by the process pool initializer
+_loader = None
 
 
 class Feeder:
@@ -27,6 +36,17 @@ class Feeder:
         # Load metadata
         self._mel_dir = os.path.join(os.path.dirname(metadata_filename), 'mels')
         self._linear_dir = os.path.join(os.path.dirname(metadata_filename), 'linear')
+        # Features packed by preprocess.py --output_format=shards are served from memory maps
+        self._mel_reader = shards.open_reader(self._mel_dir)
+        self._linear_reader = shards.open_reader(self._linear_dir)
+        if self._mel_reader is not None:
+            log('Reading features from shards in {}'.format(os.path.dirname(metadata_filename)))
+        # Symbol ID sequences written by preprocessing, unless another text pipeline produced them
+        self._input_reader = shards.open_reader(os.path.join(os.path.dirname(metadata_filename), 'inputs'))
+        if self._input_reader is not None and \
+                self._input_reader.attrs.get('version') != sequence_version(self._cleaner_names, hparams.cmudict_path):
+            log('Symbol sequences were encoded with other cleaners or symbols, encoding transcripts on the fly')
+            self._input_reader = None
         with open(metadata_filename, encoding='utf-8') as f:
             self._metadata = [line.strip().split('|') for line in f]
             frame_shift_ms = hparams.hop_size / hparams.sample_rate
@@ -58,6 +78,14 @@ class Feeder:
         if hparams.tacotron_test_size is None:
             assert hparams.tacotron_test_batches == self.test_steps
 
+        # Batches packed on a frame budget are planned by the sampler as well
+        if hparams.tacotron_global_bucketing or hparams.tacotron_batch_frames is not None:
+            self._sampler = BucketSampler(self._train_meta, hparams.tacotron_batch_size,
+                                          hparams.tacotron_bucket_boundaries, hparams.tacotron_num_buckets,
+                                          hparams.tacotron_batch_frames)
+        else:
+            self._sampler = None
+
         # pad input sequences with the <pad_token> 0 ( _ )
         self._pad = 0
         # explicitely setting the padding to a value that doesn't originally exist in the spectogram
@@ -70,46 +98,145 @@ class Feeder:
         self._token_pad = 1.
 
         with tf.device('/cpu:0'):
-            # Create placeholders for inputs and targets. Don't specify batch size because we want
-            # to be able to feed different batch sizes at eval time.
-            self._placeholders = [
-                tf.placeholder(tf.int32, shape=(None, None), name='inputs'),
-                tf.placeholder(tf.int32, shape=(None,), name='input_lengths'),
-                tf.placeholder(tf.float32, shape=(None, None, hparams.num_mels), name='mel_targets'),
-                tf.placeholder(tf.float32, shape=(None, None), name='token_targets'),
-                tf.placeholder(tf.float32, shape=(None, None, hparams.num_freq), name='linear_targets'),
-                tf.placeholder(tf.int32, shape=(None,), name='targets_lengths'),
-            ]
-
-            # Create queue for buffering data
-            queue = tf.FIFOQueue(8, [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32],
-                                 name='input_queue')
-            self._enqueue_op = queue.enqueue(self._placeholders)
-            self.inputs, self.input_lengths, self.mel_targets, self.token_targets, self.linear_targets, self.targets_lengths = queue.dequeue()
-
-            self.inputs.set_shape(self._placeholders[0].shape)
-            self.input_lengths.set_shape(self._placeholders[1].shape)
-            self.mel_targets.set_shape(self._placeholders[2].shape)
-            self.token_targets.set_shape(self._placeholders[3].shape)
-            self.linear_targets.set_shape(self._placeholders[4].shape)
-            self.targets_lengths.set_shape(self._placeholders[5].shape)
-
-            # Create eval queue for buffering eval data
-            eval_queue = tf.FIFOQueue(1, [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32],
-                                      name='eval_queue')
-            self._eval_enqueue_op = eval_queue.enqueue(self._placeholders)
-            self.eval_inputs, self.eval_input_lengths, self.eval_mel_targets, self.eval_token_targets, \
-            self.eval_linear_targets, self.eval_targets_lengths = eval_queue.dequeue()
-
-            self.eval_inputs.set_shape(self._placeholders[0].shape)
-            self.eval_input_lengths.set_shape(self._placeholders[1].shape)
-            self.eval_mel_targets.set_shape(self._placeholders[2].shape)
-            self.eval_token_targets.set_shape(self._placeholders[3].shape)
-            self.eval_linear_targets.set_shape(self._placeholders[4].shape)
-            self.eval_targets_lengths.set_shape(self._placeholders[5].shape)
+            if hparams.input_pipeline == 'dataset':
+                self._build_datasets(hparams)
+            else:
+                self._build_queues(hparams)
+
+    def _build_queues(self, hparams):
+        # Create placeholders for inputs and targets. Don't specify batch size because we want
+        # to be able to feed different batch sizes at eval time.
+        self._placeholders = [
+            tf.placeholder(tf.int32, shape=(None, None), name='inputs'),
+            tf.placeholder(tf.int32, shape=(None,), name='input_lengths'),
+            tf.placeholder(tf.float32, shape=(None, None, hparams.num_mels), name='mel_targets'),
+            tf.placeholder(tf.float32, shape=(None, None), name='token_targets'),
+            tf.placeholder(tf.float32, shape=(None, None, hparams.num_freq), name='linear_targets'),
+            tf.placeholder(tf.int32, shape=(None,), name='targets_lengths'),
+        ]
+
+        # Create queue for buffering data
+        queue = tf.FIFOQueue(8, [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32],
+                             name='input_queue')
+        self._enqueue_op = queue.enqueue(self._placeholders)
+        self.inputs, self.input_lengths, self.mel_targets, self.token_targets, self.linear_targets, self.targets_lengths = queue.dequeue()
+
+        self.inputs.set_shape(self._placeholders[0].shape)
+        self.input_lengths.set_shape(self._placeholders[1].shape)
+        self.mel_targets.set_shape(self._placeholders[2].shape)
+        self.token_targets.set_shape(self._placeholders[3].shape)
+        self.linear_targets.set_shape(self._placeholders[4].shape)
+        self.targets_lengths.set_shape(self._placeholders[5].shape)
+
+        # Create eval queue for buffering eval data
+        eval_queue = tf.FIFOQueue(1, [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32],
+                                  name='eval_queue')
+        self._eval_enqueue_op = eval_queue.enqueue(self._placeholders)
+        self.eval_inputs, self.eval_input_lengths, self.eval_mel_targets, self.eval_token_targets, \
+        self.eval_linear_targets, self.eval_targets_lengths = eval_queue.dequeue()
+
+        self.eval_inputs.set_shape(self._placeholders[0].shape)
+        self.eval_input_lengths.set_shape(self._placeholders[1].shape)
+        self.eval_mel_targets.set_shape(self._placeholders[2].shape)
+        self.eval_token_targets.set_shape(self._placeholders[3].shape)
+        self.eval_linear_targets.set_shape(self._placeholders[4].shape)
+        self.eval_targets_lengths.set_shape(self._placeholders[5].shape)
+
+    def _build_datasets(self, hparams):
+        """Builds train and eval inputs from tf.data pipelines instead of feed_dict filled queues.
+
+        Examples are read by py_funcs in a parallel map, grouped by mel length with bucket_by_sequence_length
+        and padded by tf.data, so batches never go through a session.run from Python. With global bucketing,
+        whole batches planned by the sampler are loaded and padded by the map instead.
+        """
+        n = hparams.tacotron_batch_size
+        types = (tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32)
+        shapes = ([None], [], [None, hparams.num_mels], [None], [None, hparams.num_freq], [])
+        batch_shapes = tuple([None] + shape for shape in shapes)
+        padding_values = tuple(tf.constant(value, dtype) for value, dtype in zip(
+            (self._pad, 0, self._target_pad, self._token_pad, self._target_pad, 0), types))
+        num_parallel_calls = max(1, hparams.tacotron_loader_workers)
+
+        def load(load_fn, shapes=shapes):
+            def _load(meta):
+                example = tf.py_func(load_fn, [meta], types, stateful=False)
+                for tensor, shape in zip(example, shapes):
+                    tensor.set_shape(shape)
+                return example
+            return _load
+
+        if self._sampler is not None:
+            train = tf.data.Dataset.from_generator(self._train_batch_generator, tf.string,
+                                                   tf.TensorShape([None, None]))
+            train = train.map(load(self._load_dataset_batch, batch_shapes), num_parallel_calls=num_parallel_calls)
+        else:
+            boundaries = hparams.tacotron_bucket_boundaries or bucket_boundaries(
+                [int(x[4]) for x in self._train_meta], hparams.tacotron_num_buckets)
+            train = tf.data.Dataset.from_generator(self._train_meta_generator, tf.string, tf.TensorShape([None]))
+            train = train.map(load(self._load_dataset_example), num_parallel_calls=num_parallel_calls)
+            train = train.apply(tf.contrib.data.bucket_by_sequence_length(
+                lambda *example: example[-1], boundaries, [n] * (len(boundaries) + 1),
+                padded_shapes=shapes, padding_values=padding_values))
+            train = train.map(self._round_up_batch, num_parallel_calls=num_parallel_calls)
+        train = train.prefetch(hparams.tacotron_prefetch_batches)
+        if hparams.dataset_prefetch_device is not None:
+            train = train.apply(tf.contrib.data.prefetch_to_device(hparams.dataset_prefetch_device))
+
+        # Test batches are built once on the entire test set and cached
+        test_meta = [_encode_meta(x) for x in sorted(self._test_meta, key=lambda x: int(x[4]))]
+        test = tf.data.Dataset.from_generator(lambda: iter(test_meta), tf.string, tf.TensorShape([None]))
+        test = test.map(load(self._load_dataset_test_example), num_parallel_calls=num_parallel_calls)
+        test = test.padded_batch(n, padded_shapes=shapes, padding_values=padding_values)
+        test = test.map(self._round_up_batch).cache().shuffle(max(1, self.test_steps)).repeat()
+
+        self._train_iterator = train.make_initializable_iterator()
+        self.inputs, self.input_lengths, self.mel_targets, self.token_targets, self.linear_targets, \
+        self.targets_lengths = self._train_iterator.get_next()
+
+        self._test_iterator = test.make_initializable_iterator()
+        self.eval_inputs, self.eval_input_lengths, self.eval_mel_targets, self.eval_token_targets, \
+        self.eval_linear_targets, self.eval_targets_lengths = self._test_iterator.get_next()
+
+    def _train_meta_generator(self):
+        while True:
+            yield _encode_meta(self._next_train_meta())
+
+    def _train_batch_generator(self):
+        for batch in self._sampler:
+            yield [_encode_meta(meta) for meta in batch]
+
+    def _load_dataset_batch(self, metas):
+        batch = self._load_batch([[x.decode('utf-8') for x in meta] for meta in metas], self._hparams.outputs_per_step)
+        dtypes = (np.int32, np.int32, np.float32, np.float32, np.float32, np.int32)
+        return tuple(x.astype(dtype) for x, dtype in zip(batch, dtypes))
+
+    def _load_dataset_example(self, meta):
+        return self._to_dataset_example(self._load_example([x.decode('utf-8') for x in meta]))
+
+    def _load_dataset_test_example(self, meta):
+        return self._to_dataset_example(self._load_test_example([x.decode('utf-8') for x in meta]))
+
+    def _to_dataset_example(self, example):
+        input_data, mel_target, token_target, linear_target, mel_length = example
+        return (input_data, np.int32(len(input_data)), mel_target.astype(np.float32),
+                token_target.astype(np.float32), linear_target.astype(np.float32), np.int32(mel_length))
+
+    def _round_up_batch(self, inputs, input_lengths, mel_targets, token_targets, linear_targets, targets_lengths):
+        # Pad targets to a multiple of outputs_per_step (tokens were padded with 1s up to max_len - 1)
+        r = self._hparams.outputs_per_step
+        max_len = tf.reduce_max(targets_lengths)
+        max_len = (max_len + r - 1) // r * r
+        mel_targets = _pad_time(mel_targets, max_len, self._target_pad)
+        token_targets = _pad_time(token_targets, max_len, self._token_pad)
+        linear_targets = _pad_time(linear_targets, max_len, self._target_pad)
+        return inputs, input_lengths, mel_targets, token_targets, linear_targets, targets_lengths
 
     def start_threads(self, session):
         self._session = session
+        if self._hparams.input_pipeline == 'dataset':
+            session.run([self._train_iterator.initializer, self._test_iterator.initializer])
+            return
+
         thread = threading.Thread(name='background', target=self._enqueue_next_train_group)
         thread.daemon = True  # Thread will close when parent quits
         thread.start()
@@ -121,14 +248,14 @@ class Feeder:
     def _get_test_groups(self):
         meta = self._test_meta[self._test_offset]
         self._test_offset += 1
+        return self._load_test_example(meta)
 
-        text = meta[5]
-
-        input_data = np.asarray(text_to_sequence(text, self._cleaner_names), dtype=np.int32)
-        mel_target = np.load(os.path.join(self._mel_dir, meta[1]))
+    def _load_test_example(self, meta):
+        input_data = self._input_sequence(meta, meta[5])
+        mel_target = shards.load(self._mel_reader, self._mel_dir, meta[1])
         # Create parallel sequences containing zeros to represent a non finished sequence
         token_target = np.asarray([0.] * (len(mel_target) - 1))
-        linear_target = np.load(os.path.join(self._linear_dir, meta[2]))
+        linear_target = shards.load(self._linear_reader, self._linear_dir, meta[2])
         return (input_data, mel_target, token_target, linear_target, len(mel_target))
 
     def make_test_batches(self):
@@ -150,24 +277,88 @@ class Feeder:
         return batches, r
 
     def _enqueue_next_train_group(self):
+        if self._hparams.tacotron_loader_workers > 0:
+            return self._enqueue_prefetched_train_batches()
+
         while not self._coord.should_stop():
             start = time.time()
 
             # Read a group of examples
             n = self._hparams.tacotron_batch_size
             r = self._hparams.outputs_per_step
-            examples = [self._get_next_example() for i in range(n * _batches_per_group)]
-
-            # Bucket examples based on similar output sequence length for efficiency
-            examples.sort(key=lambda x: x[-1])
-            batches = [examples[i: i + n] for i in range(0, len(examples), n)]
-            np.random.shuffle(batches)
+            batches = [[self._load_example(meta) for meta in batch] for batch in self._next_train_batches()]
 
             log('\nGenerated {} train batches of size {} in {:.3f} sec'.format(len(batches), n, time.time() - start))
             for batch in batches:
                 feed_dict = dict(zip(self._placeholders, self._prepare_batch(batch, r)))
                 self._session.run(self._enqueue_op, feed_dict=feed_dict)
 
+    def _enqueue_prefetched_train_batches(self):
+        """Loads and pads train batches on a pool of workers and keeps a bounded buffer of them ahead of the
+        input queue, so that reading, padding and enqueueing overlap with the training steps
+        """
+        hp = self._hparams
+        if hp.tacotron_loader_type == 'process':
+            # Loader processes are spawned (forking the running TF session can deadlock, and forked workers would
+            # share one np.random state). The loader state is sent once to each process, then only the metadata of
+            # every batch
+            executor = ProcessPoolExecutor(max_workers=hp.tacotron_loader_workers,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_loader, initargs=(self,))
+            load_batch = _load_batch
+        else:
+            executor = ThreadPoolExecutor(max_workers=hp.tacotron_loader_workers)
+            load_batch = self._load_batch
+        pending = queue.Queue(maxsize=hp.tacotron_prefetch_batches)
+
+        thread = threading.Thread(name='background', target=self._schedule_train_batches,
+                                  args=(executor, load_batch, pending))
+        thread.daemon = True  # Thread will close when parent quits
+        thread.start()
+
+        wait, count = 0., 0
+        while not self._coord.should_stop():
+            start = time.time()
+            batch = pending.get().result()
+            wait += time.time() - start
+            count += 1
+
+            if count == _batches_per_group:
+                log('\nWaited {:.3f} sec on the loader for {} train batches'.format(wait, count))
+                wait, count = 0., 0
+
+            feed_dict = dict(zip(self._placeholders, batch))
+            self._session.run(self._enqueue_op, feed_dict=feed_dict)
+
+        executor.shutdown(wait=False)
+
+    def _schedule_train_batches(self, executor, load_batch, pending):
+        r = self._hparams.outputs_per_step
+        while not self._coord.should_stop():
+            for batch in self._next_train_batches():
+                # Blocks while the prefetch buffer is full
+                pending.put(executor.submit(load_batch, batch, r))
+
+    def _next_train_batches(self):
+        """Metadata of the next _batches_per_group train batches, bucketed on the mel lengths of the metadata
+        so that examples are only read once batched
+        """
+        if self._sampler is not None:
+            return [self._sampler.next_batch() for i in range(_batches_per_group)]
+
+        n = self._hparams.tacotron_batch_size
+        metas = [self._next_train_meta() for i in range(n * _batches_per_group)]
+        metas.sort(key=lambda x: int(x[4]))
+        batches = [metas[i: i + n] for i in range(0, len(metas), n)]
+        np.random.shuffle(batches)
+        return batches
+
+    def _load_batch(self, metas, outputs_per_step):
+        return self._prepare_batch([self._load_example(meta) for meta in metas], outputs_per_step)
+
+    def __getstate__(self):
+        return {name: value for name, value in self.__dict__.items() if name in _loader_state}
+
     def _enqueue_next_test_group(self):
         # Create test batches once and evaluate on them for all test steps
         test_batches, r = self.make_test_batches()
@@ -176,29 +367,28 @@ class Feeder:
                 feed_dict = dict(zip(self._placeholders, self._prepare_batch(batch, r)))
                 self._session.run(self._eval_enqueue_op, feed_dict=feed_dict)
 
-    def _get_next_example(self):
-        """Gets a single example (input, mel_target, token_target, linear_target, mel_length) from_ disk
-        """
+    def _next_train_meta(self):
         if self._train_offset >= len(self._train_meta):
             self._train_offset = 0
             np.random.shuffle(self._train_meta)
 
         meta = self._train_meta[self._train_offset]
         self._train_offset += 1
+        return meta
 
-        text = meta[5]
-        if is_korean_text(text):
-            text = normalize_number(text)
-            # 한글을 자소 단위로 쪼갠다.
-            text = split_to_jamo(text, self._cleaner_names)
-
-        input_data = np.asarray(text_to_sequence(text, self._cleaner_names), dtype=np.int32)
-        mel_target = np.load(os.path.join(self._mel_dir, meta[1]))
+    def _load_example(self, meta):
+        input_data = self._input_sequence(meta, meta[5])
+        mel_target = shards.load(self._mel_reader, self._mel_dir, meta[1])
         # Create parallel sequences containing zeros to represent a non finished sequence
         token_target = np.asarray([0.] * (len(mel_target) - 1))
-        linear_target = np.load(os.path.join(self._linear_dir, meta[2]))
+        linear_target = shards.load(self._linear_reader, self._linear_dir, meta[2])
         return (input_data, mel_target, token_target, linear_target, len(mel_target))
 
+    def _input_sequence(self, meta, text):
+        if self._input_reader is not None and meta[1] in self._input_reader:
+            return np.asarray(self._input_reader[meta[1]])
+        return np.asarray(training_sequence(text, self._cleaner_names, self._hparams.cmudict_path), dtype=np.int32)
+
     def _prepare_batch(self, batch, outputs_per_step):
         np.random.shuffle(batch)
         inputs = self._prepare_inputs([x[0] for x in batch])
@@ -234,3 +424,22 @@ class Feeder:
     def _round_up(self, x, multiple):
         remainder = x % multiple
         return x if remainder == 0 else x + multiple - remainder
+
+
+def _init_loader(feeder):
+    global _loader
+    _loader = feeder
+
+
+def _load_batch(metas, outputs_per_step):
+    return _loader._load_batch(metas, outputs_per_step)
+
+
+def _encode_meta(meta):
+    return [x.encode('utf-8') for x in meta]
+
+
+def _pad_time(x, length, value):
+    """Pads the time axis (1) of a batch up to length with a constant value"""
+    paddings = [[0, 0], [0, length - tf.shape(x)[1]]] + [[0, 0]] * (x.shape.ndims - 2)
+    return tf.pad(x, paddings, constant_values=value)
@@ -24,21 +24,23 @@ class TacotronEncoderCell(RNNCell):
 	layer to predict the hidden representation vector (or memory)
 	"""
 
-	def __init__(self, convolutional_layers, lstm_layer):
+	def __init__(self, convolutional_layers, lstm_layer, mask_paddings=False):
 		"""Initialize encoder parameters
 
 		Args:
 			convolutional_layers: Encoder convolutional block class
 			lstm_layer: encoder bidirectional lstm layer class
+			mask_paddings: whether the convolutional layers see zeros past the input lengths
 		"""
 		super(TacotronEncoderCell, self).__init__()
 		#Initialize encoder layers
 		self._convolutions = convolutional_layers
 		self._cell = lstm_layer
+		self._mask_paddings = mask_paddings
 
 	def __call__(self, inputs, input_lengths=None):
 		#Pass input sequence through a stack of convolutional layers
-		conv_output = self._convolutions(inputs)
+		conv_output = self._convolutions(inputs, input_lengths if self._mask_paddings else None)
 
 		#Extract hidden representation from encoder lstm cells
 		hidden_representation = self._cell(conv_output, input_lengths)
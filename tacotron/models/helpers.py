@@ -48,10 +48,11 @@ class TacoTestHelper(Helper):
             #	and the use of stop_at_any = True would be recommended. If however the model didn't
             #	learn to stop correctly yet, (stops too soon) one could choose to use the safer option
             #	to get a correct synthesis
+            # (reduced over the r frames of each batch entry, entries of a batch finish independently)
             if self.stop_at_any:
-                finished = tf.reduce_any(finished)  # Recommended
+                finished = tf.reduce_any(finished, axis=1)  # Recommended
             else:
-                finished = tf.reduce_all(finished)  # Safer option
+                finished = tf.reduce_all(finished, axis=1)  # Safer option
 
             # Feed last output frame as next input. outputs is [N, output_dim * r]
             next_inputs = outputs[:, -self._output_dim:]
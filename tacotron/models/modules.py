@@ -15,6 +15,27 @@ def conv1d(inputs, kernel_size, channels, activation, is_training, drop_rate, sc
                                  name='dropout_{}'.format(scope))
 
 
+def mask_paddings(x, lengths):
+    '''Zeroes the steps of x [batch_size, steps, channels] past the length of every entry (x as is without lengths)
+    '''
+    if lengths is None:
+        return x
+    return x * tf.expand_dims(tf.sequence_mask(lengths, tf.shape(x)[1], dtype=x.dtype), axis=-1)
+
+
+def stop_token_lengths(stop_token_prediction, hparams):
+    '''Number of frames decoded up to the <stop_token> of every entry of a synthesis batch (as TacoTestHelper
+    finishes a decoding run), stop_token_prediction: [batch_size, decoder_steps * r]
+    '''
+    r = hparams.outputs_per_step
+    batch_size = tf.shape(stop_token_prediction)[0]
+    finished = tf.reshape(stop_token_prediction, [batch_size, -1, r]) > 0.5
+    finished = tf.reduce_any(finished, axis=2) if hparams.stop_at_any else tf.reduce_all(finished, axis=2)
+    first = tf.argmax(tf.cast(finished, tf.int32), axis=1, output_type=tf.int32)
+    return tf.where(tf.reduce_any(finished, axis=1), (first + 1) * r,
+                    tf.fill([batch_size], tf.shape(finished)[1] * r))
+
+
 class ZoneoutLSTMCell(tf.nn.rnn_cell.RNNCell):
     '''Wrapper for tf LSTM to create Zoneout LSTM Cell
 
@@ -104,12 +125,14 @@ class EncoderConvolutions:
         self.drop_rate = hparams.tacotron_dropout_rate
         self.enc_conv_num_layers = hparams.enc_conv_num_layers
 
-    def __call__(self, inputs):
+    def __call__(self, inputs, lengths=None):
+        # With lengths, every layer sees zeros past the end of an entry, as a batch of one would
         with tf.variable_scope(self.scope):
-            x = inputs
+            x = mask_paddings(inputs, lengths)
             for i in range(self.enc_conv_num_layers):
                 x = conv1d(x, self.kernel_size, self.channels, self.activation,
                            self.is_training, self.drop_rate, 'conv_layer_{}_'.format(i + 1) + self.scope)
+                x = mask_paddings(x, lengths)
         return x
 
 
@@ -309,15 +332,17 @@ class Postnet:
         self.postnet_num_layers = hparams.postnet_num_layers
         self.drop_rate = hparams.tacotron_dropout_rate
 
-    def __call__(self, inputs):
+    def __call__(self, inputs, lengths=None):
+        # With lengths, every layer sees zeros past the end of an entry, as a batch of one would
         with tf.variable_scope(self.scope):
-            x = inputs
+            x = mask_paddings(inputs, lengths)
             for i in range(self.postnet_num_layers - 1):
                 x = conv1d(x, self.kernel_size, self.channels, self.activation,
                            self.is_training, self.drop_rate, 'conv_layer_{}_'.format(i + 1) + self.scope)
+                x = mask_paddings(x, lengths)
             x = conv1d(x, self.kernel_size, self.channels, lambda _: _, self.is_training, self.drop_rate,
                        'conv_layer_{}_'.format(5) + self.scope)
-        return x
+        return mask_paddings(x, lengths)
 
 
 def _round_up_tf(x, multiple):
@@ -386,4 +411,4 @@ def MaskedSigmoidCrossEntropy(targets, outputs, targets_lengths, hparams, mask=N
     with tf.control_dependencies([tf.assert_equal(tf.shape(mask), tf.shape(losses))]):
         masked_loss = losses * mask
 
-    return tf.reduce_sum(masked_loss) / tf.count_nonzero(masked_loss, dtype=tf.float32)
+    return tf.reduce_sum(masked_loss) / tf.reduce_sum(mask)
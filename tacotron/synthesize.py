@@ -8,6 +8,18 @@ import tensorflow as tf
 from tacotron.utils.text_kr import split_to_jamo, is_korean_text, normalize_number
 
 
+def load_synthesizer(checkpoint_path, hparams, gta=False):
+    """Synthesizer restored from a checkpoint, or started from a frozen graph (.pb) exported by export.py"""
+    synth = Synthesizer()
+    if not checkpoint_path.endswith('.pb'):
+        synth.load(checkpoint_path, hparams, gta=gta)
+    elif gta:
+        raise ValueError('GTA synthesis needs a checkpoint, {} has no mel targets input'.format(checkpoint_path))
+    else:
+        synth.load_frozen(checkpoint_path, hparams)
+    return synth
+
+
 def generate_fast(model, text):
     model.synthesize(text, None, None, None, None)
 
@@ -15,8 +27,7 @@ def generate_fast(model, text):
 def run_live(args, checkpoint_path, hparams):
     # Log to Terminal without keeping any records in files
     log(hparams_debug_string())
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams)
+    synth = load_synthesizer(checkpoint_path, hparams)
 
     # Generate fast greeting message
     greetings = 'Hello, Welcome to the Live testing tool. Please type a message and I will try to read it!'
@@ -51,18 +62,25 @@ def run_eval(args, checkpoint_path, output_dir, hparams, sentences):
     os.makedirs(os.path.join(log_dir, 'plots'), exist_ok=True)
 
     log(hparams_debug_string())
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams)
-
+    synth = load_synthesizer(checkpoint_path, hparams)
+
+    texts = []
+    for text in sentences:
+        if is_korean_text(text):
+            text = normalize_number(text)
+            # 한글을 자소 단위로 쪼갠다.
+            text = split_to_jamo(text, hparams.cleaners)
+        texts.append(text)
+
+    # Synthesize sentences by batches, with a single decoder run for every batch
+    n = hparams.tacotron_synthesis_batch_size
     with open(os.path.join(eval_dir, 'map.txt'), 'w') as file:
-        for i, text in enumerate(tqdm(sentences)):
-            if is_korean_text(text):
-                text = normalize_number(text)
-                # 한글을 자소 단위로 쪼갠다.
-                text = split_to_jamo(text, hparams.cleaners)
-            mel_filename = synth.synthesize(text, i + 1, eval_dir, log_dir, None)
-
-            file.write('{}|{}\n'.format(text, mel_filename))
+        for i in tqdm(range(0, len(texts), n)):
+            batch = texts[i: i + n]
+            mel_filenames = synth.synthesize_batch_to_files(batch, range(i + 1, i + 1 + len(batch)), eval_dir, log_dir)
+
+            for text, mel_filename in zip(batch, mel_filenames):
+                file.write('{}|{}\n'.format(text, mel_filename))
     log('synthesized mel spectrograms at {}'.format(eval_dir))
     return eval_dir
 
@@ -82,8 +100,7 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
 
     metadata_filename = os.path.join(args.base_dir, args.input_dir, 'train.txt')
     log(hparams_debug_string())
-    synth = Synthesizer()
-    synth.load(checkpoint_path, hparams, gta=GTA)
+    synth = load_synthesizer(checkpoint_path, hparams, gta=GTA)
     with open(metadata_filename, encoding='utf-8') as f:
         metadata = [line.strip().split('|') for line in f]
         frame_shift_ms = hparams.hop_size / hparams.sample_rate
@@ -108,24 +125,28 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
 def tacotron_synthesize(args, hparams, checkpoint, sentences=None):
     output_dir = 'tacotron_' + args.output_dir
 
-    try:
-        checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
-        log('loaded model at {}'.format(checkpoint_path))
-    except AttributeError:
-        # Swap logs dir name in case user used Tacotron-2 for train and Both for test (and vice versa)
-        if 'Both' in checkpoint:
-            checkpoint = checkpoint.replace('Both', 'Tacotron-2')
-        elif 'Tacotron-2' in checkpoint:
-            checkpoint = checkpoint.replace('Tacotron-2', 'Both')
-        else:
-            raise AssertionError('Cannot restore checkpoint: {}, did you train a model?'.format(checkpoint))
-
+    if checkpoint.endswith('.pb'):
+        # Frozen graph exported by export.py
+        checkpoint_path = checkpoint
+    else:
         try:
-            # Try loading again
             checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
             log('loaded model at {}'.format(checkpoint_path))
-        except:
-            raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
+        except AttributeError:
+            # Swap logs dir name in case user used Tacotron-2 for train and Both for test (and vice versa)
+            if 'Both' in checkpoint:
+                checkpoint = checkpoint.replace('Both', 'Tacotron-2')
+            elif 'Tacotron-2' in checkpoint:
+                checkpoint = checkpoint.replace('Tacotron-2', 'Both')
+            else:
+                raise AssertionError('Cannot restore checkpoint: {}, did you train a model?'.format(checkpoint))
+
+            try:
+                # Try loading again
+                checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
+                log('loaded model at {}'.format(checkpoint_path))
+            except:
+                raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
 
     if args.mode == 'eval':
         return run_eval(args, checkpoint_path, output_dir, hparams, sentences)
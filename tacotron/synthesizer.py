@@ -2,43 +2,72 @@ import os
 import numpy as np
 import tensorflow as tf
 from tacotron.models import create_model
-from tacotron.utils.text import text_to_sequence
+from tacotron.utils.text import text_to_sequence, arpabet_text
 from tacotron.utils import plot
 from datasets import audio
-import pyaudio
-import wave
 from infolog import log
 from tacotron.utils.text_kr import j2h
 
 
 class Synthesizer:
-    def load(self, checkpoint_path, hparams, gta=False, model_name='Tacotron'):
+    def load(self, checkpoint_path, hparams, gta=False, model_name='Tacotron', session_config=None):
         log('Constructing model: %s' % model_name)
-        inputs = tf.placeholder(tf.int32, [1, None], 'inputs')
-        input_lengths = tf.placeholder(tf.int32, [1], 'input_lengths')
-        targets = tf.placeholder(tf.float32, [1, None, hparams.num_mels], 'mel_targets')
+        inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+        input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+        targets = tf.placeholder(tf.float32, [None, None, hparams.num_mels], 'mel_targets')
         with tf.variable_scope('model') as scope:
-            self.model = create_model(model_name, hparams)
+            # Padded steps of a batch are masked, so a sentence comes out the same alone or batched with others
+            self.model = create_model(model_name, synthesis_hparams(hparams))
             if gta:
                 self.model.initialize(inputs, input_lengths, targets, gta=gta)
             else:
                 self.model.initialize(inputs, input_lengths)
             self.mel_outputs = self.model.mel_outputs
             self.alignment = self.model.alignments[0]
+            self.alignments = self.model.alignments
+            self.stop_token_prediction = self.model.stop_token_prediction
+            if hparams.predict_linear and not gta:
+                self.linear_outputs = self.model.linear_outputs
+
+        # mel -> wav inversion fetched in the same session.run as the mels
+        self.wav_outputs = audio.inv_mel_spectrogram_tensorflow(
+            self.mel_outputs, hparams) if hparams.griffin_lim_in_graph else None
 
         self.gta = gta
         self._hparams = hparams
 
         log('Loading checkpoint: %s' % checkpoint_path)
-        self.session = tf.Session()
+        self.session = tf.Session(config=session_config)
         self.session.run(tf.global_variables_initializer())
         saver = tf.train.Saver()
         saver.restore(self.session, checkpoint_path)
 
+    def load_frozen(self, frozen_path, hparams, session_config=None):
+        '''Loads a graph exported by export.py (no model construction nor checkpoint restore)'''
+        from export import load_frozen_graph, frozen_tensors
+
+        log('Loading frozen graph: %s' % frozen_path)
+        graph = load_frozen_graph(frozen_path)
+        self.model = frozen_tensors(graph, ['inputs', 'input_lengths', 'alignments', 'linear_outputs'])
+        outputs = frozen_tensors(graph, ['mel_outputs', 'stop_token_prediction', 'wav_outputs'])
+        self.mel_outputs = outputs.mel_outputs
+        self.stop_token_prediction = outputs.stop_token_prediction
+        self.wav_outputs = outputs.wav_outputs
+        self.alignments = self.model.alignments
+        with graph.as_default():
+            self.alignment = self.alignments[0]
+        self.linear_outputs = self.model.linear_outputs
+        if self.linear_outputs is None and hparams.predict_linear:
+            raise ValueError('{} was exported without linear outputs, set predict_linear=False'.format(frozen_path))
+
+        self.gta = False
+        self._hparams = hparams
+        self.session = tf.Session(graph=graph, config=session_config)
+
     def synthesize(self, text, index, out_dir, log_dir, mel_filename):
         hparams = self._hparams
         cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
-        seq = text_to_sequence(text, cleaner_names)
+        seq = text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names)
         feed_dict = {
             self.model.inputs: [np.asarray(seq, dtype=np.int32)],
             self.model.input_lengths: np.asarray([len(seq)], dtype=np.int32),
@@ -47,39 +76,106 @@ class Synthesizer:
         if self.gta:
             feed_dict[self.model.mel_targets] = np.load(mel_filename).reshape(1, -1, 80)
 
+        need_wav = index is None or log_dir is not None
         if self.gta or not hparams.predict_linear:
-            mels, alignment = self.session.run([self.mel_outputs, self.alignment], feed_dict=feed_dict)
+            (mels, alignment), wav = self._run([self.mel_outputs, self.alignment], feed_dict, need_wav)
 
         else:
-            linear, mels, alignment = self.session.run([self.linear_outputs, self.mel_outputs, self.alignment],
-                                                       feed_dict=feed_dict)
+            (linear, mels, alignment), wav = self._run([self.linear_outputs, self.mel_outputs, self.alignment],
+                                                       feed_dict, need_wav)
             linear = linear.reshape(-1, hparams.num_freq)
 
         mels = mels.reshape(-1, hparams.num_mels)  # Thanks to @imdatsolak for pointing this out
+        if self.gta or not hparams.predict_linear:
+            linear = None
 
         if index is None:
-            # Generate wav and read it
-            wav = audio.inv_mel_spectrogram(mels.T, hparams)
-            audio.save_wav(wav, 'temp.wav', sr=hparams.sample_rate)  # Find a better way
-
-            chunk = 512
-            f = wave.open('temp.wav', 'rb')
-            p = pyaudio.PyAudio()
-            stream = p.open(format=p.get_format_from_width(f.getsampwidth()),
-                            channels=f.getnchannels(),
-                            rate=f.getframerate(),
-                            output=True)
-            data = f.readframes(chunk)
-            while data:
-                stream.write(data)
-                data = f.readframes(chunk)
-
-            stream.stop_stream()
-            stream.close()
-
-            p.terminate()
+            # Generate wav and play it
+            if wav is None:
+                wav = audio.inv_mel_spectrogram(mels.T, hparams)
+            audio.play_wav(wav, hparams.sample_rate)
             return
 
+        return self._save_outputs(text, index, out_dir, log_dir, mels, alignment, linear, wav)
+
+    def synthesize_batch(self, texts, alignments=False):
+        """Synthesizes a batch of texts with a single decoder run
+
+        Sequences are padded to the longest one and every output is cut after its own <stop_token>.
+
+        Args:
+            - texts: list of (already normalized) texts
+            - alignments: Optional, also return the alignment of every text
+        Returns:
+            - list of mel spectrograms [frames, num_mels] (and list of alignments [input_length, decoder_steps])
+        """
+        mels, alignment, _, _ = self._run_batch(texts, alignments)
+        return (mels, alignment) if alignments else mels
+
+    def synthesize_batch_to_files(self, texts, indices, out_dir, log_dir):
+        """Synthesizes a batch of texts and writes every output as synthesize() does
+
+        Returns:
+            - list of the mel spectrogram file names
+        """
+        mels, alignments, linears, wavs = self._run_batch(texts, log_dir is not None, log_dir is not None)
+        alignments = alignments or [None] * len(texts)
+        linears = linears or [None] * len(texts)
+        wavs = wavs or [None] * len(texts)
+        return [self._save_outputs(*outputs) for outputs in zip(
+            texts, indices, [out_dir] * len(texts), [log_dir] * len(texts), mels, alignments, linears, wavs)]
+
+    def _run(self, fetches, feed_dict, wav):
+        '''Runs fetches and, if wav is True and the in graph vocoder was built, the waveforms in the same run
+        '''
+        if wav and self.wav_outputs is not None:
+            outputs = self.session.run(fetches + [self.wav_outputs], feed_dict=feed_dict)
+            return outputs[:-1], outputs[-1][0]
+        return self.session.run(fetches, feed_dict=feed_dict), None
+
+    def _run_batch(self, texts, alignments, wavs=False):
+        hparams = self._hparams
+        cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
+        seqs = [text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names) for text in texts]
+        input_lengths = np.asarray([len(seq) for seq in seqs], dtype=np.int32)
+        # Pad sequences with the <pad_token> 0
+        inputs = np.zeros((len(seqs), input_lengths.max()), dtype=np.int32)
+        for i, seq in enumerate(seqs):
+            inputs[i, :len(seq)] = seq
+        feed_dict = {
+            self.model.inputs: inputs,
+            self.model.input_lengths: input_lengths,
+        }
+
+        predict_linear = hparams.predict_linear and not self.gta
+        fetches = [self.mel_outputs, self.stop_token_prediction]
+        if alignments:
+            fetches.append(self.alignments)
+        if predict_linear:
+            fetches.append(self.linear_outputs)
+        fetch_wavs = wavs and self.wav_outputs is not None
+        if fetch_wavs:
+            fetches.append(self.wav_outputs)
+        outputs = self.session.run(fetches, feed_dict=feed_dict)
+        lengths = [output_length(stop_tokens, hparams) for stop_tokens in outputs[1]]
+
+        wavs = None
+        if fetch_wavs:
+            hop_size = audio.get_hop_size(hparams)
+            wavs = [wav[:length * hop_size] for wav, length in zip(outputs.pop(), lengths)]
+
+        mels = [mel[:length] for mel, length in zip(outputs[0], lengths)]
+        alignment = None
+        if alignments:
+            r = hparams.outputs_per_step
+            alignment = [a[:input_length, :length // r] for a, input_length, length in
+                         zip(outputs[2], input_lengths, lengths)]
+        linears = [linear[:length] for linear, length in zip(outputs[-1], lengths)] if predict_linear else None
+        return mels, alignment, linears, wavs
+
+    def _save_outputs(self, text, index, out_dir, log_dir, mels, alignment, linear, wav=None):
+        hparams = self._hparams
+
         # Write the spectrogram to disk
         # Note: outputs mel-spectrogram files and target ones have same names, just different folders
         mel_filename = os.path.join(out_dir, 'speech-mel-{:05d}.npy'.format(index))
@@ -87,11 +183,12 @@ class Synthesizer:
 
         if log_dir is not None:
             # save wav (mel -> wav)
-            wav = audio.inv_mel_spectrogram(mels.T, hparams)
+            if wav is None:
+                wav = audio.inv_mel_spectrogram(mels.T, hparams)
             audio.save_wav(wav, os.path.join(log_dir, 'wavs/speech-wav-{:05d}-mel.wav'.format(index)),
                            sr=hparams.sample_rate)
 
-            if hparams.predict_linear:
+            if linear is not None:
                 # save wav (linear -> wav)
                 wav = audio.inv_linear_spectrogram(linear.T, hparams)
                 audio.save_wav(wav, os.path.join(log_dir, 'wavs/speech-wav-{:05d}-linear.wav'.format(index)),
@@ -109,20 +206,45 @@ class Synthesizer:
 
         return mel_filename
 
-    def predict(self, text, out_dir):
+    def synthesize_wav(self, text):
+        '''Synthesizes a (normalized) text to a float32 waveform, without writing any file
+        '''
         hparams = self._hparams
         cleaner_names = [x.strip() for x in hparams.cleaners.split(',')]
-        seq = text_to_sequence(text, cleaner_names)
+        seq = text_to_sequence(arpabet_text(text, hparams.cmudict_path), cleaner_names)
         feed_dict = {
             self.model.inputs: [np.asarray(seq, dtype=np.int32)],
             self.model.input_lengths: np.asarray([len(seq)], dtype=np.int32),
         }
 
-        mels, alignment = self.session.run([self.mel_outputs, self.alignment], feed_dict=feed_dict)
-        mels = mels.reshape(-1, hparams.num_mels)  # Thanks to @imdatsolak for pointing this out
-
-        # Generate wav and read it
-        wav = audio.inv_mel_spectrogram(mels.T, hparams)
-        audio.save_wav(wav, out_dir, sr=hparams.sample_rate)  # Find a better way
-
-        return out_dir
+        (mels,), wav = self._run([self.mel_outputs], feed_dict, True)
+        if wav is None:
+            wav = audio.inv_mel_spectrogram(mels.reshape(-1, hparams.num_mels).T, hparams)
+        return wav
+
+    def predict(self, text, out_path=None):
+        '''Returns the wav file content (bytes) of a text, also written to out_path if given
+        '''
+        data = audio.to_wav_bytes(self.synthesize_wav(text), self._hparams.sample_rate)
+        if out_path is not None:
+            with open(out_path, 'wb') as f:
+                f.write(data)
+        return data
+
+
+def synthesis_hparams(hparams):
+    '''Copy of hparams with encoder masking (without effect on a batch of one) to build an inference model
+    '''
+    model_hparams = tf.contrib.training.HParams(**hparams.values())
+    model_hparams.set_hparam('mask_encoder', True)
+    return model_hparams
+
+
+def output_length(stop_tokens, hparams):
+    '''Number of frames decoded up to the <stop_token> of a batch entry, as if it was synthesized alone
+    '''
+    r = hparams.outputs_per_step
+    finished = stop_tokens.reshape(-1, r) > 0.5
+    finished = finished.any(axis=1) if hparams.stop_at_any else finished.all(axis=1)
+    steps = np.flatnonzero(finished)
+    return len(stop_tokens) if len(steps) == 0 else (steps[0] + 1) * r
@@ -17,8 +17,8 @@ from .numbers import normalize_numbers
 # Regular expression matching whitespace:
 _whitespace_re = re.compile(r'\s+')
 
-# List of (regular expression, replacement) pairs for abbreviations:
-_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in [
+# Abbreviations and their expansion, matched by a single regular expression:
+_abbreviations = dict([
     ('mrs', 'misess'),
     ('mr', 'mister'),
     ('dr', 'doctor'),
@@ -37,13 +37,29 @@ _abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in
     ('ltd', 'limited'),
     ('col', 'colonel'),
     ('ft', 'fort'),
-]]
+])
+_abbreviations_re = re.compile('\\b(%s)\\.' % '|'.join(_abbreviations), re.IGNORECASE)
+_abbreviations_order = {name: i for i, name in enumerate(_abbreviations)}
 
 
 def expand_abbreviations(text):
-    for regex, replacement in _abbreviations:
-        text = re.sub(regex, replacement, text)
-    return text
+    # Same output as expanding the abbreviations one after the other: an abbreviation right after one expanded
+    # before it (earlier in the list) has lost its word boundary and is kept
+    parts = []
+    position, last_end, last_order = 0, -1, None
+    for m in _abbreviations_re.finditer(text):
+        name = m.group(1).lower()
+        order = _abbreviations_order[name]
+        if m.start() == last_end and last_order is not None and last_order < order:
+            last_order = None
+        else:
+            parts.append(text[position:m.start()])
+            parts.append(_abbreviations[name])
+            position = m.end()
+            last_order = order
+        last_end = m.end()
+    parts.append(text[position:])
+    return ''.join(parts)
 
 
 def expand_numbers(text):
@@ -57,7 +73,7 @@ def lowercase(text):
 
 
 def collapse_whitespace(text):
-    return re.sub(_whitespace_re, ' ', text)
+    return _whitespace_re.sub(' ', text)
 
 
 def convert_to_ascii(text):
@@ -1,3 +1,6 @@
+import array
+import mmap
+import os
 import re
 
 
@@ -25,6 +28,7 @@ class CMUDict:
     if not keep_ambiguous:
       entries = {word: pron for word, pron in entries.items() if len(pron) == 1}
     self._entries = entries
+    self._arpabet_memo = {}
 
 
   def __len__(self):
@@ -36,6 +40,147 @@ class CMUDict:
     return self._entries.get(word.upper())
 
 
+  def to_arpabet(self, text):
+    return _to_arpabet(self.lookup, self._arpabet_memo, text)
+
+
+
+class CMUDictIndex:
+  '''CMUDict read from a binary index written by build_index(), with the same interface as CMUDict.
+
+  The index is memory-mapped (and shared through the page cache by the processes that open it), a word is
+  looked up by binary search: opening it does not parse nor copy the dictionary.
+  '''
+  def __init__(self, path, keep_ambiguous=True):
+    with open(path, 'rb') as f:
+      self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._map[:len(_index_magic)] != _index_magic:
+      raise ValueError('{} is not a CMUDict index'.format(path))
+    count = memoryview(self._map)[_count_offset:_offsets_offset].cast('I')[0]
+    self._offsets = memoryview(self._map)[_offsets_offset:_offsets_offset + 4 * (count + 1)].cast('I')
+    self._data_offset = _offsets_offset + 4 * (count + 1)
+    self._count = count
+    self._keep_ambiguous = keep_ambiguous
+    self._len = count if keep_ambiguous else None
+    self._arpabet_memo = {}
+
+
+  def __len__(self):
+    if self._len is None:
+      self._len = sum(1 for i in range(self._count) if len(self._entry(i)) == 2)
+    return self._len
+
+
+  def lookup(self, word):
+    '''Returns list of ARPAbet pronunciations of the given word.'''
+    try:
+      key = word.upper().encode('latin-1')
+    except UnicodeEncodeError:
+      return None
+    low, high = 0, self._count
+    while low < high:
+      middle = (low + high) // 2
+      if self._word(middle) < key:
+        low = middle + 1
+      else:
+        high = middle
+    if low == self._count or self._word(low) != key:
+      return None
+    pronunciations = self._entry(low)[1:]
+    if not self._keep_ambiguous and len(pronunciations) > 1:
+      return None
+    return pronunciations
+
+
+  def to_arpabet(self, text):
+    return _to_arpabet(self.lookup, self._arpabet_memo, text)
+
+
+  def _word(self, i):
+    start = self._data_offset + self._offsets[i]
+    return self._map[start:self._map.find(b'\t', start)]
+
+
+  def _entry(self, i):
+    start = self._data_offset
+    return self._map[start + self._offsets[i]:start + self._offsets[i + 1]].decode('latin-1').split('\t')
+
+
+
+# Index layout: magic, entry count (uint32), entry offsets (uint32, count + 1, relative to the entries) and the
+# entries, sorted by word: "WORD\tPRONUNCIATION[\tPRONUNCIATION...]" (latin-1). Integers are in the byte order
+# of the machine that builds the index.
+_index_magic = b'CMUIDX1\n'
+_count_offset = len(_index_magic)
+_offsets_offset = _count_offset + 4
+
+
+def build_index(file_or_path, index_path):
+  '''Writes the entries of a CMUDict text file to a binary index for CMUDictIndex'''
+  if isinstance(file_or_path, str):
+    with open(file_or_path, encoding='latin-1') as f:
+      entries = _parse_cmudict(f)
+  else:
+    entries = _parse_cmudict(file_or_path)
+
+  # Code point order of the words is the byte order of their latin-1 encoding, which lookup() compares
+  data = ['\t'.join([word] + entries[word]).encode('latin-1') for word in sorted(entries)]
+  offsets = [0]
+  for entry in data:
+    offsets.append(offsets[-1] + len(entry))
+
+  # Written next to the index and renamed, processes opening it meanwhile never see a partial file
+  tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    f.write(_index_magic)
+    f.write(array.array('I', [len(data)] + offsets).tobytes())
+    f.write(b''.join(data))
+  os.replace(tmp_path, index_path)
+
+
+def load(path, keep_ambiguous=True):
+  '''CMUDict of a binary index, or of a text file: its index (<path>.idx) is built on first use and reused
+  while it is newer than the text file. The text file is parsed if the index can not be written.'''
+  with open(path, 'rb') as f:
+    is_index = f.read(len(_index_magic)) == _index_magic
+  if is_index:
+    return CMUDictIndex(path, keep_ambiguous)
+
+  index_path = path + '.idx'
+  try:
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path):
+      build_index(path, index_path)
+  except OSError:
+    return CMUDict(path, keep_ambiguous)
+  return CMUDictIndex(index_path, keep_ambiguous)
+
+
+# Words replaced by to_arpabet, and the {ARPAbet} spans already in the text (kept as is)
+_arpabet_word_re = re.compile(r"\{[^}]*\}|[A-Za-z]+(?:'[A-Za-z]+)*")
+
+# Number of words whose replacement is memoized by each dictionary
+_arpabet_memo_size = 100000
+
+
+def _to_arpabet(lookup, memo, text):
+  '''Replaces the words of a text found in the dictionary by their first pronunciation in curly braces
+  ("{HH AH0 L OW1}"), for text_to_sequence. Replacements are memoized per word.'''
+  def replace(m):
+    word = m.group()
+    arpabet = memo.get(word)
+    if arpabet is None:
+      if word[0] == '{':
+        return word
+      pronunciations = lookup(word)
+      arpabet = '{%s}' % pronunciations[0] if pronunciations else word
+      if len(memo) >= _arpabet_memo_size:
+        memo.clear()
+      memo[word] = arpabet
+    return arpabet
+
+  return _arpabet_word_re.sub(replace, text)
+
+
 
 _alt_re = re.compile(r'\([0-9]+\)')
 
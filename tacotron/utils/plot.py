@@ -1,24 +1,31 @@
-import matplotlib
-
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.font_manager as font_manager
-from matplotlib.pyplot import rc
 import numpy as np
 
 
 FONT_NAME = "NanumBarunGothic"
 
+_plt = None
+
 
 def check_font():
+    import matplotlib.font_manager as font_manager
     flist = font_manager.findSystemFonts()
     names = [font_manager.FontProperties(fname=fname).get_name() for fname in flist]
     if not (FONT_NAME in names):
         font_manager._rebuild()
 
 
-check_font()
-rc('font', family=FONT_NAME)
+def pyplot():
+    '''matplotlib.pyplot with the Agg backend (no display needed) and the korean font, set up on first use
+    '''
+    global _plt
+    if _plt is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        check_font()
+        plt.rc('font', family=FONT_NAME)
+        _plt = plt
+    return _plt
 
 
 def split_title_line(title_text, max_words=5):
@@ -31,6 +38,7 @@ def split_title_line(title_text, max_words=5):
 
 
 def plot_alignment(alignment, path, info=None, split_title=False, max_len=None):
+    plt = pyplot()
     if max_len is not None:
         alignment = alignment[:, :max_len]
 
@@ -63,6 +71,7 @@ def plot_spectrogram(pred_spectrogram,
                      target_spectrogram=None,
                      max_len=None,
                      head=None):
+    plt = pyplot()
     if max_len is not None:
         target_spectrogram = target_spectrogram[:max_len]
         pred_spectrogram = pred_spectrogram[:max_len]
@@ -0,0 +1,85 @@
+import numpy as np
+from infolog import log
+
+
+def bucket_boundaries(lengths, num_buckets=10):
+    """Length boundaries splitting the examples into buckets of about the same size"""
+    boundaries = np.unique(np.percentile(lengths, np.linspace(0, 100, num_buckets + 1)[1:-1]).astype(np.int64))
+    return [int(b) for b in boundaries if b > 0] or [max(lengths) + 1]
+
+
+def padding_efficiency(batches, length_fn):
+    """Ratio of useful frames over padded frames (batch size * longest example) of a list of batches"""
+    useful, padded = 0, 0
+    for batch in batches:
+        lengths = [length_fn(x) for x in batch]
+        useful += sum(lengths)
+        padded += len(lengths) * max(lengths)
+    return useful / max(padded, 1)
+
+
+class BucketSampler:
+    """
+        Yields batches of metadata bucketed by length over the entire training set.
+
+        Every epoch, the examples of each bucket (lengths in [boundaries[i-1], boundaries[i]) ) are shuffled
+        and cut into batches, then the batches of all buckets are shuffled together, so that batches hold
+        examples of similar lengths while their order stays random.
+
+        With max_frames, batches are not cut at batch_size examples but packed with as many examples as fit
+        in max_frames padded frames (batch size * longest example), so short examples make larger batches.
+    """
+
+    def __init__(self, metadata, batch_size, boundaries=None, num_buckets=10, max_frames=None,
+                 length_fn=lambda x: int(x[4])):
+        self._metadata = metadata
+        self._batch_size = batch_size
+        self._max_frames = max_frames
+        self._length_fn = length_fn
+
+        lengths = [length_fn(x) for x in metadata]
+        self.boundaries = sorted(boundaries) if boundaries else bucket_boundaries(lengths, num_buckets)
+        self._buckets = [[] for _ in range(len(self.boundaries) + 1)]
+        for meta, bucket in zip(metadata, np.searchsorted(self.boundaries, lengths, side='right')):
+            self._buckets[bucket].append(meta)
+        self._epoch = 0
+        self._batches = []
+
+    def epoch_batches(self):
+        """Shuffled batches of one epoch over the whole metadata"""
+        batches = []
+        for bucket in self._buckets:
+            np.random.shuffle(bucket)
+            if self._max_frames is None:
+                batches.extend(bucket[i: i + self._batch_size] for i in range(0, len(bucket), self._batch_size))
+            else:
+                batches.extend(self._pack(bucket))
+        np.random.shuffle(batches)
+        return batches
+
+    def _pack(self, bucket):
+        batches, batch, longest = [], [], 0
+        for meta in bucket:
+            length = self._length_fn(meta)
+            # An example longer than the budget still makes a batch of its own
+            if batch and (len(batch) + 1) * max(longest, length) > self._max_frames:
+                batches.append(batch)
+                batch, longest = [], 0
+            batch.append(meta)
+            longest = max(longest, length)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def next_batch(self):
+        if not self._batches:
+            self._batches = self.epoch_batches()
+            self._epoch += 1
+            log('Epoch {}: {} train batches ({:.1f} examples on average) in {} buckets, padding efficiency {:.2f}%'.format(
+                self._epoch, len(self._batches), len(self._metadata) / max(len(self._batches), 1), len(self._buckets),
+                100 * padding_efficiency(self._batches, self._length_fn)))
+        return self._batches.pop()
+
+    def __iter__(self):
+        while True:
+            yield self.next_batch()
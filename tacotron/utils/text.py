@@ -1,6 +1,16 @@
+import hashlib
+import json
+import os
 import re
-from . import cleaners
+from functools import lru_cache
+import numpy as np
+from . import cleaners, cmudict
 from .symbols import symbols
+from .text_kr import split_to_jamo, is_korean_text, normalize_number
+
+# Version of the text to symbol IDs pipeline, to bump when the cleaners or the korean normalization change
+# (sequences precomputed by preprocessing are only used if their version matches)
+_pipeline_version = 1
 
 # Mappings from symbol to numeric ID and vice versa:
 _symbol_to_id = {s: i for i, s in enumerate(symbols)}
@@ -9,6 +19,15 @@ _id_to_symbol = {i: s for i, s in enumerate(symbols)}
 # Regular expression matching text enclosed in curly braces:
 _curly_re = re.compile(r'(.*?)\{(.+?)\}(.*)')
 
+# Symbol ID of every character code (-1 for characters that are not kept), to encode a text in one numpy lookup
+_char_ids = np.full(max(ord(s) for s in _symbol_to_id if len(s) == 1) + 1, -1, dtype=np.int32)
+for _symbol, _id in _symbol_to_id.items():
+    if len(_symbol) == 1 and _symbol not in '_~':
+        _char_ids[ord(_symbol)] = _id
+
+# Number of texts whose sequence is kept (synthesis requests often repeat)
+_sequence_cache_size = 4096
+
 
 def text_to_sequence(text, cleaner_names):
     '''Converts a string of text to a sequence of IDs corresponding to the symbols in the text.
@@ -23,21 +42,59 @@ def text_to_sequence(text, cleaner_names):
       Returns:
         List of integers corresponding to the symbols in the text
     '''
+    return list(_cached_sequence(text, tuple(cleaner_names)))
+
+
+@lru_cache(maxsize=_sequence_cache_size)
+def _cached_sequence(text, cleaner_names):
     sequence = []
 
     # Check for curly braces and treat their contents as ARPAbet:
     while len(text):
         m = _curly_re.match(text)
         if not m:
-            sequence += _symbols_to_sequence(_clean_text(text, cleaner_names))
+            sequence += _text_to_sequence(_clean_text(text, cleaner_names))
             break
-        sequence += _symbols_to_sequence(_clean_text(m.group(1), cleaner_names))
+        sequence += _text_to_sequence(_clean_text(m.group(1), cleaner_names))
         sequence += _arpabet_to_sequence(m.group(2))
         text = m.group(3)
 
     # Append EOS token
     sequence.append(_symbol_to_id['~'])
-    return sequence
+    return tuple(sequence)
+
+
+def training_sequence(text, cleaner_names, cmudict_path=None):
+    '''Symbol IDs of a training transcript: korean text is number normalized and split to jamo first, words
+    found in the pronunciation dictionary at cmudict_path (if any) are fed as ARPAbet'''
+    if is_korean_text(text):
+        text = normalize_number(text)
+        # 한글을 자소 단위로 쪼갠다.
+        text = split_to_jamo(text, cleaner_names)
+    return text_to_sequence(arpabet_text(text, cmudict_path), cleaner_names)
+
+
+def sequence_version(cleaner_names, cmudict_path=None):
+    '''Tag of the symbol IDs training_sequence() produces (pipeline version, cleaners, symbol set and dictionary)'''
+    content = [_pipeline_version, list(cleaner_names), symbols]
+    if cmudict_path:
+        content.append([os.path.basename(cmudict_path), len(_cmudict(cmudict_path))])
+    content = json.dumps(content, ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def arpabet_text(text, cmudict_path):
+    '''Replaces the words of text found in the CMUDict at cmudict_path (a text file or a binary index) by their
+    {ARPAbet} pronunciation. The text is returned as is without dictionary.'''
+    if not cmudict_path:
+        return text
+    return _cmudict(cmudict_path).to_arpabet(text)
+
+
+@lru_cache(maxsize=None)
+def _cmudict(path):
+    # Opened once per process (the binary index is memory-mapped, not parsed)
+    return cmudict.load(path)
 
 
 def sequence_to_text(sequence):
@@ -58,12 +115,28 @@ def cleaners_text(text, cleaner_names):
 
 
 def _clean_text(text, cleaner_names):
+    for cleaner in _cleaners(tuple(cleaner_names)):
+        text = cleaner(text)
+    return text
+
+
+@lru_cache(maxsize=None)
+def _cleaners(cleaner_names):
+    '''Cleaner functions of a chain of cleaner names, looked up once'''
+    functions = []
     for name in cleaner_names:
-        cleaner = getattr(cleaners, name)
+        cleaner = getattr(cleaners, name, None)
         if not cleaner:
             raise Exception('Unknown cleaner: %s' % name)
-        text = cleaner(text)
-    return text
+        functions.append(cleaner)
+    return tuple(functions)
+
+
+def _text_to_sequence(text):
+    # Character codes -> symbol IDs, characters out of the table or not kept are dropped
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    ids = _char_ids[codes[codes < len(_char_ids)]]
+    return ids[ids >= 0].tolist()
 
 
 def _symbols_to_sequence(symbols):
@@ -75,4 +148,4 @@ def _arpabet_to_sequence(text):
 
 
 def _should_keep_symbol(s):
-    return s in _symbol_to_id and s is not '_' and s is not '~'
+    return s in _symbol_to_id and s != '_' and s != '~'
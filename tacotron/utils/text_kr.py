@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import re
 import ast
+from functools import lru_cache
 
 """
     초성 중성 종성 분리 하기
@@ -62,62 +63,58 @@ def split_to_jamo(text, cleaners):
         return text
 
 
+_chosung_index = {c: i for i, c in enumerate(CHOSUNG_LIST)}
+_jungsung_index = {c: i for i, c in enumerate(JUNGSUNG_LIST)}
+_jongsung_index = {c: i for i, c in enumerate(JONGSUNG_LIST)}
+
+# Syllable -> jamo translation table over the 11,172 syllables (가-힣)
+_h2j_table = {}
+for _code in range(BASE_CODE, BASE_CODE + len(CHOSUNG_LIST) * CHOSUNG):
+    _cho, _rest = divmod(_code - BASE_CODE, CHOSUNG)
+    _jung, _jong = divmod(_rest, JUNGSUNG)
+    _h2j_table[_code] = CHOSUNG_LIST[_cho] + JUNGSUNG_LIST[_jung] + (JONGSUNG_LIST[_jong] if _jong else '')
+
+# Jamo -> syllable: initial + medial (+ final followed by an initial, a symbol or the end of the text),
+# remaining jamo are dropped
+_j2h_re = re.compile('[{0}][{1}](?:[{2}](?=[{3}]|\\Z))?|[{4}]'.format(
+    ''.join(CHOSUNG_LIST), ''.join(JUNGSUNG_LIST), ''.join(JONGSUNG_LIST),
+    re.escape(''.join(CHOSUNG_LIST + SYMBOLS)), HANGUEL_LIST))
+_j2h_table = {c: '' for c in HANGUEL_LIST}
+for _cho in CHOSUNG_LIST:
+    for _jung in JUNGSUNG_LIST:
+        _j2h_table[_cho + _jung] = chr(BASE_CODE + _chosung_index[_cho] * CHOSUNG + _jungsung_index[_jung] * JUNGSUNG)
+        for _jong in JONGSUNG_LIST:
+            _j2h_table[_cho + _jung + _jong] = chr(ord(_j2h_table[_cho + _jung]) + _jongsung_index[_jong]) + \
+                                               (' ' if _jong == ' ' else '')
+
+
 def merge_j(jamos):
+    code = BASE_CODE + _chosung_index[jamos[0]] * CHOSUNG + _jungsung_index[jamos[1]] * JUNGSUNG
     if len(jamos) == 3:
-        code = CHOSUNG_LIST.index(jamos[0]) * CHOSUNG + \
-               JUNGSUNG_LIST.index(jamos[1]) * JUNGSUNG + \
-               JONGSUNG_LIST.index(jamos[2])
-    else:
-        code = CHOSUNG_LIST.index(jamos[0]) * CHOSUNG + \
-               JUNGSUNG_LIST.index(jamos[1]) * JUNGSUNG
-    code += BASE_CODE
+        code += _jongsung_index[jamos[2]]
     c = chr(code)
     return c + ' ' if jamos[-1] == ' ' else c
 
 
+def _merge_match(match):
+    return _j2h_table[match.group()]
+
+
 def h2j(text):
-    result = list()
-    for keyword in text:
-        # 한글 여부 check 후 분리
-        if re.match('.*[ㄱ-ㅎㅏ-ㅣ가-힣]+.*', keyword) is not None:
-            char_code = ord(keyword) - BASE_CODE
-            char1 = int(char_code / CHOSUNG)
-            result.append(CHOSUNG_LIST[char1])
-            char2 = int((char_code - (CHOSUNG * char1)) / JUNGSUNG)
-            result.append(JUNGSUNG_LIST[char2])
-            char3 = int((char_code - (CHOSUNG * char1) - (JUNGSUNG * char2)))
-            # 종성이 있는 경우
-            if char3 > 0:
-                result.append(JONGSUNG_LIST[char3])
-        else:
-            result.append(keyword)
-    # result
-    return "".join(result)
+    # 한글 음절을 자소로 분리
+    return text.translate(_h2j_table)
 
 
 def j2h(text):
-    result = list()
-    idx = 0
-    while idx < len(text):
-        c = text[idx]
-        if is_hanguel(c):
-            if c in CHOSUNG_LIST:
-                if idx + 1 < len(text) and text[idx + 1] in JUNGSUNG_LIST:
-                    if idx + 2 < len(text) and text[idx + 2] in JONGSUNG_LIST:
-                        if (idx + 3 < len(text) and text[idx + 3] in CHOSUNG_LIST + SYMBOLS) or (idx +3 == len(text)):
-                            result.append(merge_j(text[idx: idx + 3]))
-                            idx += 2
-                        else:
-                            result.append(merge_j(text[idx: idx + 2]))
-                            idx += 1
-                    else:
-                        result.append(merge_j(text[idx: idx + 2]))
-                        idx += 1
-        else:
-            result.append(c)
-        idx += 1
-
-    return ''.join(result)
+    return _j2h_re.sub(_merge_match, text)
+
+
+def h2j_batch(texts):
+    return [text.translate(_h2j_table) for text in texts]
+
+
+def j2h_batch(texts):
+    return [_j2h_re.sub(_merge_match, text) for text in texts]
 
 
 def korean_numbers(text):
@@ -208,14 +205,40 @@ def normalize_with_dictionary(text, dic):
         return text
 
 
+# Compiled once for normalize_number: the units ('m' last, after 'cm', 'mm' and 'km'), the numbers followed by a
+# counter word and the other numbers
+_unit_to_kor = dict(unit_to_kor1, **unit_to_kor2)
+_unit_re = re.compile('|'.join(re.escape(key) for key in _unit_to_kor))
+_count_re = re.compile(number_checker + count_checker)
+_number_re = re.compile(number_checker)
+_number_start_re = re.compile('[1-9]')
+_count_tenth_re = re.compile('|'.join(count_tenth_dict.keys()))
+_float_digit_re = re.compile(r'\d')
+_number_cache_size = 4096
+
+
 def normalize_number(text):
-    text = normalize_with_dictionary(text, unit_to_kor1)
-    text = normalize_with_dictionary(text, unit_to_kor2)
-    text = re.sub(number_checker + count_checker,
-            lambda x: number_to_korean(x, True), text)
-    text = re.sub(number_checker,
-            lambda x: number_to_korean(x, False), text)
-    return text
+    """Reads the units and numbers of a text in korean
+
+    Same output as replacing the units, the counted numbers ("3개") and then the remaining numbers in separate
+    passes, without scanning the replaced text again: the other numbers are read in the gaps between counted ones.
+    """
+    text = _unit_re.sub(lambda x: _unit_to_kor[x.group()], text)
+    if _number_start_re.search(text) is None:
+        return text
+
+    parts = []
+    position = 0
+    for match in _count_re.finditer(text):
+        parts.append(_number_re.sub(_read_number, text[position:match.start()]))
+        parts.append(number_to_korean(match, True))
+        position = match.end()
+    parts.append(_number_re.sub(_read_number, text[position:]))
+    return ''.join(parts)
+
+
+def _read_number(match):
+    return number_to_korean(match, False)
 
 
 def number_to_korean(num_str, is_count=False):
@@ -224,6 +247,12 @@ def number_to_korean(num_str, is_count=False):
     else:
         num_str, unit_str = num_str.group(), ""
 
+    return _number_to_korean(num_str, unit_str, is_count)
+
+
+# Years, counts and amounts come back again and again in a document: their readings are memoized
+@lru_cache(maxsize=_number_cache_size)
+def _number_to_korean(num_str, unit_str, is_count):
     num_str = num_str.replace(',', '')
     num = ast.literal_eval(num_str)
 
@@ -271,16 +300,14 @@ def number_to_korean(num_str, is_count=False):
             kor = kor[1:]
 
         if any(word in kor for word in count_tenth_dict):
-            kor = re.sub(
-                '|'.join(count_tenth_dict.keys()),
-                lambda x: count_tenth_dict[x.group()], kor)
+            kor = _count_tenth_re.sub(lambda x: count_tenth_dict[x.group()], kor)
 
     if not is_count and kor.startswith("일") and len(kor) > 1:
         kor = kor[1:]
 
     if float_str is not None:
         kor += "쩜 "
-        kor += re.sub('\d', lambda x: num_to_kor[x.group()], float_str)
+        kor += _float_digit_re.sub(lambda x: num_to_kor[x.group()], float_str)
 
     if num_str.startswith("+"):
         kor = "플러스 " + kor
@@ -290,6 +317,83 @@ def number_to_korean(num_str, is_count=False):
     return kor + unit_str
 
 
+# Sentence segmentation (rule based, a fast alternative to konlpy's Kkma().sentences)
+# A sentence ends with terminal punctuation followed by a space, or at a paragraph break. After closing
+# quotes/brackets, not when a quotative particle follows ("좋아요." 라고 말했다, “가자!” 하고). A line ending without
+# punctuation is not a boundary (lines may be wrapped anywhere, "우리 어머니\n께서"), unless a blank line follows
+_sentence_end_re = re.compile(r'[.!?…。]+(?=\s|$)'
+                              r'|[.!?…。]+["\'”’」』)\]]+(?=\s|$)(?!\s*(?:라고|하고|고|며)(?![가-힣]))'
+                              r'|\n[ \t]*\n')
+# "1. 서론" style list markers
+_list_marker_re = re.compile(r'(?:^|\s)\d{1,3}$')
+_clause_end_re = re.compile(r'(?:(?<=[,;:])|(?<=지만|는데|면서|니까|으며))\s+')
+_max_quoted_chars = 1000
+
+
+def _quote_open(text):
+    return text.count('"') % 2 == 1 or text.count('“') > text.count('”') or text.count('「') > text.count('」')
+
+
+def _split_sentences(text, final):
+    # Returns the complete sentences of text and the rest, kept when the text may still go on (not final)
+    sentences = []
+    start = 0
+    # Until the text goes on, what follows the last boundary is unknown (it may be a quotative particle)
+    tail = len(text.rstrip())
+    for match in _sentence_end_re.finditer(text):
+        end = match.end()
+        if not final and end >= tail:
+            break
+        paragraph = match.group().startswith('\n')
+        if not paragraph:
+            # (on a slice: ^ does not match at the pos of search())
+            if match.group()[0] == '.' and _list_marker_re.search(text[start:match.start()]):
+                continue
+            # No split inside a quotation (unless it is suspiciously long)
+            if _quote_open(text[start:end]) and end - start < _max_quoted_chars:
+                continue
+        sentence = ' '.join(text[start:end].split())
+        if sentence:
+            sentences.append(sentence)
+        start = end
+
+    rest = text[start:]
+    if final:
+        if rest.strip():
+            sentences.append(' '.join(rest.split()))
+        rest = ''
+    return sentences, rest
+
+
+def split_sentences(text):
+    return _split_sentences(text, True)[0]
+
+
+def iter_sentences(lines):
+    """Yields the sentences of an iterable of lines (e.g. an open file) without reading it all in memory"""
+    rest = ''
+    for line in lines:
+        sentences, rest = _split_sentences(rest + line, False)
+        for sentence in sentences:
+            yield sentence
+    for sentence in _split_sentences(rest, True)[0]:
+        yield sentence
+
+
+def split_clauses(sentence, max_chars=60):
+    """Splits a sentence longer than max_chars at commas and connective endings (-지만, -는데, ...),
+    clauses are merged back while they fit in max_chars"""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    clauses = []
+    for clause in _clause_end_re.split(sentence):
+        if clauses and len(clauses[-1]) + 1 + len(clause) <= max_chars:
+            clauses[-1] += ' ' + clause
+        elif clause:
+            clauses.append(clause)
+    return clauses
+
+
 if __name__ == '__main__':
     print(korean_numbers("대한민국 만세"))
     print(korean_numbers("올해는 2017년 이다."))
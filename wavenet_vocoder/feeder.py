@@ -6,7 +6,7 @@ import threading
 import os
 from .util import is_scalar_input, is_mulaw_quantize
 from infolog import log
-from datasets import audio
+from datasets import audio, shards
 from keras.utils import np_utils
 
 _batches_per_group = 32
@@ -32,6 +32,8 @@ class Feeder:
 
         # Base directory of the project (to map files from different locations)
         self._base_dir = base_dir
+        # Shard readers of packed feature directories, by directory
+        self._readers = {}
 
         # Load metadata
         self._data_dir = os.path.dirname(metadata_filename)
@@ -67,88 +69,155 @@ class Feeder:
         self.local_condition, self.global_condition = self._check_conditions()
 
         with tf.device('/cpu:0'):
-            # Create placeholders for inputs and targets. Don't specify batch size because we want
-            # to be able to feed different batch sizes at eval time.
-            if is_scalar_input(hparams.input_type):
-                input_placeholder = tf.placeholder(tf.float32, shape=(None, 1, None), name='audio_inputs')
-                target_placeholder = tf.placeholder(tf.float32, shape=(None, None, 1), name='audio_targets')
-                target_type = tf.float32
+            if hparams.input_pipeline == 'dataset':
+                self._build_datasets(hparams)
             else:
-                input_placeholder = tf.placeholder(tf.float32, shape=(None, hparams.quantize_channels, None),
-                                                   name='audio_inputs')
-                target_placeholder = tf.placeholder(tf.int32, shape=(None, None, 1), name='audio_targets')
-                target_type = tf.int32
-
-            self._placeholders = [
-                input_placeholder,
-                target_placeholder,
-                tf.placeholder(tf.int32, shape=(None,), name='input_lengths'),
-            ]
-
-            queue_types = [tf.float32, target_type, tf.int32]
-
-            if self.local_condition:
-                self._placeholders.append(
-                    tf.placeholder(tf.float32, shape=(None, hparams.num_mels, None), name='local_condition_features'))
-                queue_types.append(tf.float32)
-            if self.global_condition:
-                self._placeholders.append(tf.placeholder(tf.int32, shape=(), name='global_condition_features'))
-                queue_types.append(tf.int32)
-
-            # Create queue for buffering data
-            queue = tf.FIFOQueue(8, queue_types, name='intput_queue')
-            self._enqueue_op = queue.enqueue(self._placeholders)
-            variables = queue.dequeue()
-
-            self.inputs = variables[0]
-            self.inputs.set_shape(self._placeholders[0].shape)
-            self.targets = variables[1]
-            self.targets.set_shape(self._placeholders[1].shape)
-            self.input_lengths = variables[2]
-            self.input_lengths.set_shape(self._placeholders[2].shape)
-
-            # If local conditioning disabled override c inputs with None
-            if hparams.cin_channels < 0:
-                self.local_condition_features = None
-            else:
-                self.local_condition_features = variables[3]
-                self.local_condition_features.set_shape(self._placeholders[3].shape)
+                self._build_queues(hparams)
+
+    def _build_queues(self, hparams):
+        # Create placeholders for inputs and targets. Don't specify batch size because we want
+        # to be able to feed different batch sizes at eval time.
+        if is_scalar_input(hparams.input_type):
+            input_placeholder = tf.placeholder(tf.float32, shape=(None, 1, None), name='audio_inputs')
+            target_placeholder = tf.placeholder(tf.float32, shape=(None, None, 1), name='audio_targets')
+            target_type = tf.float32
+        else:
+            input_placeholder = tf.placeholder(tf.float32, shape=(None, hparams.quantize_channels, None),
+                                               name='audio_inputs')
+            target_placeholder = tf.placeholder(tf.int32, shape=(None, None, 1), name='audio_targets')
+            target_type = tf.int32
 
-            # If global conditioning disabled override g inputs with None
-            if hparams.gin_channels < 0:
-                self.global_condition_features = None
-            else:
-                self.global_condition_features = variables[4]
-                self.global_condition_features.set_shape(self._placeholders[4].shape)
-
-            # Create queue for buffering eval data
-            eval_queue = tf.FIFOQueue(1, queue_types, name='eval_queue')
-            self._eval_enqueue_op = eval_queue.enqueue(self._placeholders)
-            eval_variables = eval_queue.dequeue()
-
-            self.eval_inputs = eval_variables[0]
-            self.eval_inputs.set_shape(self._placeholders[0].shape)
-            self.eval_targets = eval_variables[1]
-            self.eval_targets.set_shape(self._placeholders[1].shape)
-            self.eval_input_lengths = eval_variables[2]
-            self.eval_input_lengths.set_shape(self._placeholders[2].shape)
-
-            # If local conditioning disabled override c inputs with None
-            if hparams.cin_channels < 0:
-                self.eval_local_condition_features = None
-            else:
-                self.eval_local_condition_features = eval_variables[3]
-                self.eval_local_condition_features.set_shape(self._placeholders[3].shape)
+        self._placeholders = [
+            input_placeholder,
+            target_placeholder,
+            tf.placeholder(tf.int32, shape=(None,), name='input_lengths'),
+        ]
 
-            # If global conditioning disabled override g inputs with None
-            if hparams.gin_channels < 0:
-                self.eval_global_condition_features = None
-            else:
-                self.eval_global_condition_features = eval_variables[4]
-                self.eval_global_condition_features.set_shape(self._placeholders[4].shape)
+        queue_types = [tf.float32, target_type, tf.int32]
+
+        if self.local_condition:
+            self._placeholders.append(
+                tf.placeholder(tf.float32, shape=(None, hparams.num_mels, None), name='local_condition_features'))
+            queue_types.append(tf.float32)
+        if self.global_condition:
+            self._placeholders.append(tf.placeholder(tf.int32, shape=(), name='global_condition_features'))
+            queue_types.append(tf.int32)
+
+        # Create queue for buffering data
+        queue = tf.FIFOQueue(8, queue_types, name='intput_queue')
+        self._enqueue_op = queue.enqueue(self._placeholders)
+        variables = queue.dequeue()
+
+        self.inputs = variables[0]
+        self.inputs.set_shape(self._placeholders[0].shape)
+        self.targets = variables[1]
+        self.targets.set_shape(self._placeholders[1].shape)
+        self.input_lengths = variables[2]
+        self.input_lengths.set_shape(self._placeholders[2].shape)
+
+        # If local conditioning disabled override c inputs with None
+        if hparams.cin_channels < 0:
+            self.local_condition_features = None
+        else:
+            self.local_condition_features = variables[3]
+            self.local_condition_features.set_shape(self._placeholders[3].shape)
+
+        # If global conditioning disabled override g inputs with None
+        if hparams.gin_channels < 0:
+            self.global_condition_features = None
+        else:
+            self.global_condition_features = variables[4]
+            self.global_condition_features.set_shape(self._placeholders[4].shape)
+
+        # Create queue for buffering eval data
+        eval_queue = tf.FIFOQueue(1, queue_types, name='eval_queue')
+        self._eval_enqueue_op = eval_queue.enqueue(self._placeholders)
+        eval_variables = eval_queue.dequeue()
+
+        self.eval_inputs = eval_variables[0]
+        self.eval_inputs.set_shape(self._placeholders[0].shape)
+        self.eval_targets = eval_variables[1]
+        self.eval_targets.set_shape(self._placeholders[1].shape)
+        self.eval_input_lengths = eval_variables[2]
+        self.eval_input_lengths.set_shape(self._placeholders[2].shape)
+
+        # If local conditioning disabled override c inputs with None
+        if hparams.cin_channels < 0:
+            self.eval_local_condition_features = None
+        else:
+            self.eval_local_condition_features = eval_variables[3]
+            self.eval_local_condition_features.set_shape(self._placeholders[3].shape)
+
+        # If global conditioning disabled override g inputs with None
+        if hparams.gin_channels < 0:
+            self.eval_global_condition_features = None
+        else:
+            self.eval_global_condition_features = eval_variables[4]
+            self.eval_global_condition_features.set_shape(self._placeholders[4].shape)
+
+    def _build_datasets(self, hparams):
+        """Builds train and eval inputs from tf.data pipelines instead of feed_dict filled queues.
+
+        Batches of metadata are loaded, cropped and padded by py_funcs in a parallel map (the random time
+        cropping of _prepare_batch works on whole batches) and prefetched by tf.data. Audio is cropped
+        to max_time_steps anyway, so batches are not bucketed by length.
+        """
+        if is_scalar_input(hparams.input_type):
+            input_channels, target_type = 1, tf.float32
+        else:
+            input_channels, target_type = hparams.quantize_channels, tf.int32
+        types = [tf.float32, target_type, tf.int32]
+        shapes = [(None, input_channels, None), (None, None, 1), (None,)]
+        if self.local_condition:
+            types.append(tf.float32)
+            shapes.append((None, hparams.num_mels, None))
+
+        def load(metas):
+            batch = tf.py_func(self._load_dataset_batch, [metas], types, stateful=False)
+            for tensor, shape in zip(batch, shapes):
+                tensor.set_shape(shape)
+            return tuple(batch)
+
+        train = tf.data.Dataset.from_generator(self._train_batch_generator, tf.string, tf.TensorShape([None, None]))
+        train = train.map(load, num_parallel_calls=hparams.wavenet_loader_workers)
+        train = train.prefetch(hparams.wavenet_prefetch_batches)
+        if hparams.dataset_prefetch_device is not None:
+            train = train.apply(tf.contrib.data.prefetch_to_device(hparams.dataset_prefetch_device))
+
+        # Test on entire test set (one sample at an evaluation step)
+        test_metas = [[_encode_meta(meta)] for meta in self._test_meta]
+        test = tf.data.Dataset.from_generator(lambda: iter(test_metas), tf.string, tf.TensorShape([None, None]))
+        test = test.map(load, num_parallel_calls=hparams.wavenet_loader_workers).repeat()
+
+        self._train_iterator = train.make_initializable_iterator()
+        self._test_iterator = test.make_initializable_iterator()
+        variables = self._train_iterator.get_next()
+        eval_variables = self._test_iterator.get_next()
+
+        self.inputs, self.targets, self.input_lengths = variables[:3]
+        self.eval_inputs, self.eval_targets, self.eval_input_lengths = eval_variables[:3]
+        self.local_condition_features = variables[3] if self.local_condition else None
+        self.eval_local_condition_features = eval_variables[3] if self.local_condition else None
+        self.global_condition_features = None
+        self.eval_global_condition_features = None
+
+    def _train_batch_generator(self):
+        n = self._hparams.wavenet_batch_size
+        while True:
+            yield [_encode_meta(self._next_train_meta()) for i in range(n)]
+
+    def _load_dataset_batch(self, metas):
+        examples = [self._load_example([x.decode('utf-8') for x in meta]) for meta in metas]
+        batch = self._prepare_batch(examples)
+        inputs, targets, input_lengths = batch[:3]
+        return (inputs, targets, np.asarray(input_lengths, dtype=np.int32)) + tuple(batch[3:])
 
     def start_threads(self, session):
         self._session = session
+        if self._hparams.input_pipeline == 'dataset':
+            session.run([self._train_iterator.initializer, self._test_iterator.initializer])
+            return
+
         thread = threading.Thread(name='background', target=self._enqueue_next_train_group)
         thread.daemon = True  # Thread will close when parent quits
         thread.start()
@@ -167,10 +236,10 @@ class Feeder:
             mel_file = meta[1]
         audio_file = meta[0]
 
-        input_data = np.load(os.path.join(self._base_dir, audio_file))
+        input_data = self._load(audio_file)
 
         if self.local_condition:
-            local_condition_features = np.load(os.path.join(self._base_dir, mel_file))
+            local_condition_features = self._load(mel_file)
         else:
             local_condition_features = None
 
@@ -220,12 +289,17 @@ class Feeder:
     def _get_next_example(self):
         '''Get a single example (input, output, len_output) from disk
         '''
+        return self._load_example(self._next_train_meta())
+
+    def _next_train_meta(self):
         if self._train_offset >= len(self._train_meta):
             self._train_offset = 0
             np.random.shuffle(self._train_meta)
         meta = self._train_meta[self._train_offset]
         self._train_offset += 1
+        return meta
 
+    def _load_example(self, meta):
         if self._hparams.train_with_GTA:
             mel_file = meta[2]
             if 'linear' in mel_file:
@@ -235,10 +309,10 @@ class Feeder:
             mel_file = meta[1]
         audio_file = meta[0]
 
-        input_data = np.load(os.path.join(self._base_dir, audio_file))
+        input_data = self._load(audio_file)
 
         if self.local_condition:
-            local_condition_features = np.load(os.path.join(self._base_dir, mel_file))
+            local_condition_features = self._load(mel_file)
         else:
             local_condition_features = None
 
@@ -313,6 +387,15 @@ class Feeder:
             g_batch = None
         return g_batch
 
+    def _load(self, filename):
+        '''Loads a feature file, from its directory shards if the directory was packed
+        '''
+        path = os.path.join(self._base_dir, filename)
+        data_dir = os.path.dirname(path)
+        if data_dir not in self._readers:
+            self._readers[data_dir] = shards.open_reader(data_dir)
+        return shards.load(self._readers[data_dir], data_dir, os.path.basename(path))
+
     def _check_conditions(self):
         local_condition = self._hparams.cin_channels > 0
         global_condition = self._hparams.gin_channels > 0
@@ -363,6 +446,10 @@ class Feeder:
         assert len(x) % len(c) == 0 and len(x) // len(c) == audio.get_hop_size(self._hparams)
 
 
+def _encode_meta(meta):
+    return [x.encode('utf-8') for x in meta]
+
+
 def _pad_inputs(x, maxlen):
     return np.pad(x, [(0, maxlen - len(x)), (0, 0)], mode='constant', constant_values=_pad)
 
@@ -16,7 +16,11 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
 	#We suppose user will provide correct folder depending on training method
 	log(hparams_debug_string())
 	synth = Synthesizer()
-	synth.load(checkpoint_path, hparams)
+	if checkpoint_path.endswith('.pb'):
+		#Frozen graph exported by export.py
+		synth.load_frozen(checkpoint_path, hparams)
+	else:
+		synth.load(checkpoint_path, hparams)
 
 	if args.model in ('Both', 'Tacotron-2'):
 		#If running all Tacotron-2, synthesize audio from evaluated mels
@@ -56,23 +60,27 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
 def wavenet_synthesize(args, hparams, checkpoint):
 	output_dir = 'wavenet_' + args.output_dir
 
-	try:
-		checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
-		log('loaded model at {}'.format(checkpoint_path))
-	except AttributeError:
-		#Swap logs dir name in case user used Tacotron-2 for train and Both for test (and vice versa)
-		if 'Both' in checkpoint:
-			checkpoint = checkpoint.replace('Both', 'Tacotron-2')
-		elif 'Tacotron-2' in checkpoint:
-			checkpoint = checkpoint.replace('Tacotron-2', 'Both')
-		else: #Synthesizing separately
-			raise AssertionError('Cannot restore checkpoint: {}, did you train a model?'.format(checkpoint))
-
+	if checkpoint.endswith('.pb'):
+		# Frozen graph exported by export.py
+		checkpoint_path = checkpoint
+	else:
 		try:
-			#Try loading again
 			checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
 			log('loaded model at {}'.format(checkpoint_path))
-		except:
-			raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
+		except AttributeError:
+			#Swap logs dir name in case user used Tacotron-2 for train and Both for test (and vice versa)
+			if 'Both' in checkpoint:
+				checkpoint = checkpoint.replace('Both', 'Tacotron-2')
+			elif 'Tacotron-2' in checkpoint:
+				checkpoint = checkpoint.replace('Tacotron-2', 'Both')
+			else: #Synthesizing separately
+				raise AssertionError('Cannot restore checkpoint: {}, did you train a model?'.format(checkpoint))
+
+			try:
+				#Try loading again
+				checkpoint_path = tf.train.get_checkpoint_state(checkpoint).model_checkpoint_path
+				log('loaded model at {}'.format(checkpoint_path))
+			except:
+				raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
 
 	run_synthesis(args, checkpoint_path, output_dir, hparams)
\ No newline at end of file
@@ -31,6 +31,20 @@ class Synthesizer:
 			self.session.run(tf.global_variables_initializer())
 			load_averaged_model(self.session, sh_saver, checkpoint_path)
 
+	def load_frozen(self, frozen_path, hparams, session_config=None):
+		'''Loads a graph exported by export.py (no model construction nor checkpoint restore)'''
+		from export import load_frozen_graph, frozen_tensors
+
+		log('Loading frozen graph: {}'.format(frozen_path))
+		self._hparams = hparams
+		graph = load_frozen_graph(frozen_path)
+		inputs = frozen_tensors(graph, ['local_condition_features', 'global_condition_features', 'synthesis_length'])
+		self.local_conditions = inputs.local_condition_features
+		self.global_conditions = inputs.global_condition_features
+		self.synthesis_length = inputs.synthesis_length
+		self.model = frozen_tensors(graph, ['y_hat'])
+		self.session = tf.Session(graph=graph, config=session_config)
+
 	def synthesize(self, mel_spectrogram, speaker_id, index, out_dir, log_dir):
 		hparams = self._hparams
 		local_cond, global_cond = self._check_conditions()
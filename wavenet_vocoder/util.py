@@ -1,7 +1,5 @@
 import numpy as np 
 import tensorflow as tf 
-import librosa.display as dsp
-import matplotlib.pyplot as plt
 
 
 def _assert_valid_input_type(s):
@@ -169,6 +167,11 @@ def sequence_mask(input_lengths, max_len=None, expand=True):
 
 
 def waveplot(path, y_hat, y_target, hparams):
+	from tacotron.utils.plot import pyplot
+	# Selects the Agg backend before librosa.display imports matplotlib
+	plt = pyplot()
+	import librosa.display as dsp
+
 	sr = hparams.sample_rate
 
 	plt.figure(figsize=(12, 4))